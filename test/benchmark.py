@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# プロトコル処理のマイクロベンチマーク (実機不要)
+#   python test/benchmark.py -o bench.json
+#   python test/benchmark.py --compare bench.json   # 前回の結果と比較
+#   python test/benchmark.py -k roundtrip           # 名前に"roundtrip"を含むものだけ
+
+import sys
+import os
+import argparse
+import contextlib
+import json
+import platform
+import statistics
+import time
+import timeit
+import logging
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from triorb_core import *
+from triorb_core.robot import RobotValueTypes, RobotValues
+from triorb_core.sim import SimulatedSerial
+
+logging.basicConfig(level=logging.ERROR)
+
+REGRESSION_THRESHOLD = 1.2  # 比較時にこの倍率以上遅くなったものを報告する
+
+
+class EchoSerial:
+    """
+    Serial port that answers every frame with itself, for measuring tx() alone.
+    An unread response is dropped by the next write.
+    """
+    timeout = 0
+
+    def __init__(self):
+        self._response = b""
+
+    @property
+    def in_waiting(self):
+        return len(self._response)
+
+    def write(self, data):
+        self._response = bytes(data)
+        return len(data)
+
+    def read(self, size=1):
+        data, self._response = self._response[:size], self._response[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self._response = b""
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def sample_value(code):
+    cls = RobotValueTypes[code]
+    if code == RobotCodes.STARTUP_SUSPENSION:
+        return RobotValues.ROBOT_STARTUP
+    if cls is TriOrbBaseState:
+        return cls(s_on=1, success=1, motor_id=1)
+    if cls is TriOrbDriveMatrix:
+        return cls(np.eye(3, dtype=np.float32))
+    return cls()
+
+
+def typical_queries():
+    return {
+        "wakeup": [[RobotCodes.STARTUP_SUSPENSION, RobotValues.ROBOT_STARTUP]],
+        "get_pos": [[RobotCodes.GET_POSE, TriOrbDrive3Pose()]],
+        "set_vel_relative": [[RobotCodes.MOVING_SPEED_RELATIVE, TriOrbDrive3Pose(0.1, 0.0, 0.0)],
+                             [RobotCodes.ACCELERATION_TIME, TriOrbDrive3Vector(500, 500, 500)],
+                             [RobotCodes.DECELERATION_TIME, TriOrbDrive3Vector(500, 500, 500)],
+                             [RobotCodes.MOVING_DRIVE_LIFE_TIME, RobotValueTypes[RobotCodes.MOVING_DRIVE_LIFE_TIME](1000)]],
+        "set_pos_relative": [[RobotCodes.TARGET_POSITION_RELATIVE, TriOrbDrive3Pose(0.5, 0.0, 90.0)],
+                             [RobotCodes.POSITION_DRIVE_STD_SPEED, RobotValueTypes[RobotCodes.POSITION_DRIVE_STD_SPEED](0.5)],
+                             [RobotCodes.POSITION_DRIVE_ROT_SPEED, RobotValueTypes[RobotCodes.POSITION_DRIVE_ROT_SPEED](1.0)]],
+        "motor_status": [[RobotCodes.OPERATING_STATUS, TriOrbBaseState(motor_id=i)] for i in (1, 2, 3)]
+                        + [[RobotCodes.POWER_SUPPLY_VOLTAGE, RobotValueTypes[RobotCodes.POWER_SUPPLY_VOLTAGE](0)]]*3,
+    }
+
+
+def make_robot(**kwargs):
+    return robot(transport=SimulatedSerial(baudrate=None), **kwargs)
+
+
+def codec_cases():
+    cases = {}
+    for code in RobotValueTypes:
+        val = sample_value(code)
+        buf = robot.to_bytes(val)
+        cases["encode." + code.name] = (lambda v=val: robot.to_bytes(v))
+        cases["decode." + code.name] = (lambda b=buf, c=code: robot.from_bytes(b, c))
+    return cases
+
+
+def tx_cases():
+    cases = {}
+    r = robot(transport=EchoSerial())
+    for name, query in typical_queries().items():
+        cases["tx." + name] = (lambda q=query: r.tx(q))
+    return cases
+
+
+def rx_cases():
+    cases = {}
+    r = make_robot()
+    ecu = r._uart.ecu
+    ecu.excited = True
+    for name, query in typical_queries().items():
+        _, expected_values, expected_size = r._build_frame(query)
+        response = ecu.feed(r._build_frame(query)[0])
+        cases["rx." + name] = (lambda b=response, v=expected_values, s=expected_size:
+                               r._parse_response(b, v, s))
+
+    # 値を返せないコードが含まれる応答 (with_not_readable_code)
+    query = [[RobotCodes.GET_POSE, TriOrbDrive3Pose()],
+             [RobotCodes.GET_LIFTER_POSITION, RobotValueTypes[RobotCodes.GET_LIFTER_POSITION]()]]
+    _, expected_values, expected_size = r._build_frame(query)
+    response = b"\x00" + RobotCodes.GET_POSE.value.to_bytes(2, "little") \
+        + RobotCodes.GET_LIFTER_POSITION.value.to_bytes(2, "little") + b"\x1e\r\n"
+    cases["rx.not_readable_code"] = (lambda: r._parse_response(response, expected_values, expected_size))
+    cases["rx.wrong_packet"] = (lambda: r._parse_response(b"\x00\r\n", expected_values, expected_size))
+    return cases
+
+
+def roundtrip_cases():
+    cases = {}
+    queries = typical_queries()
+    for mode, kwargs in [("sync", {}), ("reader", {"background_reader": True})]:
+        r = make_robot(**kwargs)
+        r.wakeup()
+        cases["roundtrip.{}.get_pos".format(mode)] = r.get_pos
+        cases["roundtrip.{}.get_motor_status".format(mode)] = r.get_motor_status
+        cases["roundtrip.{}.pipeline8".format(mode)] = (lambda r=r: r.pipeline([queries["get_pos"]]*8))
+    return cases
+
+
+def measure(func, repeat, min_time):
+    timer = timeit.Timer(func)
+    # 1回の計測がmin_time以上になるように回数を決める
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= min_time:
+            break
+        number = min(max(number*2, int(number * min_time / max(t, 1e-9))), number*10)
+    samples = [t / number] + [s / number for s in timer.repeat(repeat - 1, number)]
+    return {"number": number,
+            "min_us": min(samples) * 1e6,
+            "median_us": statistics.median(samples) * 1e6}
+
+
+def run(filters, repeat, min_time):
+    suites = [codec_cases, tx_cases, rx_cases, roundtrip_cases]
+    results = {}
+    out = sys.stdout
+    # 計測対象のprint出力は捨てる
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for suite in suites:
+            cases = suite()
+            for name, func in cases.items():
+                if filters and not any(f in name for f in filters):
+                    continue
+                results[name] = measure(func, repeat, min_time)
+                print("{:<48} {:>12.2f} us".format(name, results[name]["min_us"]), file=out)
+            del cases
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print("\n{:<48} {:>12} {:>12} {:>8}".format("name", "base [us]", "now [us]", "ratio"))
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        ratio = res["min_us"] / baseline[name]["min_us"]
+        mark = " <<" if ratio >= threshold else ""
+        print("{:<48} {:>12.2f} {:>12.2f} {:>8.2f}{}".format(
+            name, baseline[name]["min_us"], res["min_us"], ratio, mark))
+        if ratio >= threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="triorb_core protocol micro-benchmarks")
+    parser.add_argument("-o", "--output", help="save the results as JSON")
+    parser.add_argument("-k", dest="filters", action="append", default=[],
+                        help="run only benchmarks whose name contains this string (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.02, help="minimum time of one repeat [s]")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run(args.filters, args.repeat, args.min_time)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "results": results}, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print("\n{} benchmark(s) slower than {:.2f}x".format(len(regressions), args.threshold))
+            sys.exit(1)
@@ -127,9 +127,29 @@ def check_robot_vel_pos(com1):
 
 
 
+def check_robot_pose_history(com1):
+    vehicle = robot(com1)
+    vehicle.wakeup()
+    history = PoseHistory()
+
+    time.sleep(2)
+    vehicle.set_pos_relative(x=0.3, y=0.0, w=0.0, acc=1000, dec=500)
+    st = time.time()
+    while time.time() - st < 5.0:
+        history.record(vehicle)
+        time.sleep(0.02)
+
+    history.save("./res_pose_history.npy")
+    t, poses = history.resample(20.0)
+    vel = history.velocity(body=True)
+    print("max vx: {:.3f} m/s".format(abs(vel[:, 0]).max()))
+    np.savetxt("./res_pose_resampled.csv", np.column_stack([t, poses]), delimiter=",")
+
+
 if __name__ == '__main__':
     #check_robot_odom("COM32")
     #check_robot_move("COM32")
     check_robot_pos("COM32")
     #check_robot_vel_pos("COM32")
+    #check_robot_pose_history("COM32")
 
@@ -0,0 +1,541 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# 実機なしでシミュレータに対してrobotの機能を確認する
+
+import sys
+import os
+import time
+import tempfile
+import asyncio
+import dataclasses
+import numpy as np
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from triorb_core import *
+from triorb_core.sim import SimulatedECU, SimulatedSerial, PtyECU, ReplaySerial, SIM_DEFAULT_CONFIG
+from triorb_core.capture import read_capture
+from triorb_core.stream import VelocityStream
+from triorb_core.framing import FrameParser, response_length
+from triorb_core.metrics import LatencyHistogram, METRIC_QUANTILES
+from triorb_core.codec import get_type_codec
+
+formatter = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=formatter)
+
+
+def check_robot_functions(background_reader=False):
+    vehicle = robot(transport=SimulatedSerial(latency=0.002), background_reader=background_reader)
+    _tx = vehicle.tx(code_array=[[RobotCodes.STARTUP_SUSPENSION, 0x02]])
+    assert _tx == [0x00, 0x01, 0x03, 0x02, 0x0d, 0x0a]
+    assert vehicle.byteList_to_string(_tx) == '0x00 0x01 0x03 0x02 0x0d 0x0a'
+    assert vehicle.rx() == [2]
+
+    assert len(vehicle.get_motor_status(params=["state"])) == 3
+    assert vehicle.write_config({"acc": 300, "dec": 300}) == [300, 300]
+    assert vehicle.read_config(["acc", "dec"]) == [300, 300]
+
+    vehicle.set_pos_relative(x=0.2, y=0.0, w=90.0, vel_xy=1.0, vel_w=3.14)
+    assert vehicle.join(timeout=5.0)
+    pose = vehicle.get_pos()[0]
+    assert abs(pose.x - 0.2) < 1e-3 and abs(pose.w - 90.0) < 1e-3
+
+    vehicle.set_vel_relative(0.5, 0.0, 0.0)  # w=90degなのでY方向に進む
+    time.sleep(0.2)
+    vehicle.brake()
+    pose = vehicle.get_pos()[0]
+    assert pose.y > 0.05 and abs(pose.x - 0.2) < 1e-3
+
+    vehicle.set_odometry(0, 0, 0)
+    assert vehicle.get_pos()[0] == TriOrbDrive3Pose(0, 0, 0)
+    vehicle.set_lifter_move(30)
+    assert vehicle.get_lifter_pos() == [30]
+    vehicle.stop_reader()  # 無励磁にしてポートを閉じるのは__del__で行う
+    logging.info("background_reader={}: OK".format(background_reader))
+
+
+def check_join_stale_state():
+    # 指令直後にECUが前回の位置決め完了状態を返しても完了としない
+    vehicle = robot(transport=SimulatedSerial())
+    states = []
+
+    def stale_status(params, _id):
+        move = bool(states) and states.pop(0)
+        return [TriOrbBaseState(move=move, in_pos=not move, success=True, motor_id=i) for i in _id]
+    vehicle.get_motor_status = stale_status
+    assert not vehicle.join(timeout=0.5, min_wait=0.05)
+    states.extend([True, True])
+    st = time.monotonic()
+    assert vehicle.join(timeout=2.0, min_wait=0.05)
+    assert time.monotonic() - st < 1.0
+    logging.info("join stale state: OK")
+
+
+def check_join_async():
+    # 待機スレッドの状態取得と呼び出し側の要求の応答が混ざらないこと
+    vehicle = robot(transport=SimulatedSerial(baudrate=115200))
+    vehicle.wakeup()
+    vehicle.set_pos_relative(x=0.1, y=0.0, w=0.0, vel_xy=0.5)
+    done = vehicle.join_async(timeout=5.0, poll_interval=0.01, max_poll_interval=0.01)
+    while not done.done():
+        pose = vehicle.get_pos()
+        assert len(pose) == 1 and isinstance(pose[0], TriOrbDrive3Pose)
+    assert done.result() and vehicle.resyncs == 0
+    vehicle.stop_reader()
+    logging.info("join async: OK")
+
+
+def check_write_coalescing():
+    # 間引き対象のコードを直接書き込んだ後も, 同じ値の再送が間引かれないこと
+    transport = SimulatedSerial()
+    vehicle = robot(transport=transport, coalesce_writes=True)
+    vehicle.set_vel_relative(0.0, 0.0, 0.0, acc=500)
+    vehicle.set_vel_relative(0.0, 0.0, 0.0, acc=500)
+    assert vehicle.shadow.dropped == 1
+    vehicle.set_acceleration_time(1000)
+    assert transport.ecu._register(RobotCodes.ACCELERATION_TIME).v1 == 1000
+    vehicle.set_vel_relative(0.0, 0.0, 0.0, acc=500)
+    assert transport.ecu._register(RobotCodes.ACCELERATION_TIME).v1 == 500
+    vehicle.set_vel_relative(0.0, 0.0, 0.0, acc=500)
+    assert vehicle.shadow.dropped == 2
+    # 設定値の読み出しは間引き用の記録を捨てない. 書き込みは捨てる
+    vehicle.read_config(["acc", "dec", "std-vel"])
+    vehicle.set_vel_relative(0.0, 0.0, 0.0, acc=500)
+    assert vehicle.shadow.dropped == 3
+    vehicle.write_config({"acc": 300})
+    vehicle.set_vel_relative(0.0, 0.0, 0.0, acc=500)
+    assert vehicle.shadow.dropped == 3
+    logging.info("write coalescing: OK")
+
+
+def check_velocity_stream(seconds=1.0):
+    # 送信スレッドと呼び出し側のスレッドが同時に要求しても応答が混ざらないこと
+    vehicle = robot(transport=SimulatedSerial(baudrate=115200))
+    vehicle.wakeup()
+    stream = vehicle.velocity_stream(rate=100)
+    st = time.monotonic()
+    while time.monotonic() - st < seconds:
+        stream.post(0.1, 0.0, 0.0)
+        pose = vehicle.get_pos()
+        assert len(pose) == 1 and isinstance(pose[0], TriOrbDrive3Pose)
+    stream.stop()
+    assert vehicle.resyncs == 0 and stream.errors == 0 and stream.sent > 0
+
+    # 応答が無かった指令は送信済みに数えない
+    vehicle.set_vel_relative = lambda *args, **kwargs: b""
+    stream = VelocityStream(vehicle)
+    stream._send(0.1, 0.0, 0.0, time.monotonic())
+    assert stream.sent == 0 and stream.errors == 1
+    logging.info("velocity stream: OK")
+
+
+def check_trajectory_concurrent():
+    # 軌道の送信スレッドと呼び出し側のスレッドが同時に要求しても応答が混ざらないこと
+    vehicle = robot(transport=SimulatedSerial(baudrate=115200))
+    vehicle.wakeup()
+    ex = vehicle.follow_trajectory([[0, 0, 0], [0.1, 0, 0]], rate=50, vel_xy=0.2, acc=200, dec=200)
+    while ex.running:
+        pose = vehicle.get_pos()
+        assert len(pose) == 1 and isinstance(pose[0], TriOrbDrive3Pose)
+    assert ex.join() and vehicle.resyncs == 0 and ex.errors == 0 and ex.sent > 0
+
+    # 応答が無かった指令は送信済みに数えない
+    vehicle.set_vel_relative = lambda *args, **kwargs: b""
+    ex = TrajectoryExecutor(vehicle, Trajectory([[0, 0, 0], [0.1, 0, 0]]))
+    ex._send((0.1, 0.0, 0.0))
+    assert ex.sent == 0 and ex.errors == 1
+    logging.info("trajectory concurrent: OK")
+
+
+def check_response_cache():
+    vehicle = robot(transport=SimulatedSerial())
+    assert vehicle.read_config(["acc"]) == vehicle.read_config(["acc"])
+    assert vehicle.cache.hits == 1 and vehicle.cache.misses == 1
+    # 書き込みで古い値は捨てられる
+    vehicle.write_config({"acc": 700})
+    assert vehicle.read_config(["acc"]) == [700]
+    assert vehicle.cache.hits == 1
+
+    # 読み出し指定値での読み出しはキャッシュを捨てない. 重なるパラメータはコード毎に共有する
+    vehicle = robot(transport=SimulatedSerial())
+    for params in (["acc", "dec"], ["acc"], ["acc", "dec"], ["acc"], ["torque"], ["dec", "torque"]):
+        assert len(vehicle.read_config(params)) == len(params)
+    assert vehicle.cache.hits == 6 and vehicle.cache.misses == 3
+    vehicle.get_device_status()
+    kin = vehicle.get_kinematics()
+    vehicle.get_device_status()
+    vehicle.read_config(["kin-matrix"])
+    assert vehicle.get_kinematics() is kin and vehicle.cache.hits == 8
+    logging.info("response cache: OK")
+
+
+def check_async_robot():
+    async def run():
+        async with AsyncRobot(transport=SimulatedSerial(latency=0.002)) as vehicle:
+            assert await vehicle.wakeup() == [2]
+            await vehicle.set_pos_relative(x=0.2, y=0.0, w=0.0, vel_xy=1.0)
+            assert await vehicle.join(timeout=5.0)
+            poses, status = await asyncio.gather(vehicle.get_pos(), vehicle.get_motor_status(params=["state"]))
+            assert abs(poses[0].x - 0.2) < 1e-3 and len(status) == 3
+            acc = SIM_DEFAULT_CONFIG[RobotCodes.STANDARD_ACCELERATION_TIME]
+            assert await vehicle.read_config(["acc", "acc"]) == [acc, acc]
+            await vehicle.set_pos_relative(x=1.0, y=0.0, w=0.0, vel_xy=0.1)
+            assert not await vehicle.join(timeout=0.2)  # 移動中にタイムアウトする
+            try:
+                vehicle.velocity_stream()
+                assert False
+            except NotImplementedError:
+                pass
+    asyncio.run(run())
+    logging.info("async robot: OK")
+
+
+def check_capture_replay():
+    path = os.path.join(tempfile.mkdtemp(), "session.trbcap")
+    vehicle = robot(transport=SimulatedSerial(latency=0.001))
+    vehicle.start_capture(path)
+    vehicle.wakeup()
+    vehicle.set_pos_relative(x=0.1, y=0.0, w=0.0, vel_xy=1.0)
+    poses = [vehicle.get_pos() for _ in range(3)]
+    vehicle.sleep()
+    vehicle.stop_capture()
+    _started, records = read_capture(path)
+    assert [d for _t, d, _b in records].count("tx") == 6
+
+    transport = ReplaySerial(path, speed=None)
+    replay = robot(transport=transport)
+    replay.wakeup()
+    replay.set_pos_relative(x=0.1, y=0.0, w=0.0, vel_xy=1.0)
+    assert [replay.get_pos() for _ in range(3)] == poses
+    assert transport.mismatches == 0 and transport.remaining == 1
+    del replay  # 最後のsleep()は__del__で送られる
+    assert transport.mismatches == 0 and transport.remaining == 0
+    logging.info("capture replay: OK")
+
+
+def check_kinematics():
+    vehicle = robot(transport=SimulatedSerial())
+    kin = vehicle.get_kinematics()
+    assert kin is vehicle.get_kinematics()  # 2回目はキャッシュから返す
+    assert np.allclose(kin.matrix, SIM_DEFAULT_CONFIG[RobotCodes.KINEMATICS].mat)
+    vel = np.random.default_rng(0).uniform(-1.0, 1.0, (16, 3))
+    assert np.allclose(kin.to_body(kin.to_wheel(vel)), vel)
+    limited = Kinematics(kin.matrix, wheel_limit=1000.0)
+    assert not limited.feasible(vel).all() and limited.feasible(limited.scale_to_limits(vel)).all()
+    logging.info("kinematics: OK")
+
+
+def check_trajectory():
+    vehicle = robot(transport=SimulatedSerial())
+    vehicle.wakeup()
+    route = [[0, 0, 0], [0.2, 0, 0], [0.2, 0.2, 90]]
+    ex = vehicle.follow_trajectory(route, rate=50, feedback=True, vel_xy=0.5, vel_w=2.0, acc=200, dec=200)
+    assert ex.join(timeout=10.0) and ex.errors == 0
+    pose = vehicle.get_pos()[0]
+    assert np.allclose([pose.x, pose.y, pose.w], route[-1], atol=[0.02, 0.02, 2.0])
+    logging.info("trajectory: OK")
+
+
+class OmittingECU(SimulatedECU):
+    """Leaves out the value of the last code, as the ECU does for a value it cannot read."""
+
+    def process(self, entries):
+        return super().process(entries[:-1] if len(entries) > 1 else entries)
+
+
+def check_async_partial_response():
+    # 値が欠けた短い応答もタイムアウトを待たずに返すこと
+    async def request(vehicle):
+        st = time.monotonic()
+        values = await vehicle._request([[RobotCodes.GET_POSE, TriOrbDrive3Pose()],
+                                         [RobotCodes.DRIVING_POWER, np.float32(0)]])
+        return values, time.monotonic() - st
+
+    async def run():
+        vehicle = AsyncRobot(transport=SimulatedSerial(ecu=OmittingECU()))
+        values, elapsed = await request(vehicle)
+        assert len(values) == 1 and isinstance(values[0], TriOrbDrive3Pose) and elapsed < 0.5
+        vehicle.stop_reader()
+        if os.name == "posix":  # add_reader()で受信する場合
+            with PtyECU(ecu=OmittingECU()) as pty:
+                vehicle = AsyncRobot(port=pty.port)
+                values, elapsed = await request(vehicle)
+                assert len(values) == 1 and elapsed < 0.5
+                vehicle.stop_reader()
+    asyncio.run(run())
+    logging.info("async partial response: OK")
+
+
+def check_frame_parser():
+    pose = b"\x00" + b"\x0d\x01"
+    codes = [RobotCodes.GET_POSE, RobotCodes.DRIVING_POWER]
+    sizes = [12, 4]
+    length = response_length(sizes)
+    value = b"\x0d\x0a\x00\x3f" + bytes(8)  # 0x0d0a 0x00を含む値
+    full = pose + value + b"\x0b\x01" + bytes(4) + b"\r\n"
+    short = pose + value + b"\r\n"  # DRIVING_POWERが読めなかった応答
+
+    # 値の中の0x0d0aで区切らない. 短い応答の後に次の応答が続いても境界を保つ
+    frames = FrameParser()
+    frames.feed(short + full)
+    assert frames.next_frame(length, pose, codes, sizes) == short
+    assert frames.next_frame(length, pose, codes, sizes) == full and len(frames) == 0
+
+    # 先頭のゴミは読み飛ばす
+    frames.feed(b"\xff\x12\x0d\x0a" + full)
+    assert frames.next_frame(length, pose, codes, sizes) == full and frames.dropped_bytes == 4
+
+    # 途中まで届いたフレームは受信が途切れても残りを待つ
+    other = pose + bytes(12) + b"\x0b\x01" + bytes(4) + b"\r\n"
+    frames.feed(other[:10])
+    assert frames.next_frame(length, pose, codes, sizes) is None
+    assert frames.flush(codes, sizes) is None
+    frames.feed(other[10:])
+    assert frames.next_frame(length, pose, codes, sizes) == other
+    # 途切れた時点で揃っている短い応答はコードの並びで区切る
+    frames.feed(short)
+    assert frames.next_frame(length, pose, codes, sizes) is None
+    assert frames.flush(codes, sizes) == short and len(frames) == 0
+    echoed = pose + b"\x0b\x01" + b"\x0d\x0a\x00\x3f" + b"\r\n"  # 値なしでコードだけ返った応答
+    frames.feed(echoed)
+    assert frames.flush(codes, sizes) == echoed
+    logging.info("frame parser: OK")
+
+
+def check_state_flags():
+    for word in range(1 << 16):
+        if not word & TriOrbStateFlag.SUCCESS:
+            continue  # 読み出し失敗の警告が出るので除く
+        state = TriOrbBaseState.from_flags(TriOrbStateFlag(word), motor_id=1)
+        assert state.flags == word
+        assert [getattr(state, name) for name in STATE_FIELDS] == [bool(word >> k & 1) for k in range(16)]
+    raw = np.random.default_rng(0).integers(0, 256, (50, 3, 2), dtype=np.uint8)
+    raw[..., 0] |= 0x80  # success
+    bits = decode_state_bits(raw)
+    words = state_words(raw)
+    assert bits.shape == (50, 3, 16) and words.shape == (50, 3)
+    codec = get_type_codec(TriOrbBaseState)
+    for idx in np.ndindex(words.shape):
+        state = codec.decode(bytes(raw[idx]) + b"\x01")  # ECUの応答と同じく状態2バイト+モーターID
+        assert state.flags == TriOrbStateFlag(int(words[idx]))
+        assert bits[idx].tolist() == [getattr(state, name) for name in STATE_FIELDS]
+    assert np.array_equal(bits[..., STATE_FIELDS.index("move")], (words & TriOrbStateFlag.MOVE) > 0)
+    logging.info("state flags: OK")
+
+
+def check_slots():
+    values = [TriOrbBaseSystem(3, 60), TriOrbBaseDevice(), TriOrbBaseSensor(), TriOrbBaseError(0x30, 2),
+              TriOrbErrorStamped(), TriOrbErrorHistory(), TriOrbDriveUSS(), TriOrbMotorParams(),
+              TriOrbBaseState(btn_y=True, move=True, success=True, qstop=True, motor_id=2),
+              TriOrbDrive3Pose(0.5, -1.0, 90.0), TriOrbDrive3Vector(1.0, 2.0, 3.0)]
+    for v in values:
+        cls = type(v)
+        assert not hasattr(v, "__dict__") and cls.__slots__ == tuple(f.name for f in dataclasses.fields(cls))
+        data = v.to_bytes()
+        buf = bytearray(len(data) + 3)
+        v.pack_into(buf, 3)
+        assert bytes(buf[3:]) == data == get_type_codec(cls).encode(v)
+        assert cls().unpack_from(bytes(buf), 3) == v
+    # 状態の応答はfrom_BE=Trueのビット順で復号する
+    state = values[8].to_bytes()
+    assert get_type_codec(TriOrbBaseState).decode(state) == TriOrbBaseState().unpack_from(state, 0, True)
+    logging.info("slots: OK")
+
+
+def check_metrics():
+    hist = LatencyHistogram()
+    samples = np.random.default_rng(0).exponential(0.002, 10000)
+    for v in samples:
+        hist.record(v)
+    for q in METRIC_QUANTILES:
+        exact = np.quantile(samples, q)
+        assert abs(hist.percentile(q) - exact) <= exact*0.07 + 1e-6  # バケットの相対誤差 約6%
+    assert hist.count == len(samples) and hist.max == samples.max()
+
+    vehicle = robot(transport=SimulatedSerial(latency=0.001), metrics=True)
+    vehicle.wakeup()
+    for _ in range(5):
+        vehicle.get_pos()
+    snap = vehicle.metrics.snapshot()
+    assert snap["frames_tx"] == snap["frames_rx"] == 6 and snap["timeouts"] == 0
+    stats = snap["latency"]["GET_POSE"]
+    assert set(stats) == {"tx", "wait", "parse"} and stats["wait"]["count"] == 5
+    assert stats["wait"]["min"] >= 0.001
+    text = vehicle.metrics.to_prometheus()
+    assert "triorb_frames_rx_total 6\n" in text
+    assert 'triorb_latency_seconds_count{code="GET_POSE",phase="wait"} 5\n' in text
+
+    vehicle.metrics.enabled = False
+    vehicle.get_pos()
+    assert vehicle.metrics.snapshot()["frames_rx"] == 6
+    vehicle.metrics.reset()
+    assert vehicle.metrics.snapshot()["latency"] == {}
+    logging.info("metrics: OK")
+
+
+def check_telemetry():
+    vehicle = robot(transport=SimulatedSerial(latency=0.001))
+    vehicle.wakeup()
+    vehicle.set_vel_relative(0.5, 0.0, 0.0)
+    tm = Telemetry(vehicle, rate=100.0, capacity=8)
+    records = [tm.sample() for _ in range(10)]  # 容量を超えて上書きさせる
+    vehicle.brake()
+    assert tm.count == 10 and tm.errors == 0 and all(r["ok"] for r in records)
+    window = tm.window()
+    assert len(window) == 8 and np.array_equal(window, np.array(records[2:], dtype=tm.dtype))
+    assert np.array_equal(tm.window(n=3), window[-3:]) and tm.latest() == records[-1]
+    assert len(tm.window(since=records[-2]["t"])) == 2
+    assert np.all(np.diff(window["pose"][:, 0]) > 0) and np.allclose(window["voltage"], 24.0)
+    state = decode_state_bits(window["state"])
+    assert state[:, :, STATE_FIELDS.index("move")].all()
+    pose = vehicle.get_pos()[0]
+    assert np.allclose(tm.sample()["pose"], (pose.x, pose.y, pose.w), atol=1e-3)
+
+    # 1フレームに1エントリずつ送っても同じ値を読む
+    small = Telemetry(vehicle, max_packet_size=1)
+    assert small.frames_per_sample == 1 + 3 + 3 + 3 + 1 > tm.frames_per_sample
+    a, b = small.sample(), tm.sample()
+    assert all(np.array_equal(a[name], b[name]) for name in tm.dtype.names if name != "t")
+
+    tm.start()
+    time.sleep(0.2)
+    assert vehicle.get_pos()[0] == pose  # 計測中も他の要求を送れる
+    tm.stop()
+    assert tm.count > 12 and tm.errors == 0
+    logging.info("telemetry: OK")
+
+
+def check_pose_history():
+    vehicle = robot(transport=SimulatedSerial())
+    vehicle.wakeup()
+    history = PoseHistory(capacity=2)  # 記録中に伸長させる
+    vehicle.set_vel_relative(0.5, 0.0, 0.0)
+    for _ in range(10):
+        history.record(vehicle)
+        time.sleep(0.02)
+    vehicle.brake()
+    assert len(history) == 10 and np.all(np.diff(history.t) > 0)
+    assert np.allclose(history.velocity()[1:-1, 0], 0.5, atol=0.1)
+    t, poses = history.resample(100.0)
+    assert np.allclose(np.diff(t), 0.01) and np.all(np.diff(poses[:, 0]) >= 0)
+
+    history = PoseHistory()
+    history.extend([0.0, 1.0, 2.0], [[0, 0, 170], [0, 0, -170], [0, 0, -150]])
+    assert np.allclose(history.velocity()[:, 2], [20.0, 20.0, 20.0])  # ±180degを跨いでも連続
+    path = os.path.join(tempfile.mkdtemp(), "poses.npy")
+    history.save(path)
+    for mode in ("r", "r+"):
+        loaded = PoseHistory.load(path, mmap_mode=mode)
+        assert np.array_equal(loaded.records(), history.records())
+        loaded.clear()
+        loaded.append(5.0, (1.0, 2.0, 3.0))  # ファイルは書き換えずにメモリへ複製する
+        assert len(loaded) == 1 and loaded.poses.tolist() == [[1.0, 2.0, 3.0]]
+    assert np.array_equal(np.load(path), history.records())
+    logging.info("pose history: OK")
+
+
+def check_fleet(n=3):
+    ecus = [SimulatedECU() for _ in range(n)]
+    with RobotFleet(transports=[SimulatedSerial(ecu=ecu, latency=0.002) for ecu in ecus]) as fleet:
+        assert fleet.wakeup_all() == [[2]] * n and all(ecu.excited for ecu in ecus)
+        fleet.scatter("set_pos_relative", [(0.1*(i + 1), 0.0, 0.0, 1.0) for i in range(n)])
+        assert all(fleet.broadcast("join", timeout=5.0))
+        assert np.allclose(fleet.get_pose_all()[:, 0], [0.1*(i + 1) for i in range(n)], atol=1e-3)
+        robots = list(fleet)
+    # close()でsleep()を送ってからポートを閉じる. 閉じた後の__del__は何も送らない
+    assert not any(ecu.excited for ecu in ecus)
+    frames = [ecu.frames for ecu in ecus]
+    unraisable = []
+    hook, sys.unraisablehook = sys.unraisablehook, unraisable.append
+    try:
+        del fleet, robots
+    finally:
+        sys.unraisablehook = hook
+    assert [ecu.frames for ecu in ecus] == frames and not unraisable
+    logging.info("fleet: OK")
+
+
+def check_motor_snapshot():
+    ecu = SimulatedECU()
+    ecu.alarms = {1: 0x30, 3: 0x41}
+    vehicle = robot(transport=SimulatedSerial(ecu=ecu))
+    vehicle.wakeup()
+    vehicle.set_vel_relative(0.2, 0.0, 0.0)
+    for ids in ([1, 2, 3], [3, 1], 2):
+        snapshot = vehicle.get_motor_snapshot(_id=ids)
+        status = vehicle.get_motor_status(_id=ids)
+        n = len(snapshot)
+        errors, states, voltages, powers = [status[k*n:(k+1)*n] for k in range(4)]
+        assert snapshot["valid"].all()
+        assert snapshot["id"].tolist() == [e.motor_id for e in errors] == [s.motor_id for s in states]
+        assert snapshot["alarm"].tolist() == [e.alarm for e in errors]
+        assert [TriOrbStateFlag(int(v)) for v in snapshot["state"]] == [s.flags for s in states]
+        assert np.allclose(snapshot["voltage"], voltages) and np.allclose(snapshot["power"], powers)
+    assert decode_motor_alarms(vehicle.get_motor_snapshot(params=["error"]))["hex"].tolist() == ["0x30", "0x00", "0x41"]
+    vehicle.brake()
+    logging.info("motor snapshot: OK")
+
+
+def check_alarms():
+    table = decode_alarms([[0x10, 0x29], [0x00, 0xf3]])
+    assert table.shape == (2, 2) and table.dtype.names == ("code", "hex", "name", "name_en", "known")
+    assert table["known"].tolist() == [[True, True], [False, True]]
+    assert table[0, 1]["hex"] == "0x29" and get_alarm_name(0x29) == ALARMS[0x29].name
+    assert get_alarm_name(0x00) is False and get_alarm_name(300) is False
+    assert not ALARM_TABLE.flags.writeable
+    vehicle = robot(transport=SimulatedSerial())
+    alarms = decode_motor_alarms(vehicle.get_motor_status(params=["error"]))
+    assert alarms["motor_id"].tolist() == [1, 2, 3] and not alarms["known"].any()
+    logging.info("alarms: OK")
+
+
+def check_throughput(n=200):
+    for baudrate in [None, 115200]:
+        vehicle = robot(transport=SimulatedSerial(baudrate=baudrate))
+        st = time.perf_counter()
+        for _ in range(n):
+            vehicle.get_pos()
+        logging.info("baudrate={}: {:.3f} ms/request".format(
+            baudrate, (time.perf_counter() - st) / n * 1e3))
+
+
+if __name__ == '__main__':
+    check_robot_functions()
+    check_robot_functions(background_reader=True)
+    check_join_stale_state()
+    check_join_async()
+    check_write_coalescing()
+    check_velocity_stream()
+    check_trajectory_concurrent()
+    check_response_cache()
+    check_async_robot()
+    check_capture_replay()
+    check_kinematics()
+    check_trajectory()
+    check_async_partial_response()
+    check_frame_parser()
+    check_slots()
+    check_state_flags()
+    check_metrics()
+    check_telemetry()
+    check_pose_history()
+    check_fleet()
+    check_motor_snapshot()
+    check_alarms()
+    check_throughput()
@@ -19,3 +19,10 @@
 from .core_types import *
 from .robot import robot
 from .robot import RobotCodes
+from .aio import AsyncRobot
+from .fleet import RobotFleet
+from .telemetry import Telemetry
+from .odometry import PoseHistory
+from .alarms import ALARMS, ALARM_TABLE, get_alarm_name, decode_alarms, decode_error_history, decode_motor_alarms
+from .kinematics import Kinematics
+from .trajectory import Trajectory, TrajectoryExecutor
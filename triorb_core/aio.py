@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .robot import robot, RobotCodes, RobotValues, DRIVE_MOTOR_LOCAL_IDS, ALL_MOTOR_LOCAL_IDS, RESPONSE_TIMEOUT, \
+    PIPELINE_DEPTH, UART_TIMEOUT, KINEMATICS_CACHE_KEY, JOIN_MIN_WAIT, JOIN_POLL_INTERVAL, JOIN_MAX_POLL_INTERVAL, JOIN_POLL_BACKOFF
+from .reader import ResponseReader
+from .alarms import decode_motor_alarms
+import asyncio
+import collections
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+ASYNC_POLL_INTERVAL = 0.002  # add_readerが使えない環境での受信ポーリング周期 [s]
+ASYNC_FLUSH_DELAY = UART_TIMEOUT  # 受信が途絶えてから値が欠けた短い応答を確定させるまでの時間 [s]
+
+
+class AsyncRobot(robot):
+    """
+    asyncio front-end of robot. The request methods (wakeup, set_vel_relative,
+    set_pos_relative, get_pos, get_motor_status, join, ...) return coroutines.
+    The serial port is read from the event loop with loop.add_reader() (or a
+    polling task where the platform does not support it), so one loop can
+    drive many robots without a thread per port.
+    Do not call tx()/rx() directly on this class.
+    """
+
+    def __init__(self, port=None, node=None, port_find_time=None, trace_history=0, transport=None, cache_ttls=None,
+                 coalesce_writes=False, metrics=False):
+        super().__init__(port, node, port_find_time, trace_history=trace_history, transport=transport,
+                         cache_ttls=cache_ttls, coalesce_writes=coalesce_writes, metrics=metrics)
+        self._uart.timeout = 0  # ノンブロッキング読み込み
+        self._reader = ResponseReader(self._uart, self._parse_response, metrics=self.metrics,
+                                      on_read=self._record_rx)
+        self._loop = None
+        self._poll_task = None
+        self._flush_handle = None
+
+    async def __aenter__(self):
+        self.start_reader()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    def start_reader(self):
+        """Attaches the serial port to the running event loop. Called automatically by the first request."""
+        if self._loop is not None or self._uart is None:
+            return
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        try:
+            loop.add_reader(self._uart.fileno(), self._on_readable)
+        except (NotImplementedError, AttributeError, ValueError, OSError):
+            self._poll_task = loop.create_task(self._poll())
+
+    def stop_reader(self):
+        if self._loop is None:
+            return
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        else:
+            self._loop.remove_reader(self._uart.fileno())
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._loop = None
+        self._reader.stop()
+
+    def _on_readable(self):
+        try:
+            data = self._uart.read(self._uart.in_waiting or 1)
+        except Exception as e:
+            self._print_error("serial read failed: {}".format(e))
+            self.stop_reader()
+            return
+        if data:
+            self._reader.feed(data)
+            # ResponseReader._run()と同じく, 受信が途絶えたらバッファに残った短い応答を渡す
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._flush_handle = self._loop.call_later(ASYNC_FLUSH_DELAY, self._reader.flush)
+
+    async def _poll(self):
+        last = time.monotonic()
+        while True:
+            n = self._uart.in_waiting
+            if n > 0:
+                self._reader.feed(self._uart.read(n))
+                last = time.monotonic()
+            else:
+                if time.monotonic() - last >= ASYNC_FLUSH_DELAY:
+                    self._reader.flush()
+                await asyncio.sleep(ASYNC_POLL_INTERVAL)
+
+    def _send(self, code_array, parse=None):
+        self.start_reader()
+        _send_binary, expected_values, expected_size = self._build_frame(code_array)
+        future = self._write_frame(_send_binary, expected_values, expected_size, parse)
+        self.tracer.tx(_send_binary)
+        return future
+
+    async def _wait_response(self, future):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), RESPONSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self._print_error("[ERROR] timeout. May be send wrong packet.")
+            self._dump_trace()
+            self.metrics.count_timeout()
+            return b""
+
+    async def _request(self, code_array):
+        if self._uart is None:
+            return 0
+        return await self._wait_response(self._send(code_array))
+
+    async def _coalesced_request(self, query):
+        if self.shadow is None:
+            return await self._request(query)
+        query, pending = self.shadow.filter(query)
+        values = await self._request(query)
+        self.shadow.acknowledge(pending, isinstance(values, list) and len(values) == len(query))
+        return values
+
+    async def _cached_request(self, code_array):
+        key = tuple(entry[0] for entry in code_array)
+        hit, values = self.cache.get(key)
+        if hit:
+            return list(values)
+        values = await self._request(code_array)
+        if isinstance(values, list) and len(values) == len(code_array):
+            self.cache.put(key, list(values), key)
+        return values
+
+    async def _request_all(self, code_arrays):
+        values = []
+        for code_array in code_arrays:
+            res = await self._request(code_array)
+            # タイムアウト(b"")や不正パケットの応答は連結せずにそのまま返す
+            if not isinstance(res, list):
+                return res
+            values += res
+            if len(res) != len(code_array):
+                return values  # 読めなかった値がある. 残りは送らない
+        return values
+
+    async def pipeline(self, code_arrays, depth=PIPELINE_DEPTH, raw=False):
+        if self._uart is None:
+            return []
+        depth = max(int(depth), 1)
+        parse = self._raw_response if raw else None
+        results = []
+        inflight = collections.deque()
+        for code_array in code_arrays:
+            if len(inflight) >= depth:
+                results.append(await self._wait_response(inflight.popleft()))
+            inflight.append(self._send(code_array, parse))
+        while inflight:
+            results.append(await self._wait_response(inflight.popleft()))
+        return results
+
+    async def get_motor_snapshot(self, params=["error", "state", "voltage", "power"], _id=ALL_MOTOR_LOCAL_IDS):
+        plan = self._motor_snapshot_plan(params, _id)
+        return plan.decode(await self.pipeline(plan.queries, raw=True))
+
+    async def get_motor_alarms(self, _id=ALL_MOTOR_LOCAL_IDS):
+        return decode_motor_alarms(await self.get_motor_snapshot(params=["error"], _id=_id))
+
+    async def get_kinematics(self):
+        hit, kin = self.cache.get(KINEMATICS_CACHE_KEY)
+        if hit:
+            return kin
+        return self._store_kinematics(await self._request_all(self._kinematics_queries()))
+
+    def velocity_stream(self, *args, **kwargs):
+        # 送信スレッドからコルーチンは呼べない
+        raise NotImplementedError("velocity_stream() is not supported by AsyncRobot")
+
+    def follow_trajectory(self, *args, **kwargs):
+        raise NotImplementedError("follow_trajectory() is not supported by AsyncRobot")
+
+    async def ota_reboot(self):
+        logger.debug("OTA Reboot")
+        # 再起動するので応答は待たない
+        _send_binary, _, _ = self._build_frame(
+            [[RobotCodes.STARTUP_SUSPENSION, RobotValues.OTA_REBOOT]])
+        self._write_uart(_send_binary)
+        self.tracer.tx(_send_binary)
+        return [RobotCodes.STARTUP_SUSPENSION, RobotValues.OTA_REBOOT]
+
+    async def read_config(self, params=["acc", "dec", "std-vel", "torque"]):
+        logger.debug("read_config")
+        plan = self._config_read_plan(params)
+        res = await self._request(plan.query) if plan.query else []
+        return self._config_read_result(plan, res)
+
+    async def write_config(self, params):
+        res = robot.write_config(self, params)
+        if res is False:
+            return False
+        return await res
+
+    async def join(self, timeout=None, **kwargs):
+        logger.debug("join")
+        done = await self.wait_motion(timeout=timeout, **kwargs)
+        print("move end" if done else "move timeout")
+        return done
+
+    def join_async(self, timeout=None, **kwargs):
+        """Returns an asyncio.Task of wait_motion()."""
+        return asyncio.ensure_future(self.wait_motion(timeout=timeout, **kwargs))
+
+    async def wait_motion(self, timeout=None, poll_interval=JOIN_POLL_INTERVAL, max_poll_interval=JOIN_MAX_POLL_INTERVAL,
+                          backoff=JOIN_POLL_BACKOFF, min_wait=JOIN_MIN_WAIT, predicted_time=None):
+        wait = self._motion_wait(timeout, poll_interval, max_poll_interval, backoff, min_wait, predicted_time)
+        while (True):
+            delay, expired = wait.next_poll(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if expired:
+                return False
+            data = await self.get_motor_status(
+                params=["state"], _id=DRIVE_MOTOR_LOCAL_IDS)
+            if wait.done(data, time.monotonic()):
+                break
+        self._motion_end = None
+        return True
+
+    async def aclose(self):
+        """Turns off the excitation and closes the port."""
+        if self._uart is None:
+            return
+        await self.sleep()
+        self.close_serial()
+
+    def close_serial(self):
+        self.stop_reader()
+        if self._uart is not None:
+            self._uart.close()
+            self._uart = None
+
+    def __del__(self):
+        # イベントループ外では応答を待てないのでsleep()は送らない. aclose()を使うこと
+        if self._uart is not None:
+            self._uart.close()
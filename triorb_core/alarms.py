@@ -1,36 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
 # P410
+import collections
+import types
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+# (コード, 日本語名, 英語名)
+_ALARM_CATALOGUE = (
+    (0x10, "位置偏差過大", "Excessive position deviation"),
+    (0x20, "過電流", "Overcurrent"),
+    (0x21, "主回路加熱", "Main circuit overheat"),
+    (0x22, "過電圧", "Overvoltage"),
+    (0x25, "不足電圧", "Undervoltage"),
+    (0x26, "モーター過熱", "Motor overheat"),
+    (0x28, "エンコーダ異常", "Encoder error"),
+    (0x29, "内部回路異常", "Internal circuit error"),
+    (0x2a, "エンコーダ通信異常", "Encoder communication error"),
+    (0x2d, "モーター接続異常", "Motor connection error"),
+    (0x30, "過負荷", "Overload"),
+    (0x31, "過速度", "Overspeed"),
+    (0x41, "EEPROM異常", "EEPROM error"),
+    (0x42, "初期時エンコーダ異常", "Initial encoder error"),
+    (0x44, "エンコーダEEPROM異常", "Encoder EEPROM error"),
+    (0x45, "モーター組合せ異常", "Motor combination error"),
+    (0x4a, "原点復帰未完了", "Return-to-home incomplete"),
+    (0x50, "電磁ブレーキ過電流", "Electromagnetic brake overcurrent"),
+    (0x53, "HWTO入力回路異常", "HWTO input circuit error"),
+    (0x55, "電磁ブレーキ接続異常", "Electromagnetic brake connection error"),
+    (0x60, "±LS同時入力", "+LS and -LS both active"),
+    (0x61, "±LS逆接続", "Reverse LS connection"),
+    (0x62, "原点復帰運転異常", "Homing operation error"),
+    (0x63, "HOMES未検出", "No HOMES"),
+    (0x64, "Z, SLIT信号異常", "Z, SLIT signal error"),
+    (0x66, "ハードウェアオーバートラベル", "Hardware overtravel"),
+    (0x67, "ソフトウェアオーバートラベル", "Software overtravel"),
+    (0x68, "HWTO入力検出", "HWTO input detection"),
+    (0x6a, "原点復帰追加運転異常", "Return-to-home additional operation error"),
+    (0x6e, "ユーザーアラーム", "User alarm"),
+    (0x70, "運転データ異常", "Operation data error"),
+    (0x71, "単位設定異常", "Unit setting error"),
+    (0x81, "ネットワークパス異常", "Network bus error"),
+    (0x84, "RS-485通信異常", "RS-485 communication error"),
+    (0x85, "RS-485通信タイムアウト", "RS-485 communication timeout"),
+    (0x8c, "読込み失敗", "Read failure"),
+    (0xf0, "CPU異常", "CPU error"),
+    (0xf3, "CPU過負荷", "CPU overload"),
+)
+
+ALARM_DTYPE = np.dtype([
+    ("code", "u1"),
+    ("hex", "U4"),
+    ("name", "U16"),
+    ("name_en", "U48"),
+    ("known", "?"),
+])
+ALARM_HISTORY_DTYPE = np.dtype([("stamp", "<u4")] + ALARM_DTYPE.descr)
+MOTOR_ALARM_DTYPE = np.dtype([("motor_id", "u1")] + ALARM_DTYPE.descr)
+
+AlarmInfo = collections.namedtuple("AlarmInfo", ALARM_DTYPE.names)
+
+
+def _build_table():
+    table = np.zeros(256, dtype=ALARM_DTYPE)
+    table["code"] = np.arange(256)
+    table["hex"] = ["0x{:02X}".format(code) for code in range(256)]
+    for code, name, name_en in _ALARM_CATALOGUE:
+        table[code] = (code, "0x{:02X}".format(code), name, name_en, True)
+    table.flags.writeable = False
+    return table
+
+
+# アラームコード(0-255)で引く表. import時に一度だけ作る
+ALARM_TABLE = _build_table()
+ALARMS = types.MappingProxyType(
+    {int(row["code"]): AlarmInfo(*row.tolist()) for row in ALARM_TABLE[ALARM_TABLE["known"]]})
+_ALARM_NAMES = tuple(row["name"] if row["known"] else False for row in ALARM_TABLE)
+
+
 def get_alarm_name(code):
+    """Japanese name of an alarm code, or False if the code is not an alarm."""
+    if 0 <= code < len(_ALARM_NAMES):
+        return _ALARM_NAMES[code]
+    return False
+
+
+def decode_alarms(codes):
+    """
+    Looks up any array of alarm codes at once.
+    Returns an ALARM_DTYPE array of the same shape (known is False for codes that are not alarms).
+    """
+    codes = np.asarray(codes)
+    if codes.size and (codes.min() < 0 or codes.max() > 255):
+        raise Exception("Alarm code out of range (0-255)")
+    return ALARM_TABLE[codes.astype(np.intp)]
+
 
-    alarm_list = \
-          [False for i in range(16)] \
-        + ["位置偏差過大"] + [False for i in range(15)] \
-        + ["過電流", "主回路加熱", "過電圧", False, False, "不足電圧", "モーター過熱", False, "エンコーダ異常", "内部回路異常", "エンコーダ通信異常", False, False, "モーター接続異常", False, False] \
-        + ["過負荷", "過速度"] + [False for i in range(14)] \
-        + [False, "EEPROM異常",  "初期時エンコーダ異常", False, "エンコーダEEPROM異常",  "モーター組合せ異常",  False,  False,  False,  False,  "原点復帰未完了", False, False, False, False, False] \
-        + ["電磁ブレーキ過電流",  False, False, "HWTO入力回路異常", False, "電磁ブレーキ接続異常"] + [False for i in range(10)] \
-        + ["±LS同時入力", "±LS逆接続", "原点復帰運転異常", "HOMES未検出", "Z, SLIT信号異常", False, "ハードウェアオーバートラベル", "ソフトウェアオーバートラベル", "HWTO入力検出", False, "原点復帰追加運転異常", False, False, False, "ユーザーアラーム", False] \
-        + ["運転データ異常", "単位設定異常"] + [False for i in range(14)] \
-        + [False, "ネットワークパス異常", False, False, "RS-485通信異常", "RS-485通信タイムアウト", False, False, False, False, False, False, "読込み失敗"] 
- 
-    if code<8*16+13:
-        return alarm_list[code]
-    elif code==15*16:
-        return "CPU異常"
-    elif code==15*16+3:
-        return "CPU過負荷"
-    else:
-        return False
+def _copy_alarm_fields(out, codes):
+    decoded = decode_alarms(codes)
+    for name in ALARM_DTYPE.names:
+        out[name] = decoded[name]
+    return out
 
 
+def decode_error_history(history):
+    """
+    Decodes every entry of a TriOrbErrorHistory, or of a list of them
+    (e.g. robot.get_error_history()), into an ALARM_HISTORY_DTYPE array.
+    Empty entries have code 0.
+    """
+    if not isinstance(history, (list, tuple)):
+        history = [history]
+    entries = [e for h in history if hasattr(h, "errors") for e in h.errors()]
+    out = np.zeros(len(entries), dtype=ALARM_HISTORY_DTYPE)
+    out["stamp"] = [e.stamp for e in entries]
+    return _copy_alarm_fields(out, [e.error for e in entries])
+
+
+def decode_motor_alarms(status):
+    """
+    Decodes the alarms of several motors into a MOTOR_ALARM_DTYPE array.
+    `status` is an array with "id" and "alarm" fields (robot.get_motor_snapshot())
+    or a list containing TriOrbBaseError (robot.get_motor_status()).
+    """
+    if isinstance(status, np.ndarray) and status.dtype.names is not None:
+        out = np.zeros(status.shape, dtype=MOTOR_ALARM_DTYPE)
+        out["motor_id"] = status["id"]
+        return _copy_alarm_fields(out, status["alarm"])
+    errors = [v for v in status if hasattr(v, "alarm")]
+    out = np.zeros(len(errors), dtype=MOTOR_ALARM_DTYPE)
+    out["motor_id"] = [e.motor_id for e in errors]
+    return _copy_alarm_fields(out, [e.alarm for e in errors])
+
 
 if __name__ == "__main__":
 
     tx = ""
-    for i in range(15*16+10):
-        n = get_alarm_name(i)
-        if n:
-            tx += "%03d,%02x,"%(i,i)+n+"\n"
+    for code, info in ALARMS.items():
+        tx += "%03d,%02x,"%(code,code)+info.name+"\n"
     print(tx)
     with open("alarm.csv", "w") as f:
         f.write(tx)
-
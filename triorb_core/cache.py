@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Cache of parsed responses of slow-changing reads.
+    Every entry is tagged with the codes it was read from. Its lifetime is the
+    shortest TTL [s] of those codes, and it is dropped by invalidate() with
+    any of them. Codes without a TTL (or with TTL <= 0) are never cached.
+    """
+
+    def __init__(self, ttls=None, clock=time.monotonic):
+        self.ttls = {} if ttls is None else dict(ttls)
+        self._clock = clock
+        self._entries = {}  # key: (expire time, value, codes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_ttl(self, code, ttl):
+        """Sets the TTL [s] of a code. None or 0 disables caching of it."""
+        with self._lock:
+            if ttl:
+                self.ttls[code] = ttl
+            else:
+                self.ttls.pop(code, None)
+            self._drop([code])
+
+    def ttl(self, codes):
+        """TTL of an entry read from codes, or None if it must not be cached."""
+        ttl = None
+        for code in codes:
+            t = self.ttls.get(code)
+            if not t or t <= 0:
+                return None
+            ttl = t if ttl is None else min(ttl, t)
+        return ttl
+
+    def get(self, key):
+        """Returns (True, value) on a hit and (False, None) on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self.hits += 1
+                    return True, entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, codes):
+        ttl = self.ttl(codes)
+        if ttl is None:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value, frozenset(codes))
+
+    def invalidate(self, codes=None):
+        """Drops the entries read from any of codes (all entries if codes is None)."""
+        with self._lock:
+            if codes is None:
+                self._entries.clear()
+            else:
+                self._drop(codes)
+
+    def _drop(self, codes):
+        codes = set(codes)
+        for key in [k for k, e in self._entries.items() if not codes.isdisjoint(e[2])]:
+            del self._entries[key]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .trace import TRACE_TX, TRACE_RX
+import mmap
+import struct
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+# ファイル: ヘッダ(マジック, 記録開始時刻[UNIX時間]) + レコードの列
+# レコード: 記録開始からの経過時間[ns], 方向(0:tx, 1:rx), 長さ, シリアルポートに書いた/から読んだバイト列
+CAPTURE_MAGIC = b"TRBCAP01"
+CAPTURE_HEADER = struct.Struct("<8sd")
+CAPTURE_RECORD = struct.Struct("<QBH")
+CAPTURE_DIRECTIONS = (TRACE_TX, TRACE_RX)
+
+
+class SessionRecorder:
+    """
+    Appends every write to and read from the serial port to a binary log.
+    Reads are recorded as they came from the port, before they are split
+    into frames, so resynchronized bytes and partial responses are kept.
+    With `mmap_size` the log is written through a memory-mapped file that
+    grows by doubling, so recording is a copy into memory.
+    """
+
+    def __init__(self, path, mmap_size=None):
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+        self._start = time.monotonic_ns()
+        header = CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.time())
+        self._mm = None
+        if mmap_size:
+            self._file = open(path, "w+b")
+            self._file.truncate(max(int(mmap_size), len(header)))
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+            self._mm[:len(header)] = header
+            self._pos = len(header)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def tx(self, data):
+        self.record(0, data)
+
+    def rx(self, data):
+        self.record(1, data)
+
+    def record(self, direction, data):
+        stamp = time.monotonic_ns() - self._start
+        n = len(data)
+        with self._lock:
+            if self._file is None:
+                return
+            if self._mm is None:
+                self._file.write(CAPTURE_RECORD.pack(stamp, direction, n))
+                self._file.write(data)
+            else:
+                start = self._pos + CAPTURE_RECORD.size
+                end = start + n
+                if end > len(self._mm):
+                    self._mm.resize(max(end, len(self._mm) * 2))
+                CAPTURE_RECORD.pack_into(self._mm, self._pos, stamp, direction, n)
+                self._mm[start:end] = data
+                self._pos = end
+            self.records += 1
+
+    def flush(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+            elif self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm.close()
+                self._mm = None
+                self._file.truncate(self._pos)  # 確保した余りを切り詰める
+            self._file.close()
+            self._file = None
+
+
+def read_capture(path):
+    """Returns the wall-clock start time and the list of (time [s], "tx"/"rx", bytes) of a capture file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, started = CAPTURE_HEADER.unpack_from(data, 0)
+    if magic != CAPTURE_MAGIC:
+        raise Exception("Not a capture file: {}".format(path))
+    records = []
+    pos = CAPTURE_HEADER.size
+    while pos + CAPTURE_RECORD.size <= len(data):
+        stamp, direction, n = CAPTURE_RECORD.unpack_from(data, pos)
+        pos += CAPTURE_RECORD.size
+        if pos + n > len(data):
+            logger.warning("Capture is truncated: {}".format(path))
+            break
+        records.append((stamp * 1e-9, CAPTURE_DIRECTIONS[direction], data[pos:pos+n]))
+        pos += n
+    return started, records
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .core_types import *
+from operator import attrgetter
+import struct
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TypeCodec:
+    """
+    Precompiled encoder/decoder of one value type.
+    `fields(val)` returns the tuple packed by `struct`, `build(tuple)` rebuilds
+    the value from the tuple unpacked by `decode_struct`.
+    """
+    __slots__ = ("cls", "struct", "decode_struct", "fields", "build", "size")
+
+    def __init__(self, cls, fmt, fields, build, decode_fmt=None):
+        self.cls = cls
+        self.struct = _compile(fmt)
+        self.decode_struct = self.struct if decode_fmt is None else _compile(decode_fmt)
+        self.fields = fields
+        self.build = build
+        self.size = self.struct.size
+
+    def encode(self, val):
+        return self.struct.pack(*self.fields(val))
+
+    def pack_into(self, buf, offset, val):
+        self.struct.pack_into(buf, offset, *self.fields(val))
+
+    def decode(self, buf, offset=0):
+        return self.build(self.decode_struct.unpack_from(buf, offset))
+
+
+def _compile(fmt):
+    return fmt if isinstance(fmt, struct.Struct) else struct.Struct(fmt)
+
+
+_TYPE_CODECS = {}
+
+
+def register_type(cls, fmt=None, fields=None, build=None, decode_fmt=None):
+    """
+    Registers the codec of a value type. Without `fmt` the format is taken
+    from cls._STRUCT (and cls._DECODE_STRUCT for decoding), so the wire
+    format of the core_types is defined only in their class.
+    """
+    if fmt is None:
+        fmt = cls._STRUCT
+        decode_fmt = getattr(cls, "_DECODE_STRUCT", None)
+    if build is None:
+        def build(t): return cls(*t)
+    codec = TypeCodec(cls, fmt, fields, build, decode_fmt)
+    _TYPE_CODECS[cls] = codec
+    return codec
+
+
+def get_type_codec(cls):
+    codec = _TYPE_CODECS.get(cls)
+    if codec is None:
+        for c in _TYPE_CODECS.values():  # サブクラス用
+            if issubclass(cls, c.cls):
+                return c
+    return codec
+
+
+def to_bytes(val):
+    codec = _TYPE_CODECS.get(type(val))
+    if codec is None:
+        codec = get_type_codec(type(val))
+        if codec is None:
+            raise Exception("Unknown type")
+    return codec.struct.pack(*codec.fields(val))
+
+
+def _scalar(val):
+    return (val,)
+
+
+def _first(t):
+    return t[0]
+
+
+def _state_build(t):
+    # ECUからの状態はTriOrbBaseState.from_bytes(arr, from_BE=True)のビット順
+    return TriOrbBaseState()._set_values(*t, from_BE=True)
+
+
+def _history_fields(val):
+    return (val.err1.error, val.err1.stamp, val.err2.error, val.err2.stamp,
+            val.err3.error, val.err3.stamp, val.err4.error, val.err4.stamp,
+            val.err5.error, val.err5.stamp)
+
+
+def _history_build(t):
+    return TriOrbErrorHistory(*[TriOrbErrorStamped(t[2*i], t[2*i+1]) for i in range(MAX_ERROR_HIST)])
+
+
+def _matrix_fields(val):
+    return tuple(val.mat[i, j] for i in range(3) for j in range(3))
+
+
+def _matrix_build(t):
+    return TriOrbDriveMatrix(np.array(t, dtype=np.float32).reshape(3, 3))
+
+
+# 書式は各クラスの_STRUCT/_DECODE_STRUCTを使う
+register_type(TriOrbBaseSystem, fields=attrgetter("age", "weight"))
+register_type(TriOrbBaseDevice, fields=attrgetter(
+    "max_vx", "max_vy", "max_vw", "min_vx", "min_vy", "min_vw"))
+register_type(TriOrbBaseSensor, fields=attrgetter("age", "weight"))
+register_type(TriOrbBaseError, fields=attrgetter("alarm", "motor_id"))
+register_type(TriOrbBaseState, fields=TriOrbBaseState._values, build=_state_build)
+register_type(TriOrbErrorStamped, fields=attrgetter("error", "stamp"))
+register_type(TriOrbErrorHistory, fields=_history_fields, build=_history_build)
+register_type(TriOrbDriveUSS, fields=attrgetter("v1", "v2", "v3", "v4", "v5"))
+register_type(TriOrbMotorParams, fields=TriOrbMotorParams._values)
+register_type(TriOrbDrive3Pose, fields=attrgetter("x", "y", "w"))
+register_type(TriOrbDrive3Vector, fields=attrgetter("v1", "v2", "v3"))
+register_type(TriOrbDriveMatrix, fields=_matrix_fields, build=_matrix_build)
+
+register_type(bool, "<B", _scalar, _first)
+register_type(int, "<B", _scalar, _first)  # intは1バイトとして送信する
+register_type(np.uint8, "<B", _scalar, _first)
+register_type(np.uint16, "<H", _scalar, _first)
+register_type(np.uint32, "<I", _scalar, _first)
+register_type(np.int32, "<i", _scalar, _first)
+register_type(np.float32, "<f", _scalar, _first)
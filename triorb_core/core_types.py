@@ -16,22 +16,55 @@
 # limitations under the License.
 # ==============================================================================
 
-import sys
+import dataclasses
+import enum
 from dataclasses import dataclass, field
 import numpy as np
 import struct
+import logging
+logger = logging.getLogger(__name__)
 
 MAX_ERROR_HIST = 5
 
+
+def _slots(cls):
+    """
+    Rebuilds a dataclass with __slots__ (same as dataclass(slots=True) of Python 3.10+).
+    Instances have no __dict__, so they are smaller and faster to create.
+    """
+    names = tuple(f.name for f in dataclasses.fields(cls))
+    ns = dict(cls.__dict__)
+    for name in names:
+        ns.pop(name, None)  # 既定値は__init__が持っている
+    ns.pop("__dict__", None)
+    ns.pop("__weakref__", None)
+    ns["__slots__"] = names
+    new_cls = type(cls)(cls.__name__, cls.__bases__, ns)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+
+# 値の型はいずれも to_bytes()/from_bytes(arr) に加えて, 呼び出し側のバッファに直接
+# 読み書きする pack_into(buf, offset)/unpack_from(buf, offset) を持つ.
+# 書式はクラス毎に _STRUCT (受信用が異なる場合は _DECODE_STRUCT) として事前にコンパイルしておく.
+
+@_slots
 @dataclass
 class TriOrbBaseSystem:
     age: int = 0
     weight: int = 0
+    _STRUCT = struct.Struct("<ii")
     def to_bytes(self) -> bytes:
-        return struct.pack('<ii', self.age, self.weight)
+        return self._STRUCT.pack(self.age, self.weight)
     def from_bytes(self, arr):
-        self.age, self.weight = struct.unpack("<ii", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.age, self.weight)
+    def unpack_from(self, buf, offset=0):
+        self.age, self.weight = self._STRUCT.unpack_from(buf, offset)
+        return self
     
+@_slots
 @dataclass
 class TriOrbBaseDevice:
     max_vx: np.float32 = 0
@@ -40,39 +73,68 @@ class TriOrbBaseDevice:
     min_vx: np.float32 = 0
     min_vy: np.float32 = 0
     min_vw: np.float32 = 0
+    _STRUCT = struct.Struct("<ffffff")
     def to_bytes(self) -> bytes:
-        return struct.pack('<ffffff', self.max_vx, self.max_vy, self.max_vw, self.min_vx, self.min_vy, self.min_vw)
+        return self._STRUCT.pack(self.max_vx, self.max_vy, self.max_vw, self.min_vx, self.min_vy, self.min_vw)
     def from_bytes(self, arr):
-        self.max_vx, self.max_vy, self.max_vw, self.min_vx, self.min_vy, self.min_vw = struct.unpack("<ffffff", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.max_vx, self.max_vy, self.max_vw, self.min_vx, self.min_vy, self.min_vw)
+    def unpack_from(self, buf, offset=0):
+        self.max_vx, self.max_vy, self.max_vw, self.min_vx, self.min_vy, self.min_vw = self._STRUCT.unpack_from(buf, offset)
+        return self
 
+@_slots
 @dataclass
 class TriOrbBaseSensor:
     age: int = 0
     weight: int = 0
+    _STRUCT = struct.Struct("<ii")
     def to_bytes(self) -> bytes:
-        return struct.pack('<ii', self.age, self.weight)
+        return self._STRUCT.pack(self.age, self.weight)
     def from_bytes(self, arr):
-        self.age, self.weight = struct.unpack("<ii", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.age, self.weight)
+    def unpack_from(self, buf, offset=0):
+        self.age, self.weight = self._STRUCT.unpack_from(buf, offset)
+        return self
 
+@_slots
 @dataclass
 class TriOrbBaseError:
     alarm: np.uint8 = 0
     motor_id: np.uint8 = 0
+    _STRUCT = struct.Struct("<bb")
+    _DECODE_STRUCT = struct.Struct("<BB")
     def to_bytes(self) -> bytes:
-        return struct.pack('<bb', self.alarm, self.motor_id)
+        return self._STRUCT.pack(self.alarm, self.motor_id)
     def from_bytes(self, arr):
-        self.alarm, self.motor_id = struct.unpack("<BB", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.alarm, self.motor_id)
+    def unpack_from(self, buf, offset=0):
+        self.alarm, self.motor_id = self._DECODE_STRUCT.unpack_from(buf, offset)
+        return self
     
 
+@_slots
 @dataclass
 class TriOrbErrorStamped:
     error: np.uint8 = 0
     stamp: np.uint32 = 0
+    _STRUCT = struct.Struct("<BI")
     def to_bytes(self) -> bytes:
-        return struct.pack('<BI', self.error, self.stamp)
+        return self._STRUCT.pack(self.error, self.stamp)
     def from_bytes(self, arr):
-        self.error, self.stamp = struct.unpack("<BI", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.error, self.stamp)
+    def unpack_from(self, buf, offset=0):
+        self.error, self.stamp = self._STRUCT.unpack_from(buf, offset)
+        return self
 
+@_slots
 @dataclass
 class TriOrbErrorHistory:
     err1: TriOrbErrorStamped = field(default_factory=TriOrbErrorStamped) 
@@ -80,17 +142,27 @@ class TriOrbErrorHistory:
     err3: TriOrbErrorStamped = field(default_factory=TriOrbErrorStamped) 
     err4: TriOrbErrorStamped = field(default_factory=TriOrbErrorStamped) 
     err5: TriOrbErrorStamped = field(default_factory=TriOrbErrorStamped) 
+    _STRUCT = struct.Struct("<" + "BI"*MAX_ERROR_HIST)
+    def errors(self):
+        return [self.err1, self.err2, self.err3, self.err4, self.err5]
     def to_bytes(self) -> bytes:
-        bt = b''
-        for e in [self.err1, self.err2, self.err3, self.err4, self.err5]:
-            bt += e.to_bytes()
-        return bt
+        buf = bytearray(self._STRUCT.size)
+        self.pack_into(buf)
+        return bytes(buf)
     def from_bytes(self, arr):
-        i=0
-        for e in [self.err1, self.err2, self.err3, self.err4, self.err5]:
-            e.from_bytes(arr[5*i:5*(i+1)])
-            i+=1
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        values = []
+        for e in self.errors():
+            values += [e.error, e.stamp]
+        self._STRUCT.pack_into(buf, offset, *values)
+    def unpack_from(self, buf, offset=0):
+        values = self._STRUCT.unpack_from(buf, offset)
+        for i, e in enumerate(self.errors()):
+            e.error, e.stamp = values[2*i], values[2*i+1]
+        return self
 
+@_slots
 @dataclass
 class TriOrbDriveUSS:
     v1: np.uint8 = 255
@@ -98,12 +170,19 @@ class TriOrbDriveUSS:
     v3: np.uint8 = 255
     v4: np.uint8 = 255
     v5: np.uint8 = 255
+    _STRUCT = struct.Struct("<BBBBB")
     def to_bytes(self) -> bytes:
-        return struct.pack('<BBBBB', self.v1, self.v2, self.v3, self.v4, self.v5)
+        return self._STRUCT.pack(self.v1, self.v2, self.v3, self.v4, self.v5)
     def from_bytes(self, arr):
-        self.v1, self.v2, self.v3, self.v4, self.v5 = struct.unpack("<BBBBB", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.v1, self.v2, self.v3, self.v4, self.v5)
+    def unpack_from(self, buf, offset=0):
+        self.v1, self.v2, self.v3, self.v4, self.v5 = self._STRUCT.unpack_from(buf, offset)
+        return self
 
 
+@_slots
 @dataclass
 class TriOrbMotorParams:
     lpf:          bool = True
@@ -114,13 +193,71 @@ class TriOrbMotorParams:
     torque_filter: np.uint16 = 1000
     speed_feedforward: np.uint8 = 80
     stiffness: np.uint8 = 7
+    _STRUCT = struct.Struct("<BBBHHHBB")
+    _DECODE_STRUCT = struct.Struct("<?BBHHHBB")
+    def _values(self):
+        return (self.lpf, self.filter_t, self.pos_p_gain, self.speed_p_gain, self.speed_i_gain, self.torque_filter, self.speed_feedforward, self.stiffness)
     def to_bytes(self) -> bytes:
-        return struct.pack('<BBBHHHBB', self.lpf, self.filter_t, self.pos_p_gain, self.speed_p_gain, self.speed_i_gain, self.torque_filter, self.speed_feedforward, self.stiffness)
+        return self._STRUCT.pack(*self._values())
     def from_bytes(self, arr):
-        self.lpf, self.filter_t, self.pos_p_gain, self.speed_p_gain, self.speed_i_gain, self.torque_filter, self.speed_feedforward, self.stiffness = struct.unpack("<?BBHHHBB", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, *self._values())
+    def unpack_from(self, buf, offset=0):
+        self.lpf, self.filter_t, self.pos_p_gain, self.speed_p_gain, self.speed_i_gain, self.torque_filter, self.speed_feedforward, self.stiffness = self._DECODE_STRUCT.unpack_from(buf, offset)
+        return self
         
 
+class TriOrbStateFlag(enum.IntFlag):
+    """
+    Status word of TriOrbBaseState as received from the ECU:
+    1st byte = bit0..7, 2nd byte = bit8..15 (the from_BE=True bit order).
+    """
+    BTN_Y = 1 << 0
+    BTN_B = 1 << 1
+    BTN_A = 1 << 2
+    BTN_X = 1 << 3
+    MOVE = 1 << 4
+    IN_POS = 1 << 5
+    S_ON = 1 << 6
+    SUCCESS = 1 << 7
+    EMERGENCY = 1 << 8
+    DISABLE_GAMEPAD = 1 << 9
+    QSTOP = 1 << 10
+    FREE = 1 << 11
+    FLAG4 = 1 << 12
+    FLAG5 = 1 << 13
+    FLAG6 = 1 << 14
+    FLAG7 = 1 << 15
+
+
+# TriOrbBaseStateの状態フィールド (TriOrbStateFlagのbit0から順)
+STATE_FIELDS = ("btn_y", "btn_b", "btn_a", "btn_x", "move", "in_pos", "s_on", "success",
+                "emergency", "disable_gamepad", "qstop", "free", "flag4", "flag5", "flag6", "flag7")
+
+# 1バイト -> 8フィールド分のbool. BEはbit0が先頭のフィールド, LEはbit7が先頭のフィールド
+STATE_BITS_BE = tuple(tuple((b >> k) & 1 > 0 for k in range(8)) for b in range(256))
+STATE_BITS_LE = tuple(bits[::-1] for bits in STATE_BITS_BE)
+
+
+def decode_state_bits(raw, from_BE=True):
+    """
+    Decodes many raw status words at once.
+    raw: uint8 array (..., 2) (or (..., 3) with motor id, which is ignored)
+    of the bytes as received, e.g. Telemetry records["state"].
+    Returns a bool array (..., 16) whose columns follow STATE_FIELDS.
+    """
+    raw = np.ascontiguousarray(np.asarray(raw, dtype=np.uint8)[..., :2])
+    return np.unpackbits(raw, axis=-1, bitorder="little" if from_BE else "big").astype(bool)
+
+
+def state_words(raw):
+    """Raw status bytes (..., 2) -> uint16 words comparable with TriOrbStateFlag."""
+    raw = np.asarray(raw, dtype=np.uint8)
+    return raw[..., 0].astype(np.uint16) | (raw[..., 1].astype(np.uint16) << 8)
 
+
+@_slots
 @dataclass
 class TriOrbBaseState:
     btn_y:   bool = 0
@@ -142,13 +279,17 @@ class TriOrbBaseState:
     flag7: bool = 0
 
     motor_id: np.uint8 = 0
-    def to_bytes(self) -> bytes:
+    _STRUCT = struct.Struct("<BBB")
+    _DECODE_STRUCT = struct.Struct("<BBb")
+    def _values(self):
         hb =  self.btn_y<<7 | self.btn_b<<6 | self.btn_a<<5 | self.btn_x<<4 \
             | self.move<<3 | self.in_pos<<2 | self.s_on<<1 | self.success
         lb =  self.emergency<<7 | self.disable_gamepad<<6 | self.qstop<<5 | self.free<<4 \
             | self.flag4<<3 | self.flag5<<2 | self.flag6<<1 | self.flag7
+        return hb, lb, self.motor_id
 
-        return hb.to_bytes(length=1, byteorder=sys.byteorder) + lb.to_bytes(length=1, byteorder=sys.byteorder) + self.motor_id.to_bytes(length=1, byteorder=sys.byteorder)
+    def to_bytes(self) -> bytes:
+        return self._STRUCT.pack(*self._values())
 
 #    def from_bytes(self, arr):
 #        state, self.motor_id = struct.unpack("<bb", arr)
@@ -166,72 +307,79 @@ class TriOrbBaseState:
 #        if self.success==0:
 #            print("motor ID{} failed to read status".format(self.motor_id))
 
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, *self._values())
+
     def from_bytes(self, arr, from_BE=False):
-        state, state2, self.motor_id = struct.unpack("<bbb", arr)
-        #print("%16b\n" % state)
-        if from_BE:
-            self.btn_y  = (state & 0b00000001) > 0
-            self.btn_b  = (state & 0b00000010) > 0
-            self.btn_a  = (state & 0b00000100) > 0
-            self.btn_x  = (state & 0b00001000) > 0
-            self.move   = (state & 0b00010000) > 0
-            self.in_pos = (state & 0b00100000) > 0
-            self.s_on   = (state & 0b01000000) > 0
-            self.success= (state & 0b10000000) > 0
-
-            self.emergency = (state2 & 0b00000001) > 0
-            self.disable_gamepad = (state2 & 0b00000010) > 0
-            self.qstop = (state2 & 0b00000100) > 0
-            self.free  = (state2 & 0b00001000) > 0
-            self.flag4 = (state2 & 0b00010000) > 0
-            self.flag5 = (state2 & 0b00100000) > 0
-            self.flag6 = (state2 & 0b01000000) > 0
-            self.flag7 = (state2 & 0b10000000) > 0
-        else:
-            self.btn_y  = (state & 0b10000000) > 0
-            self.btn_b  = (state & 0b01000000) > 0
-            self.btn_a  = (state & 0b00100000) > 0
-            self.btn_x  = (state & 0b00010000) > 0
-            self.move   = (state & 0b00001000) > 0
-            self.in_pos = (state & 0b00000100) > 0
-            self.s_on   = (state & 0b00000010) > 0
-            self.success= (state & 0b00000001) > 0
-
-            self.emergency = (state2 & 0b10000000) > 0
-            self.disable_gamepad = (state2 & 0b01000000) > 0
-            self.qstop = (state2 & 0b00100000) > 0
-            self.free  = (state2 & 0b00010000) > 0
-            self.flag4 = (state2 & 0b00001000) > 0
-            self.flag5 = (state2 & 0b00000100) > 0
-            self.flag6 = (state2 & 0b00000010) > 0
-            self.flag7 = (state2 & 0b00000001) > 0
-
-        if self.success==0:
-            print("motor ID{} failed to read status".format(self.motor_id))
+        self.unpack_from(arr, 0, from_BE)
+
+    def unpack_from(self, buf, offset=0, from_BE=False):
+        return self._set_values(*self._DECODE_STRUCT.unpack_from(buf, offset), from_BE=from_BE)
+
+    def _set_values(self, state, state2, motor_id, from_BE=False):
+        # _DECODE_STRUCTで読んだ(状態1バイト目, 2バイト目, モーターID)から状態を設定する
+        self.motor_id = motor_id
+        bits = STATE_BITS_BE if from_BE else STATE_BITS_LE
+        (self.btn_y, self.btn_b, self.btn_a, self.btn_x,
+         self.move, self.in_pos, self.s_on, self.success) = bits[state]
+        (self.emergency, self.disable_gamepad, self.qstop, self.free,
+         self.flag4, self.flag5, self.flag6, self.flag7) = bits[state2]
+        if not self.success:
+            logger.warning("motor ID{} failed to read status".format(self.motor_id))
+        return self
+
+    @property
+    def flags(self):
+        """The state as TriOrbStateFlag."""
+        word = 0
+        for k, name in enumerate(STATE_FIELDS):
+            if getattr(self, name):
+                word |= 1 << k
+        return TriOrbStateFlag(word)
+
+    @classmethod
+    def from_flags(cls, flags, motor_id=0):
+        flags = int(flags)
+        return cls(*STATE_BITS_BE[flags & 0xFF], *STATE_BITS_BE[(flags >> 8) & 0xFF], motor_id)
 
     
 
+@_slots
 @dataclass
 class TriOrbDrive3Pose:
     x: np.float32 = 0.0
     y: np.float32 = 0.0
     w: np.float32 = 0.0
+    _STRUCT = struct.Struct("<fff")
     def to_bytes(self) -> bytes:
-        return struct.pack('<fff', self.x, self.y, self.w)
+        return self._STRUCT.pack(self.x, self.y, self.w)
     def from_bytes(self, arr):
-        self.x, self.y, self.w = struct.unpack("<fff", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.x, self.y, self.w)
+    def unpack_from(self, buf, offset=0):
+        self.x, self.y, self.w = self._STRUCT.unpack_from(buf, offset)
+        return self
 
+@_slots
 @dataclass
 class TriOrbDrive3Vector:
     v1: np.float32 = 0.0
     v2: np.float32 = 0.0
     v3: np.float32 = 0.0
+    _STRUCT = struct.Struct("<fff")
     def to_bytes(self) -> bytes:
-        return struct.pack('<fff', self.v1, self.v2, self.v3)
+        return self._STRUCT.pack(self.v1, self.v2, self.v3)
     def from_bytes(self, arr):
-        self.v1, self.v2, self.v3 = struct.unpack("<fff", arr)
+        self.unpack_from(arr)
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, self.v1, self.v2, self.v3)
+    def unpack_from(self, buf, offset=0):
+        self.v1, self.v2, self.v3 = self._STRUCT.unpack_from(buf, offset)
+        return self
 
 
+@_slots
 @dataclass
 class TriOrbDriveMatrix:
     #mat:  np.ndarray = np.array([[1,0,0],[0,1,0],[0,0,1]], dtype=np.float32)
@@ -245,15 +393,16 @@ class TriOrbDriveMatrix:
     #m31: np.float32 = 0.0
     #m32: np.float32 = 0.0
     #m33: np.float32 = 1.0
+    _STRUCT = struct.Struct("<fffffffff")
     def to_bytes(self) -> bytes:
-        #return struct.pack('<fffffffff', self.m11, self.m12, self.m13,
-        #                                 self.m21, self.m22, self.m23,
-        #                                 self.m31, self.m32, self.m33,
-        return struct.pack('<fffffffff', self.mat[0,0], self.mat[0,1], self.mat[0,2],
-                                         self.mat[1,0], self.mat[1,1], self.mat[1,2],
-                                         self.mat[2,0], self.mat[2,1], self.mat[2,2])
+        return self._STRUCT.pack(*np.asarray(self.mat, dtype=np.float32).reshape(9).tolist())
 
     def from_bytes(self, arr):
-        self.mat[0,0], self.mat[0,1], self.mat[0,2], self.mat[1,0], self.mat[1,1], self.mat[1,2], self.mat[2,0], self.mat[2,1], self.mat[2,2] = struct.unpack('<fffffffff', arr)
-                                         
-                                         
+        self.unpack_from(arr)
+
+    def pack_into(self, buf, offset=0):
+        self._STRUCT.pack_into(buf, offset, *np.asarray(self.mat, dtype=np.float32).reshape(9).tolist())
+
+    def unpack_from(self, buf, offset=0):
+        self.mat[:, :] = np.asarray(self._STRUCT.unpack_from(buf, offset), dtype=np.float32).reshape(3, 3)
+        return self
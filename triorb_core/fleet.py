@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .core_types import *
+from .robot import robot, find_ports
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RobotFleet:
+    """
+    Set of robots, one per serial port, driven in parallel.
+    Every robot gets its own worker thread, so broadcast operations take the
+    time of the slowest robot instead of the sum over all robots.
+    """
+
+    def __init__(self, ports=None, node=None, transports=None, **robot_kwargs):
+        self.robots = []
+        if transports is not None:
+            # ポートの代わりにpyserial互換の通信路 (SimulatedSerialなど) を使う
+            ports = ["transport{}".format(i) for i in range(len(transports))]
+        elif ports is None:
+            ports = find_ports()
+        if len(ports) == 0:
+            raise Exception("No TriOrb CDC device is found")
+        self.ports = list(ports)
+        try:
+            if transports is not None:
+                for transport in transports:
+                    self.robots.append(robot(node=node, transport=transport, **robot_kwargs))
+            else:
+                for port in self.ports:
+                    self.robots.append(robot(port, node, **robot_kwargs))
+        except Exception:
+            self.close()
+            raise
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.robots), thread_name_prefix="triorb-fleet")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.robots)
+
+    def __iter__(self):
+        return iter(self.robots)
+
+    def __getitem__(self, index):
+        return self.robots[index]
+
+    def scatter(self, method, args_list, return_exceptions=False):
+        """
+        Calls robot.<method>(*args) on every robot in parallel, args_list[i]
+        being the arguments of the i-th robot, and returns the results in
+        fleet order. Every call is completed even if some fail; the first
+        exception is raised afterwards unless return_exceptions is True.
+        """
+        if len(args_list) != len(self.robots):
+            raise ValueError("args_list must have one entry per robot")
+        futures = [self._executor.submit(getattr(r, method), *args)
+                   for r, args in zip(self.robots, args_list)]
+        return self._gather(method, futures, return_exceptions)
+
+    def broadcast(self, method, *args, return_exceptions=False, **kwargs):
+        """Calls robot.<method>(*args, **kwargs) on every robot in parallel."""
+        futures = [self._executor.submit(getattr(r, method), *args, **kwargs)
+                   for r in self.robots]
+        return self._gather(method, futures, return_exceptions)
+
+    def _gather(self, method, futures, return_exceptions):
+        results = []
+        error = None
+        for port, f in zip(self.ports, futures):
+            try:
+                results.append(f.result())
+            except Exception as e:
+                logger.error("{}: {} failed: {}".format(port, method, e))
+                results.append(e)
+                if error is None:
+                    error = e
+        if error is not None and not return_exceptions:
+            raise error
+        return results
+
+    def wakeup_all(self):
+        return self.broadcast("wakeup")
+
+    def sleep_all(self):
+        return self.broadcast("sleep")
+
+    def brake_all(self):
+        # 一台が失敗しても残りは必ず停止させる
+        return self.broadcast("brake", return_exceptions=True)
+
+    def get_pose_all(self):
+        """Returns the poses of all robots as an (N, 3) float32 array of (x, y, w). Failed reads are NaN."""
+        poses = np.full((len(self.robots), 3), np.nan, dtype=np.float32)
+        for i, res in enumerate(self.broadcast("get_pos", return_exceptions=True)):
+            if isinstance(res, list) and len(res) > 0 and isinstance(res[0], TriOrbDrive3Pose):
+                poses[i] = (res[0].x, res[0].y, res[0].w)
+        return poses
+
+    def close(self):
+        """Turns off the excitation of all robots and closes their ports."""
+        executor = getattr(self, "_executor", None)
+        if executor is not None:
+            # 閉じた後に各robotの__del__からsleep()が送られないよう, ここで送っておく
+            self.broadcast("sleep", return_exceptions=True)
+            executor.shutdown(wait=True)
+            self._executor = None
+        for r in self.robots:
+            r.close_serial()
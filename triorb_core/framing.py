@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .codec import get_type_codec, to_bytes
+import threading
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+FRAME_HEADER = b"\x00"
+FRAME_TERMINATOR = b"\x0d\x0a"
+WRONG_PACKET_FRAME = b"\x00\x0d\x0a"  # 不正なパケットを送った場合の応答
+FRAME_LAYOUT_CACHE_SIZE = 128
+FRAME_OVERHEAD = len(FRAME_HEADER) + len(FRAME_TERMINATOR)
+CODE_SIZE = 2
+
+
+def response_length(sizes):
+    """Length of a response frame carrying values of the given sizes."""
+    return sum(sizes) + len(sizes)*CODE_SIZE + FRAME_OVERHEAD
+
+
+def plan_frames(entries, max_packet_size):
+    """Splits [code, value bytes] entries into as few frames as max_packet_size allows, keeping their order."""
+    frames = []
+    frame = []
+    size = FRAME_OVERHEAD
+    for entry in entries:
+        n = CODE_SIZE + len(entry[1])
+        if frame and size + n > max_packet_size:
+            frames.append(frame)
+            frame = []
+            size = FRAME_OVERHEAD
+        frame.append(entry)
+        size += n
+    if frame:
+        frames.append(frame)
+    return frames
+
+
+class ReadPlan:
+    """
+    Frames of a set of [code, value bytes] read entries (packed by plan_frames())
+    and the offset of every code and value in their responses, so that the
+    values can be decoded from the raw response frames without parsing them.
+    """
+
+    def __init__(self, entries, max_packet_size):
+        self.queries = plan_frames(entries, max_packet_size)
+        self.lengths = []
+        code_offsets, codes, frame_of = [], [], []
+        base = 0  # 全応答フレームを連結したバッファ内での位置
+        for n, query in enumerate(self.queries):
+            offset = base + len(FRAME_HEADER)
+            for code, val in query:
+                code_offsets.append(offset)
+                codes.append(code.value)
+                frame_of.append(n)
+                offset += CODE_SIZE + len(val)
+            self.lengths.append(offset + len(FRAME_TERMINATOR) - base)
+            base = offset + len(FRAME_TERMINATOR)
+        self.size = base
+        self.code_offsets = np.array(code_offsets, dtype=np.intp)
+        self.value_offsets = self.code_offsets + CODE_SIZE
+        self.codes = np.array(codes, dtype=np.uint16)
+        self.frame_of = np.array(frame_of, dtype=np.intp)
+
+    def read(self, responses):
+        """
+        Joins the raw response frames into one buffer. Returns (buffer, ok)
+        where ok is False for the entries of a missing or malformed frame, or
+        answered with another code.
+        """
+        buf = np.zeros(self.size, dtype=np.uint8)
+        frame_ok = np.zeros(len(self.lengths), dtype=bool)
+        base = 0
+        for n, length in enumerate(self.lengths):
+            frame = responses[n] if n < len(responses) else None
+            if isinstance(frame, (bytes, bytearray)) and len(frame) == length:
+                buf[base:base + length] = np.frombuffer(frame, dtype=np.uint8)
+                frame_ok[n] = True
+            base += length
+        codes = buf[self.code_offsets] | (buf[self.code_offsets + 1].astype(np.uint16) << 8)
+        return buf, frame_ok[self.frame_of] & (codes == self.codes)
+
+    def values(self, buf, index, dtype, count=1):
+        """Values of the entries selected by index, count values of dtype each. Returns an array of shape (entries, count)."""
+        dtype = np.dtype(dtype)
+        offsets = self.value_offsets[index]
+        return buf[offsets[:, None] + np.arange(dtype.itemsize*count)].view(dtype)
+
+
+class FrameLayout:
+    """
+    Preallocated frame of one query shape (sequence of codes and value types).
+    Header, codes and terminator are written once; pack() only writes the values.
+    """
+    __slots__ = ("buffer", "view", "slots", "expected_values", "expected_size", "_lock")
+
+    def __init__(self, entries):
+        pos = len(FRAME_HEADER)
+        parts = []
+        self.expected_values = []
+        self.expected_size = []
+        for _code, _value in entries:
+            _code_bytes = _code if isinstance(_code, bytes) else to_bytes(_code)
+            if isinstance(_value, bytes):
+                codec, vlen = None, len(_value)
+            else:
+                codec = get_type_codec(type(_value))
+                if codec is None:
+                    raise Exception("Unknown type")
+                vlen = codec.size
+            parts.append((_code_bytes, pos + len(_code_bytes), codec, vlen))
+            pos += len(_code_bytes) + vlen
+            self.expected_values.append(_code)
+            self.expected_size.append(vlen)
+
+        self.buffer = bytearray(pos + len(FRAME_TERMINATOR))
+        self.view = memoryview(self.buffer)
+        self.buffer[:len(FRAME_HEADER)] = FRAME_HEADER
+        self.buffer[-len(FRAME_TERMINATOR):] = FRAME_TERMINATOR
+        self.slots = []
+        for _code_bytes, offset, codec, vlen in parts:
+            self.buffer[offset-len(_code_bytes):offset] = _code_bytes
+            self.slots.append((offset, offset+vlen, codec))
+        self._lock = threading.Lock()
+
+    def pack(self, values):
+        view = self.view
+        with self._lock:
+            for (start, end, codec), _value in zip(self.slots, values):
+                if codec is None:
+                    view[start:end] = _value
+                else:
+                    codec.pack_into(view, start, _value)
+            return bytes(self.buffer)
+
+
+class FrameBuilder:
+    """Builds request frames, caching one FrameLayout per query shape."""
+
+    def __init__(self, max_layouts=FRAME_LAYOUT_CACHE_SIZE):
+        self._layouts = {}
+        self._max_layouts = max_layouts
+
+    def layout(self, entries):
+        key = tuple(
+            (_code, bytes, len(_value)) if isinstance(_value, bytes) else (_code, type(_value))
+            for _code, _value in entries)
+        layout = self._layouts.get(key)
+        if layout is None:
+            layout = FrameLayout(entries)
+            if len(self._layouts) >= self._max_layouts:
+                self._layouts.pop(next(iter(self._layouts)))
+            self._layouts[key] = layout
+        return layout
+
+    def build(self, code_array):
+        """Returns (frame, expected response codes, expected response value sizes)."""
+        entries = []
+        for code_value in code_array:
+            if not isinstance(code_value, list):
+                logger.debug(
+                    "Since it's only a communication code, I will add value=0x00.")
+                code_value = [code_value, 0x00]
+            entries.append(code_value)
+        layout = self.layout(entries)
+        frame = layout.pack([_value for _code, _value in entries])
+        return frame, layout.expected_values, layout.expected_size
+
+
+class FrameParser:
+    """
+    Incremental, resynchronizing splitter of response frames.
+    Partial reads are appended to one reusable bytearray with feed(), and
+    next_frame() returns a complete frame or None until enough bytes arrived.
+    A frame of the expected length ends exactly there, so values containing
+    0x0d0a are not mistaken for its end. A shorter frame (codes the ECU could
+    not read) is walked code by code when the expected `codes` and `sizes`
+    are given, skipping every value by its size. When `prefix` (header +
+    echoed first code) is given, bytes that cannot start the expected
+    response are discarded instead of corrupting the following frames. Each
+    discard and each frame shorter than expected is counted in `resyncs`.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.resyncs = 0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return len(self._buf)
+
+    def feed(self, data):
+        self._buf += data
+
+    def clear(self):
+        """Discards the buffered bytes and returns them."""
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+    def next_frame(self, expected_length=None, prefix=None, codes=None, sizes=None):
+        """Returns the next frame (bytes), or None if it is not complete yet."""
+        buf = self._buf
+        if prefix is not None and not self._sync(prefix):
+            return None
+        if buf.startswith(WRONG_PACKET_FRAME):
+            return self._take(len(WRONG_PACKET_FRAME))
+        if expected_length is None:
+            end = buf.find(FRAME_TERMINATOR)
+            return None if end < 0 else self._take(end + len(FRAME_TERMINATOR))
+
+        if len(buf) < expected_length:
+            return None
+        if buf.startswith(FRAME_TERMINATOR, expected_length - len(FRAME_TERMINATOR)):
+            return self._take(expected_length)
+        # 期待長で終端していない (読めないコードを含む短い応答, 欠落など)
+        end = None if codes is None else self._short_end(codes, sizes)
+        if end is not None:
+            self.resyncs += 1
+            return self._take(end)
+        # コードの並びで辿れない場合は, 次のフレームの先頭が続く最初の終端を境界とする
+        pos = len(FRAME_HEADER)
+        while True:
+            end = buf.find(FRAME_TERMINATOR, pos)
+            if end < 0:
+                return None
+            end += len(FRAME_TERMINATOR)
+            if end == len(buf) or buf.startswith(FRAME_HEADER, end):
+                self.resyncs += 1
+                return self._take(end)
+            pos = end
+
+    def flush(self, codes=None, sizes=None):
+        """
+        Returns the first terminated frame regardless of its length, or None.
+        Used when the line went idle before a frame of the expected length arrived.
+        With the expected `codes` and `sizes`, the frame is walked code by code as in next_frame().
+        """
+        end = None if codes is None else self._short_end(codes, sizes)
+        if end is not None:
+            self.resyncs += 1
+            return self._take(end)
+        end = self._buf.find(FRAME_TERMINATOR)
+        if end < 0:
+            return None
+        self.resyncs += 1
+        return self._take(end + len(FRAME_TERMINATOR))
+
+    def _short_end(self, codes, sizes):
+        """
+        End of a response echoing a subsequence of `codes` in order, each
+        followed by its value of `sizes` or, for a code the ECU could not
+        read, by nothing. Values are skipped by their size, so a value
+        containing 0x0d0a does not end the frame. The frame must be followed
+        by the next frame or by nothing. Returns None if there is no such frame.
+        """
+        buf = self._buf
+        codes = [c if isinstance(c, bytes) else to_bytes(c) for c in codes]
+        # 値ありを先に辿る. 値なし(読めなかったコード)は値ありで辿れない場合のみ
+        stack = [(len(FRAME_HEADER), 0)]
+        while stack:
+            pos, k = stack.pop()
+            if len(buf) < pos + len(FRAME_TERMINATOR):
+                continue
+            if buf.startswith(FRAME_TERMINATOR, pos):
+                end = pos + len(FRAME_TERMINATOR)
+                if end == len(buf) or buf.startswith(FRAME_HEADER, end):
+                    return end
+                continue
+            for j in range(k, len(codes)):
+                if buf.startswith(codes[j], pos):
+                    stack.append((pos + CODE_SIZE, j + 1))
+                    stack.append((pos + CODE_SIZE + sizes[j], j + 1))
+                    break
+        return None
+
+    def can_start(self, prefix):
+        """True if the buffered bytes may be the start of a response beginning with prefix."""
+        buf = self._buf
+        return self._match(buf, 0, prefix) or self._match(buf, 0, WRONG_PACKET_FRAME)
+
+    def _sync(self, prefix):
+        """Drops leading bytes that cannot start the expected response. Returns True if in sync."""
+        buf = self._buf
+        if self.can_start(prefix):
+            return True
+        # 0x00 0x0d 0x0aは値が0x00で終わるフレームの末尾と区別できないので, 再同期はprefixでのみ行う
+        pos = 1
+        while True:
+            pos = buf.find(FRAME_HEADER, pos)
+            if pos < 0:
+                pos = len(buf)
+                break
+            if self._match(buf, pos, prefix):
+                break
+            pos += 1
+        self.resyncs += 1
+        self.dropped_bytes += pos
+        logger.warning("Resync: drop {} bytes".format(pos))
+        del buf[:pos]
+        return len(buf) > 0
+
+    @staticmethod
+    def _match(buf, pos, head):
+        n = min(len(buf) - pos, len(head))
+        return buf[pos:pos+n] == head[:n]
+
+    def _take(self, end):
+        buf = self._buf
+        with memoryview(buf) as view:
+            frame = bytes(view[:end])
+        del buf[:end]  # bytearrayの先頭の削除はコピーを伴わない
+        return frame
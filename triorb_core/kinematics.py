@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# 機体速度は set_vel_* と同じく vx, vy: [m/s], vw: [rad/s]
+# 車輪速度の単位は KINEMATICS 行列に従う
+
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+BODY_AXES = ("vx", "vy", "vw")
+LIMIT_TOLERANCE = 1e-9  # 制限値との比較の相対許容誤差. scale_to_limits()の丸め誤差を違反としない
+
+
+def _matrix(value):
+    if hasattr(value, "mat"):
+        value = value.mat
+    mat = np.array(value, dtype=np.float64).reshape(3, 3)
+    mat.flags.writeable = False
+    return mat
+
+
+class Kinematics:
+    """
+    Host-side model of the drive kinematics.
+    `matrix` (KINEMATICS) maps the body velocity (vx, vy, vw) to the three
+    wheel speeds; `trans` (KINEMATICS_TRANS) is applied to the body velocity
+    before it. An all-zero `trans` (not set) is taken as the identity.
+    The combined matrix and its inverse are computed once, and every method
+    works on arrays of (..., 3) commands.
+    `limits` is a TriOrbBaseDevice: min_v <= v <= max_v per axis; an axis
+    whose max and min are both 0 (not reported) is not checked.
+    `wheel_limit` is the largest absolute wheel speed (None: not checked).
+    """
+
+    def __init__(self, matrix, trans=None, limits=None, wheel_limit=None):
+        self.matrix = _matrix(matrix)
+        trans = np.identity(3) if trans is None else _matrix(trans)
+        if not trans.any():
+            trans = np.identity(3)
+        self.trans = _matrix(trans)
+        self.forward = _matrix(self.matrix @ self.trans)
+        try:
+            inverse = np.linalg.inv(self.forward)
+        except np.linalg.LinAlgError:
+            logger.warning("Kinematics matrix is singular. The pseudo-inverse is used.")
+            inverse = np.linalg.pinv(self.forward)
+        self.inverse = _matrix(inverse)
+        # 行ベクトルの列に右から掛ける形で持っておく
+        self._forward_t = self.forward.T
+        self._inverse_t = self.inverse.T
+
+        self.limits = limits
+        if limits is None:
+            self.max_vel = np.full(3, np.inf)
+            self.min_vel = np.full(3, -np.inf)
+        else:
+            self.max_vel = np.array([limits.max_vx, limits.max_vy, limits.max_vw], dtype=np.float64)
+            self.min_vel = np.array([limits.min_vx, limits.min_vy, limits.min_vw], dtype=np.float64)
+            unset = (self.max_vel == 0) & (self.min_vel == 0)
+            self.max_vel[unset] = np.inf
+            self.min_vel[unset] = -np.inf
+        self._max_checked = self.max_vel + np.abs(self.max_vel) * LIMIT_TOLERANCE
+        self._min_checked = self.min_vel - np.abs(self.min_vel) * LIMIT_TOLERANCE
+        self.wheel_limit = wheel_limit
+
+    def to_wheel(self, vel):
+        """Wheel speeds (..., 3) of body velocities (..., 3)."""
+        return np.asarray(vel, dtype=np.float64) @ self._forward_t
+
+    def to_body(self, wheel):
+        """Body velocities (..., 3) of wheel speeds (..., 3)."""
+        return np.asarray(wheel, dtype=np.float64) @ self._inverse_t
+
+    def violations(self, vel):
+        """
+        Bool array (..., 4): vx, vy, vw outside the device limits and the
+        wheel speed limit exceeded.
+        """
+        vel = np.asarray(vel, dtype=np.float64)
+        out = np.zeros(vel.shape[:-1] + (4,), dtype=bool)
+        out[..., :3] = (vel > self._max_checked) | (vel < self._min_checked)
+        if self.wheel_limit is not None:
+            out[..., 3] = np.abs(self.to_wheel(vel)).max(axis=-1) > self.wheel_limit * (1 + LIMIT_TOLERANCE)
+        return out
+
+    def feasible(self, vel):
+        """Bool array (...,): True where the command is within all limits."""
+        return ~self.violations(vel).any(axis=-1)
+
+    def check_profile(self, vel):
+        """
+        Raises an Exception naming the first command of a velocity profile
+        (N, 3) that is outside the limits. Call it before sending the profile.
+        """
+        vel = np.asarray(vel, dtype=np.float64).reshape(-1, 3)
+        bad = self.violations(vel)
+        rows = np.flatnonzero(bad.any(axis=-1))
+        if len(rows) == 0:
+            return
+        i = rows[0]
+        axes = [name for name, b in zip(BODY_AXES + ("wheel",), bad[i]) if b]
+        raise Exception("Velocity profile exceeds the limits at {} of {} commands ({}): {}".format(
+            i, len(vel), ", ".join(axes), vel[i].tolist()))
+
+    def scale_to_limits(self, vel):
+        """
+        Scales each command (..., 3) down, keeping its direction, so that it is
+        within the limits. Assumes min_v <= 0 <= max_v.
+        """
+        vel = np.asarray(vel, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(vel > 0, self.max_vel / vel, np.where(vel < 0, self.min_vel / vel, np.inf))
+            scale = np.minimum(ratio.min(axis=-1), 1.0)
+            if self.wheel_limit is not None:
+                peak = np.abs(self.to_wheel(vel)).max(axis=-1)
+                scale = np.minimum(scale, np.where(peak > 0, self.wheel_limit / peak, 1.0))
+        return vel * scale[..., None]
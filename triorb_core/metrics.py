@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import threading
+import time
+import weakref
+import logging
+logger = logging.getLogger(__name__)
+
+
+HIST_SUB_BUCKET_BITS = 4  # 1オクターブを16分割 (相対誤差 約6%)
+HIST_MAX_US = 100_000_000  # これより長い値は最後のバケットに入れる [us]
+METRIC_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+_SUB_BUCKETS = 1 << HIST_SUB_BUCKET_BITS
+_LINEAR_LIMIT = _SUB_BUCKETS * 2
+
+
+def _bucket_index(us):
+    if us < _LINEAR_LIMIT:
+        return us
+    shift = us.bit_length() - HIST_SUB_BUCKET_BITS - 1
+    return _LINEAR_LIMIT + (shift - 1) * _SUB_BUCKETS + (us >> shift) - _SUB_BUCKETS
+
+
+def _bucket_upper(index):
+    """Largest value [us] falling into the bucket."""
+    if index < _LINEAR_LIMIT:
+        return index
+    shift = (index - _LINEAR_LIMIT) // _SUB_BUCKETS + 1
+    m = (index - _LINEAR_LIMIT) % _SUB_BUCKETS + _SUB_BUCKETS
+    return ((m + 1) << shift) - 1
+
+
+_NUM_BUCKETS = _bucket_index(HIST_MAX_US) + 1
+
+
+class LatencyHistogram:
+    """
+    HDR-style latency histogram with log-linear buckets of 1 us resolution
+    at the bottom and about 6% relative error above. Recording is O(1) and
+    the memory is fixed, regardless of the number of samples.
+    """
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        if us < 0:
+            us = 0
+        self.counts[_bucket_index(us) if us < HIST_MAX_US else _NUM_BUCKETS - 1] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Value [s] below which a fraction q of the samples fall (upper edge of the bucket)."""
+        if self.count == 0:
+            return None
+        rank = max(q * self.count, 1)
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(_bucket_upper(index) * 1e-6, self.max)
+        return self.max
+
+    def snapshot(self):
+        snap = {"count": self.count,
+                "sum": self.total,
+                "min": self.min,
+                "max": self.max,
+                "mean": self.total / self.count if self.count else None}
+        for q in METRIC_QUANTILES:
+            snap["p{:g}".format(q * 100)] = self.percentile(q)
+        return snap
+
+
+def code_label(code):
+    if hasattr(code, "name"):
+        return code.name
+    if isinstance(code, bytes):
+        return "0x{:04x}".format(int.from_bytes(code, "little"))
+    return str(code)
+
+
+class Metrics:
+    """
+    Latency histograms and throughput counters of a robot.
+    Every request is timed in three phases per (first) code: "tx" (writing
+    the frame), "wait" (until the response frame is complete) and "parse"
+    (decoding it). Recording does nothing while `enabled` is False.
+    """
+
+    def __init__(self, enabled=True, clock=time.perf_counter):
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._robot = None
+        self.reset()
+
+    def bind(self, robot):
+        """Reads robot.resyncs when a snapshot is taken. The robot is referenced weakly."""
+        self._robot = weakref.ref(robot)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}  # (phase, code): LatencyHistogram
+            self.frames_tx = 0
+            self.frames_rx = 0
+            self.bytes_tx = 0
+            self.bytes_rx = 0
+            self.timeouts = 0
+            self.started = self._clock()
+
+    def _histogram(self, phase, code):
+        hist = self.histograms.get((phase, code))
+        if hist is None:
+            hist = self.histograms[(phase, code)] = LatencyHistogram()
+        return hist
+
+    def observe_tx(self, code, seconds, nbytes):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histogram("tx", code).record(seconds)
+            self.frames_tx += 1
+            self.bytes_tx += nbytes
+
+    def observe_rx(self, code, wait, parse, nbytes):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histogram("wait", code).record(wait)
+            self._histogram("parse", code).record(parse)
+            self.frames_rx += 1
+            self.bytes_rx += nbytes
+
+    def count_timeout(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        """Returns the counters and per-code latency statistics [s] as a dict."""
+        robot = None if self._robot is None else self._robot()
+        with self._lock:
+            elapsed = self._clock() - self.started
+            latency = {}
+            for (phase, code), hist in self.histograms.items():
+                latency.setdefault(code_label(code), {})[phase] = hist.snapshot()
+            return {"elapsed": elapsed,
+                    "frames_tx": self.frames_tx,
+                    "frames_rx": self.frames_rx,
+                    "bytes_tx": self.bytes_tx,
+                    "bytes_rx": self.bytes_rx,
+                    "timeouts": self.timeouts,
+                    "resyncs": 0 if robot is None else robot.resyncs,
+                    "frames_per_second": self.frames_rx / elapsed if elapsed > 0 else 0.0,
+                    "latency": latency}
+
+    def to_prometheus(self, prefix="triorb"):
+        """Returns the snapshot in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        for name, kind, help_text in (
+                ("frames_tx", "counter", "Frames written"),
+                ("frames_rx", "counter", "Response frames received"),
+                ("bytes_tx", "counter", "Bytes written"),
+                ("bytes_rx", "counter", "Bytes received"),
+                ("timeouts", "counter", "Responses that timed out"),
+                ("resyncs", "counter", "Resynchronizations of the response stream"),
+                ("frames_per_second", "gauge", "Received frames per second since reset")):
+            metric = "{}_{}{}".format(prefix, name, "_total" if kind == "counter" else "")
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} {}".format(metric, kind))
+            lines.append("{} {}".format(metric, snap[name]))
+
+        metric = "{}_latency_seconds".format(prefix)
+        lines.append("# HELP {} Latency of each request phase".format(metric))
+        lines.append("# TYPE {} summary".format(metric))
+        for code, phases in sorted(snap["latency"].items()):
+            for phase, stats in sorted(phases.items()):
+                labels = 'code="{}",phase="{}"'.format(code, phase)
+                for q in METRIC_QUANTILES:
+                    value = stats["p{:g}".format(q * 100)]
+                    lines.append('{}{{{},quantile="{:g}"}} {}'.format(metric, labels, q, value))
+                lines.append("{}_sum{{{}}} {}".format(metric, labels, stats["sum"]))
+                lines.append("{}_count{{{}}} {}".format(metric, labels, stats["count"]))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import math
+
+
+def trapezoid_time(distance, vel, acc_time=0.0, dec_time=0.0):
+    """
+    Duration of a trapezoidal move [s].
+    distance: [m] or [rad], vel: max speed, acc_time/dec_time: time to reach/leave vel [s]
+    """
+    distance = abs(distance)
+    if distance == 0.0:
+        return 0.0
+    if vel is None or vel <= 0.0:
+        return None
+    ramp = vel * (acc_time + dec_time) / 2.0  # 加減速区間の移動量
+    if distance >= ramp:
+        return acc_time + dec_time + (distance - ramp) / vel
+    # 最高速度に達しない三角形プロファイル
+    peak = vel * math.sqrt(distance / ramp)
+    return peak * (acc_time + dec_time) / vel
+
+
+def predict_move_time(x, y, w, acc=None, dec=None, vel_xy=None, vel_w=None):
+    """
+    Predicts the duration of set_pos_relative(x, y, w, ...) [s].
+    x, y: [m], w: [deg], acc/dec: [ms], vel_xy: [m/s], vel_w: [rad/s].
+    Missing acc/dec are treated as 0, so the result is a lower bound.
+    Returns None if a needed speed is unknown.
+    """
+    acc_time = 0.0 if acc is None else acc / 1000.0
+    dec_time = 0.0 if dec is None else dec / 1000.0
+    t_xy = trapezoid_time(math.hypot(x, y), vel_xy, acc_time, dec_time)
+    t_w = trapezoid_time(math.radians(w), vel_w, acc_time, dec_time)
+    if t_xy is None or t_w is None:
+        return None
+    return max(t_xy, t_w)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# 姿勢は robot と同じく x, y: [m], w: [deg]
+
+import threading
+import time
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+POSE_HISTORY_DTYPE = np.dtype([("t", "<f8"), ("pose", "<f4", (3,))])
+POSE_HISTORY_CAPACITY = 1024
+
+
+def compose(base, delta):
+    """
+    SE(2) composition: the pose reached by moving `delta` (in the frame of
+    `base`) from `base`. Both are arrays of (..., 3) poses and broadcast.
+    """
+    base = np.asarray(base, dtype=np.float64)
+    delta = np.asarray(delta, dtype=np.float64)
+    th = np.radians(base[..., 2])
+    c, s = np.cos(th), np.sin(th)
+    out = np.empty(np.broadcast(base, delta).shape)
+    out[..., 0] = base[..., 0] + c * delta[..., 0] - s * delta[..., 1]
+    out[..., 1] = base[..., 1] + s * delta[..., 0] + c * delta[..., 1]
+    out[..., 2] = base[..., 2] + delta[..., 2]
+    return out
+
+
+def relative(base, pose):
+    """Inverse of compose(): `pose` expressed in the frame of `base`."""
+    base = np.asarray(base, dtype=np.float64)
+    pose = np.asarray(pose, dtype=np.float64)
+    th = np.radians(base[..., 2])
+    c, s = np.cos(th), np.sin(th)
+    dx = pose[..., 0] - base[..., 0]
+    dy = pose[..., 1] - base[..., 1]
+    out = np.empty(np.broadcast(base, pose).shape)
+    out[..., 0] = c * dx + s * dy
+    out[..., 1] = -s * dx + c * dy
+    out[..., 2] = pose[..., 2] - base[..., 2]
+    return out
+
+
+def chain(start, deltas):
+    """
+    Poses reached by applying the relative moves `deltas` (N, 3) one after
+    another from `start`. Returns (N, 3); the n-th row is start + deltas[:n+1].
+    """
+    start = np.asarray(start, dtype=np.float64)
+    deltas = np.asarray(deltas, dtype=np.float64).reshape(-1, 3)
+    # 各移動の開始時の向き
+    heading = start[2] + np.concatenate(([0.0], np.cumsum(deltas[:-1, 2])))
+    th = np.radians(heading)
+    c, s = np.cos(th), np.sin(th)
+    out = np.empty_like(deltas)
+    out[:, 0] = start[0] + np.cumsum(c * deltas[:, 0] - s * deltas[:, 1])
+    out[:, 1] = start[1] + np.cumsum(s * deltas[:, 0] + c * deltas[:, 1])
+    out[:, 2] = heading + deltas[:, 2]
+    return out
+
+
+def unwrap_deg(w):
+    """Removes the +-360 [deg] jumps of a heading sequence."""
+    return np.degrees(np.unwrap(np.radians(np.asarray(w, dtype=np.float64))))
+
+
+class PoseHistory:
+    """
+    Timestamped poses in a growable NumPy buffer (t [s] + float32 x, y, w,
+    20 bytes per sample). Derivatives and resampling are computed on the
+    whole history at once; the heading is unwrapped first.
+    """
+
+    def __init__(self, capacity=POSE_HISTORY_CAPACITY):
+        self._buffer = np.zeros(max(int(capacity), 1), dtype=POSE_HISTORY_DTYPE)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def t(self):
+        """Timestamps [s] (a view; valid until the next append)."""
+        return self._buffer["t"][:self._count]
+
+    @property
+    def poses(self):
+        """(N, 3) poses (a view; valid until the next append)."""
+        return self._buffer["pose"][:self._count]
+
+    def records(self):
+        """Returns the samples as a structured array (a copy)."""
+        with self._lock:
+            return self._buffer[:self._count].copy()
+
+    def _reserve(self, n):
+        need = self._count + n
+        # load(mmap_mode=...)で開いたファイルには書き込まず, 最初の追加時に複製する
+        if need > len(self._buffer) or isinstance(self._buffer, np.memmap):
+            grown = np.zeros(max(need, len(self._buffer) * 2), dtype=POSE_HISTORY_DTYPE)
+            grown[:self._count] = self._buffer[:self._count]
+            self._buffer = grown
+
+    def append(self, t, pose):
+        """Appends one pose (TriOrbDrive3Pose or (x, y, w)) taken at t [s]."""
+        if hasattr(pose, "x"):
+            pose = (pose.x, pose.y, pose.w)
+        with self._lock:
+            self._reserve(1)
+            self._buffer[self._count] = (t, pose)
+            self._count += 1
+
+    def extend(self, t, poses):
+        """Appends N poses (N, 3) taken at t (N,), e.g. Telemetry.window()["t"], ["pose"]."""
+        t = np.asarray(t, dtype=np.float64).reshape(-1)
+        poses = np.asarray(poses, dtype=np.float32).reshape(-1, 3)
+        if len(t) != len(poses):
+            raise Exception("t and poses must have the same length")
+        with self._lock:
+            self._reserve(len(t))
+            self._buffer["t"][self._count:self._count+len(t)] = t
+            self._buffer["pose"][self._count:self._count+len(t)] = poses
+            self._count += len(t)
+
+    def record(self, robot):
+        """Reads the pose with robot.get_pos() and appends it. Returns the pose, or None on failure."""
+        t = time.monotonic()
+        values = robot.get_pos()
+        if not isinstance(values, list) or len(values) == 0:
+            return None
+        self.append(t, values[0])
+        return values[0]
+
+    def clear(self):
+        with self._lock:
+            self._count = 0
+
+    def _series(self):
+        with self._lock:
+            t = self._buffer["t"][:self._count].copy()
+            poses = self._buffer["pose"][:self._count].astype(np.float64)
+        poses[:, 2] = unwrap_deg(poses[:, 2])
+        return t, poses
+
+    def velocity(self, body=False):
+        """
+        (N, 3) velocity [m/s, m/s, deg/s] by central differences.
+        With body=True vx, vy are expressed in the robot frame.
+        """
+        t, poses = self._series()
+        vel = self._gradient(poses, t)
+        if body:
+            th = np.radians(poses[:, 2])
+            c, s = np.cos(th), np.sin(th)
+            vx, vy = vel[:, 0].copy(), vel[:, 1].copy()
+            vel[:, 0] = c * vx + s * vy
+            vel[:, 1] = -s * vx + c * vy
+        return vel
+
+    def acceleration(self):
+        """(N, 3) acceleration [m/s^2, m/s^2, deg/s^2] in the world frame."""
+        t, poses = self._series()
+        return self._gradient(self._gradient(poses, t), t)
+
+    @staticmethod
+    def _gradient(values, t):
+        if len(t) < 2:
+            return np.zeros((len(t), 3))
+        return np.gradient(values, t, axis=0)
+
+    def resample(self, rate, start=None, end=None):
+        """
+        Linearly interpolates the history at a fixed `rate` [Hz].
+        Returns (t (M,), poses (M, 3)); the heading is unwrapped.
+        """
+        t, poses = self._series()
+        if len(t) == 0:
+            return np.zeros(0), np.zeros((0, 3))
+        start = t[0] if start is None else start
+        end = t[-1] if end is None else end
+        t_new = np.arange(start, end + 0.5 / rate, 1.0 / rate)
+        out = np.empty((len(t_new), 3))
+        for k in range(3):
+            out[:, k] = np.interp(t_new, t, poses[:, k])
+        return t_new, out
+
+    def save(self, path):
+        """Saves the samples as a .npy structured array."""
+        np.save(path, self.records())
+
+    def save_memmap(self, path):
+        """Writes the samples to a .npy file through a memory map and returns the map."""
+        records = self.records()
+        mm = np.lib.format.open_memmap(path, mode="w+", dtype=POSE_HISTORY_DTYPE, shape=records.shape)
+        mm[:] = records
+        mm.flush()
+        return mm
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """
+        Loads a history saved by save()/save_memmap(). With mmap_mode ("r", ...)
+        the samples stay in the file until the first append()/extend(), which
+        copies them into memory; the file is never written.
+        """
+        records = np.load(path, mmap_mode=mmap_mode)
+        if records.dtype != POSE_HISTORY_DTYPE:
+            raise Exception("Not a pose history: {}".format(path))
+        history = cls(capacity=1)
+        history._buffer = records
+        history._count = len(records)
+        return history
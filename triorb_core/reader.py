@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .framing import FrameParser, FRAME_HEADER, WRONG_PACKET_FRAME, response_length
+import collections
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+import logging
+logger = logging.getLogger(__name__)
+
+
+READ_CHUNK_SIZE = 256
+
+
+class PendingResponse:
+    __slots__ = ("codes", "sizes", "first_code", "parse", "expected_length", "prefix", "future", "written")
+
+    def __init__(self, codes, sizes, first_code, parse=None):
+        self.codes = codes
+        self.sizes = sizes
+        self.first_code = first_code
+        self.parse = parse
+        self.expected_length = response_length(sizes)
+        self.prefix = None if first_code is None else FRAME_HEADER + first_code
+        self.future = Future()
+        self.written = time.perf_counter()
+
+    def matches(self, frame):
+        if self.first_code is None:
+            return True
+        return frame[1:3] == self.first_code
+
+
+class ResponseReader:
+    """
+    Background thread owning the read side of the UART.
+    Bytes are read in chunks, split into 0x0d0a terminated frames and handed
+    to the pending requests in the order the requests were written.
+    """
+
+    def __init__(self, uart, parse, chunk_size=READ_CHUNK_SIZE, metrics=None, on_read=None):
+        self._uart = uart
+        self._parse = parse  # parse(frame, codes, sizes) -> values
+        self._metrics = metrics
+        self._on_read = on_read  # on_read(bytes). 受信したバイト列を分割前に渡す
+        self._chunk_size = chunk_size
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._frames = FrameParser()
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="triorb-rx", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        with self._lock:
+            while self._pending:
+                fut = self._pending.popleft().future
+                if not fut.done():
+                    fut.set_exception(ConnectionError("response reader stopped"))
+
+    def expect(self, codes, sizes, first_code=None, parse=None):
+        """
+        Registers a request that has been (or is about to be) written and returns its future.
+        `parse` overrides the reader's parser for this response.
+        """
+        pending = PendingResponse(codes, sizes, first_code, parse)
+        with self._lock:
+            self._pending.append(pending)
+        return pending.future
+
+    def _run(self):
+        while self._running:
+            try:
+                n = self._uart.in_waiting
+                data = self._uart.read(min(max(n, 1), self._chunk_size))
+            except Exception as e:
+                if self._running:
+                    logger.error("response reader stopped: {}".format(e))
+                self._running = False
+                break
+            if data:
+                self.feed(data)
+            elif self._frames:
+                self.flush()
+
+    def feed(self, data):
+        """Feeds received bytes. Used directly when the reader thread is not started."""
+        if self._on_read is not None:
+            self._on_read(data)
+        self._frames.feed(data)
+        self._extract_frames()
+
+    def _extract_frames(self):
+        while self._frames:
+            with self._lock:
+                # タイムアウト済みで応答が返ってこなかったリクエストは読み飛ばす
+                while len(self._pending) > 1 and self._pending[0].future.done() \
+                        and self._pending[0].prefix is not None \
+                        and not self._frames.can_start(self._pending[0].prefix):
+                    self._pending.popleft()
+                head = self._pending[0] if self._pending else None
+
+            if head is None:
+                frame = self._frames.next_frame()
+            else:
+                frame = self._frames.next_frame(head.expected_length, head.prefix, head.codes, head.sizes)
+            if frame is None:
+                return
+            if head is None and frame != WRONG_PACKET_FRAME:
+                logger.warning("Drop unexpected response: {}".format(frame))
+                continue
+            self._deliver(frame)
+
+    def flush(self):
+        """Delivers a buffered frame shorter than expected. Called when the line went idle."""
+        with self._lock:
+            head = self._pending[0] if self._pending else None
+        if head is None:
+            frame = self._frames.flush()
+        else:
+            frame = self._frames.flush(head.codes, head.sizes)
+        if frame is not None:
+            self._deliver(frame)
+            self._extract_frames()
+
+    @property
+    def resyncs(self):
+        return self._frames.resyncs
+
+    def _deliver(self, frame):
+        with self._lock:
+            # タイムアウト済みで応答が返ってこなかったリクエストは読み飛ばす
+            while len(self._pending) > 1 and self._pending[0].future.done() \
+                    and not self._pending[0].matches(frame):
+                self._pending.popleft()
+            if not self._pending:
+                logger.warning("Drop unexpected response: {}".format(frame))
+                return
+            pending = self._pending.popleft()
+
+        if pending.future.done():
+            logger.debug("Drop late response: {}".format(frame))
+            return
+        received = time.perf_counter()
+        try:
+            parse = self._parse if pending.parse is None else pending.parse
+            values = parse(frame, pending.codes, pending.sizes)
+        except Exception as e:
+            values, error = None, e
+        else:
+            error = None
+        if self._metrics is not None and self._metrics.enabled:
+            self._metrics.observe_rx(pending.codes[0] if pending.codes else None,
+                                     received - pending.written, time.perf_counter() - received, len(frame))
+        try:
+            if error is None:
+                pending.future.set_result(values)
+            else:
+                pending.future.set_exception(error)
+        except InvalidStateError:  # 呼び出し側でタイムアウト済み
+            logger.debug("Drop late response: {}".format(frame))
@@ -16,9 +16,25 @@
 # limitations under the License.
 # ==============================================================================
 
-from .alarms import get_alarm_name
+from .alarms import decode_motor_alarms
 from .core_types import *
+from .reader import ResponseReader
+from .codec import register_type, get_type_codec, to_bytes
+from .framing import FrameBuilder, FrameParser, ReadPlan, FRAME_HEADER, CODE_SIZE, response_length
+from .trace import PacketTracer, hex_string
+from .motion import predict_move_time
+from .cache import ResponseCache
+from .shadow import ShadowState
+from .stream import VelocityStream, VEL_STREAM_RATE, VEL_STREAM_LIFE_TIME
+from .metrics import Metrics
+from .capture import SessionRecorder
+from .kinematics import Kinematics
+from .trajectory import Trajectory, TrajectoryExecutor, TRAJECTORY_RATE, TRAJECTORY_LIFE_TIME
 import time
+import threading
+import collections
+import concurrent.futures
+import functools
 import serial.tools.list_ports
 import serial
 import struct
@@ -35,6 +51,16 @@ UART_STOPBITS = serial.STOPBITS_ONE
 UART_FLOW = False
 UART_ENDIAN = 'little'
 UART_TIMEOUT = 0.1
+RESPONSE_TIMEOUT = 2.0  # バックグラウンド受信時の応答待ち時間 [s]
+PIPELINE_DEPTH = 4  # pipeline()で同時に送信しておくフレーム数
+MAX_PACKET_SIZE = 64  # 1フレームの送信バイト数の上限
+
+JOIN_MIN_WAIT = 0.5  # 指令直後はmoveフラグが立つ前の状態が返ってくるので最初の問い合わせまで待つ [s]
+JOIN_POLL_INTERVAL = 0.05  # [s]
+JOIN_MAX_POLL_INTERVAL = 0.5  # [s]
+JOIN_POLL_BACKOFF = 1.5
+JOIN_PREDICT_MARGIN = 0.9  # 予測所要時間のこの割合が経過してから問い合わせを始める
+JOIN_SETTLE_TIME = 3.0  # moveフラグを見ておらず所要時間も予測できない場合, 完了を信じるまでの時間 [s]
 
 DRIVE_MOTOR_LOCAL_IDS = [1, 2, 3]
 LIFTER_MOTOR_LOCAL_IDS = [4, 5, 6, 7]
@@ -138,19 +164,265 @@ RobotValueTypes = {
     RobotCodes.KINEMATICS_TRANS: TriOrbDriveMatrix,
 }
 
+register_type(RobotCodes, "<H", lambda v: (v.value,), lambda t: RobotCodes(t[0]))
+register_type(RobotValues, "<B", lambda v: (v.value,), lambda t: RobotValues(t[0]))
+
+# RobotCodes毎のエンコーダ/デコーダ. import時に一度だけ生成する
+RobotCodecs = {code: get_type_codec(cls) for code, cls in RobotValueTypes.items()}
+
+READ_CONFIG_VALUE = 0x7FFFFFFF  # read_config()で読み出しを指定する値
+
+# write_config()/read_config()のパラメータ名とコード
+CONFIG_PARAM_CODES = {
+    "acc": (RobotCodes.STANDARD_ACCELERATION_TIME,),
+    "dec": (RobotCodes.STANDARD_DECELERATION_TIME,),
+    "std-vel": (RobotCodes.STANDARD_HORIZONTAL_SPEED, RobotCodes.STANDARD_ROTATION_SPEED),
+    "torque": (RobotCodes.DRIVING_TORQUE,),
+    "std-rot": (RobotCodes.STANDARD_ROTATION_SPEED,),
+    "kin-matrix": (RobotCodes.KINEMATICS,),
+    "kin-trans": (RobotCodes.KINEMATICS_TRANS,),
+}
+
+# 応答キャッシュの有効期間 [s]. ここに無いコードを含む応答はキャッシュしない
+DEFAULT_CACHE_TTLS = {
+    RobotCodes.SYSTEM_INFORMATION: 60.0,
+    RobotCodes.DEVICE_STATUS: 10.0,
+    RobotCodes.SENSOR_INFORMATION: 10.0,
+    RobotCodes.STANDARD_ACCELERATION_TIME: 60.0,
+    RobotCodes.STANDARD_DECELERATION_TIME: 60.0,
+    RobotCodes.STANDARD_HORIZONTAL_SPEED: 60.0,
+    RobotCodes.STANDARD_ROTATION_SPEED: 60.0,
+    RobotCodes.DRIVING_TORQUE: 60.0,
+    RobotCodes.KINEMATICS: 60.0,
+    RobotCodes.KINEMATICS_TRANS: 60.0,
+}
+
+# get_kinematics()のキャッシュ. 行列か機体の速度制限が書き換えられたら読み直す
+KINEMATICS_CACHE_KEY = ("kinematics",)
+KINEMATICS_CACHE_CODES = (RobotCodes.KINEMATICS, RobotCodes.KINEMATICS_TRANS, RobotCodes.DEVICE_STATUS)
+
+# 送信したコード: 無効にするキャッシュのコード
+_CONFIG_CODES = tuple(code for codes in CONFIG_PARAM_CODES.values() for code in codes)
+CACHE_INVALIDATION = {code: (code,) for code in _CONFIG_CODES}
+CACHE_INVALIDATION.update({
+    RobotCodes.SET_MOTOR_PARAMS: (RobotCodes.DEVICE_STATUS,),
+    RobotCodes.ROBOT_CENTER: (RobotCodes.DEVICE_STATUS,),
+    RobotCodes.KINEMATICS: (RobotCodes.KINEMATICS, RobotCodes.DEVICE_STATUS),
+    RobotCodes.KINEMATICS_TRANS: (RobotCodes.KINEMATICS_TRANS, RobotCodes.DEVICE_STATUS),
+    RobotCodes.INITIALIZE_CONFIG: _CONFIG_CODES + (RobotCodes.DEVICE_STATUS,),
+})
+
+# 書き込みの間引き対象 (set_vel_*/set_pos_*の付随コマンド)
+COALESCE_CODES = (
+    RobotCodes.ACCELERATION_TIME,
+    RobotCodes.DECELERATION_TIME,
+    RobotCodes.POSITION_DRIVE_STD_SPEED,
+    RobotCodes.POSITION_DRIVE_ROT_SPEED,
+    RobotCodes.MOVING_DRIVE_LIFE_TIME,
+    RobotCodes.DRIVE_MODE,
+)
+# ECUの保持値が変わり得るので間引き用の記録を捨てるコマンド. read_config()の読み出しは含まない
+COALESCE_RESET_CODES = (
+    RobotCodes.STARTUP_SUSPENSION,
+    RobotCodes.INITIALIZE_CONFIG,
+    RobotCodes.STANDARD_ACCELERATION_TIME,
+    RobotCodes.STANDARD_DECELERATION_TIME,
+    RobotCodes.STANDARD_HORIZONTAL_SPEED,
+    RobotCodes.STANDARD_ROTATION_SPEED,
+)
+
+MOTOR_STATUS_CODES = {"error": RobotCodes.ERROR_INFORMATION,
+                      "state": RobotCodes.OPERATING_STATUS,
+                      "voltage": RobotCodes.POWER_SUPPLY_VOLTAGE,
+                      "power": RobotCodes.DRIVING_POWER}
+
+def _matrix_value(v):
+    # スカラー(読み出し指定値など)は9要素すべてに入れる
+    return np.array(np.broadcast_to(np.asarray(v, dtype=np.float32), (3, 3)))
+
+
+def config_read_value(code):
+    """READ_CONFIG_VALUE as the value type of a config code (integers are truncated to their low bits)."""
+    cls = RobotValueTypes[code]
+    if cls is TriOrbDriveMatrix:
+        return cls(_matrix_value(READ_CONFIG_VALUE))
+    return np.array(READ_CONFIG_VALUE).astype(cls)[()]
+
+
+# 読み出し指定値のバイト列. これを送るエントリは設定値を書き換えない
+CONFIG_READ_BYTES = {code: RobotCodecs[code].encode(config_read_value(code)) for code in _CONFIG_CODES}
+
+
+def _written_entries(code_array):
+    """code_array without the entries that only read a config value (sent with the read value)."""
+    if not any(isinstance(e, (list, tuple)) and e[0] in CONFIG_READ_BYTES for e in code_array):
+        return code_array
+    return [e for e in code_array
+            if not (isinstance(e, (list, tuple)) and e[0] in CONFIG_READ_BYTES
+                    and to_bytes(e[1]) == CONFIG_READ_BYTES[e[0]])]
+
+
+# get_motor_snapshot()の1モータ分のレコード
+# state: 1バイト目(btn_y, ..., success)を下位, 2バイト目(emergency, ..., flag7)を上位とした状態ビット
+MOTOR_STATUS_DTYPE = np.dtype([
+    ("id", "u1"),
+    ("alarm", "u1"),
+    ("state", "<u2"),
+    ("voltage", "<f4"),
+    ("power", "<f4"),
+    ("valid", "?"),
+])
+
+@functools.lru_cache(maxsize=None)
+def motor_query_value(code, motor_id):
+    """Value bytes of a per-motor read query. The last byte selects the motor."""
+    return to_bytes(RobotValueTypes[code](0))[:-1] + int(motor_id).to_bytes(1, "little")
+
+
+# get_motor_snapshot()のパラメータ: (MOTOR_STATUS_DTYPEのフィールド, 応答値の先頭の型)
+_SNAPSHOT_FIELDS = {
+    "error": ("alarm", "u1"),
+    "state": ("state", "<u2"),
+    "voltage": ("voltage", "<f4"),
+    "power": ("power", "<f4"),
+}
+
+
+class MotorSnapshotPlan(ReadPlan):
+    """
+    Frames of one get_motor_snapshot() request. The (param, motor id) entries
+    are packed into as few frames as max_packet_size allows.
+    """
+
+    def __init__(self, params, ids, max_packet_size=MAX_PACKET_SIZE):
+        self.params = tuple(params)
+        self.ids = np.array(ids, dtype=np.uint8)
+        entries = []
+        self.index = {}  # パラメータ毎のエントリ番号 (motor idの順)
+        for pm in self.params:
+            code = MOTOR_STATUS_CODES[pm]
+            self.index[pm] = np.arange(len(entries), len(entries) + len(ids))
+            entries += [[code, motor_query_value(code, i)] for i in ids]
+        self.rows = np.tile(np.arange(len(ids), dtype=np.intp), len(self.params))
+        super().__init__(entries, max_packet_size)
+
+    def decode(self, responses):
+        """Decodes the raw response frames into a MOTOR_STATUS_DTYPE array, one row per motor id."""
+        out = np.zeros(len(self.ids), dtype=MOTOR_STATUS_DTYPE)
+        out["id"] = self.ids
+        out["voltage"] = np.nan
+        out["power"] = np.nan
+        buf, ok = self.read(responses)
+        valid = np.ones(len(self.ids), dtype=bool)
+        valid[self.rows[~ok]] = False
+        for pm, index in self.index.items():
+            index = index[ok[index]]
+            field, dtype = _SNAPSHOT_FIELDS[pm]
+            out[field][self.rows[index]] = self.values(buf, index, dtype)[:, 0]
+        out["valid"] = valid
+        return out
+
+
+@functools.lru_cache(maxsize=64)
+def motor_snapshot_plan(params, ids):
+    """Returns the cached MotorSnapshotPlan of a (params, ids) tuple pair."""
+    return MotorSnapshotPlan(params, ids)
+
+
+def find_ports():
+    """Returns the device names of all connected TriOrb control ECUs."""
+    return [dev.device for dev in serial.tools.list_ports.comports()
+            if "TriOrb CDC" in dev.description]
+
+
+class MotionWait:
+    """
+    Poll schedule and completion test of one wait_motion() call, shared by
+    robot and AsyncRobot: the front-ends only sleep for next_poll() and pass
+    the motor states they read to done().
+    Right after a command the ECU may still report the previous in-position
+    state, so the move counts as completed only once the move flag has been
+    seen, or after `settle_time` [s].
+    """
+
+    def __init__(self, now, timeout, first_delay, settle_time,
+                 poll_interval=JOIN_POLL_INTERVAL, max_poll_interval=JOIN_MAX_POLL_INTERVAL, backoff=JOIN_POLL_BACKOFF):
+        self.deadline = None if timeout is None else now + timeout
+        self.wake = now + first_delay
+        self.settle = now + settle_time
+        self.interval = poll_interval
+        self.max_interval = max_poll_interval
+        self.backoff = backoff
+        self.seen_move = False
+
+    def next_poll(self, now):
+        """Returns (time to sleep [s], True if the wait times out after that sleep)."""
+        if self.deadline is not None and self.wake > self.deadline:
+            return max(self.deadline - now, 0.0), True
+        return max(self.wake - now, 0.0), False
+
+    def done(self, data, now):
+        """Takes the motor states of one poll. Returns True when the move is completed."""
+        self.seen_move = self.seen_move or self.motion_seen(data)
+        if self.motion_done(data) and (self.seen_move or now >= self.settle):
+            return True
+        self.wake = now + self.interval
+        self.interval = min(self.interval*self.backoff, self.max_interval)
+        return False
+
+    @staticmethod
+    def motion_seen(data):
+        return any(isinstance(d, TriOrbBaseState) and d.move for d in data)
+
+    @staticmethod
+    def motion_done(data):
+        if len(data) != len(DRIVE_MOTOR_LOCAL_IDS) or not all(isinstance(d, TriOrbBaseState) for d in data):
+            return False
+        # 全てのmoveが0になるまでループ. 本来ならin_posを使いたいが, 時間経過でoffになるので信頼性が低い
+        if all(d.in_pos for d in data):
+            return True
+        if data[-1].success:
+            if not any(d.move for d in data):
+                return True
+        return False
+
+
+# read_config()の1回分: 読むパラメータとコード, キャッシュにあった値, 読み出すクエリ
+ConfigRead = collections.namedtuple("ConfigRead", ("params", "codes", "values", "missing", "query"))
+
 
 class robot:
 
-    def __init__(self, port=None, node=None, port_find_time=None):
+    def __init__(self, port=None, node=None, port_find_time=None, background_reader=False, trace_history=0,
+                 transport=None, cache_ttls=None, coalesce_writes=False, metrics=False):
         self._uart = None
+        self._reader = None
+        self._tx_lock = threading.Lock()
+        self._tls = threading.local()
+        self._frame_builder = FrameBuilder()
+        self._rx_frames = FrameParser()
+        self.tracer = PacketTracer(trace_history)
+        self.metrics = Metrics(enabled=metrics)
+        self.metrics.bind(self)
+        self.recorder = None
+        self.cache = ResponseCache(DEFAULT_CACHE_TTLS if cache_ttls is None else cache_ttls)
+        self.shadow = None
+        self.set_write_coalescing(coalesce_writes)
+        self._motion_end = None
         self.node = node
+        self._expected_response_values = []
+        self._expected_response_size = []
+        if transport is not None:
+            # シリアルポートの代わりにread/write/in_waitingを持つオブジェクトを使う (シミュレータ等)
+            self._uart = transport
+            if background_reader:
+                self.start_reader()
+            return
         if port is None:
             port = self.find_port(port_find_time)
         if port is None:
             raise Exception("Please set UART port path/name")
         print(port)
-        self._expected_response_values = []
-        self._expected_response_size = []
         self._uart = serial.Serial(
             port=port,
             baudrate=UART_BAUDRATE,
@@ -161,7 +433,8 @@ class robot:
             write_timeout=UART_TIMEOUT,
             rtscts=UART_FLOW,
         )
-
+        if background_reader:
+            self.start_reader()
 
     def _print_info(self, *args, **kwargs):
         if self.node is not None:
@@ -185,13 +458,49 @@ class robot:
     def codes(self):
         return RobotCodes
 
+    @property
+    def background_reader(self):
+        return self._reader is not None
+
+    def start_reader(self):
+        """
+        Starts the background reader thread. After this, the reader owns the
+        read side of the serial port and rx() waits for the response of the
+        last tx() issued from the calling thread.
+        """
+        if self._uart is None or self._reader is not None:
+            return
+        self._reader = ResponseReader(self._uart, self._parse_response, metrics=self.metrics,
+                                      on_read=self._record_rx)
+        self._reader.start()
+
+    def stop_reader(self):
+        if self._reader is None:
+            return
+        reader = self._reader
+        self._reader = None
+        reader.stop()
+
+    def start_capture(self, path, mmap_size=None):
+        """
+        Records every write to and read from the serial port to `path` (see triorb_core.capture).
+        With mmap_size [bytes] the file is written through a memory map.
+        """
+        self.stop_capture()
+        self.recorder = SessionRecorder(path, mmap_size)
+        return self.recorder
+
+    def stop_capture(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+
     def find_port(self, timeout=None):
         st = time.time()
         while 1:
-            ports = [dev for dev in serial.tools.list_ports.comports()
-                     if "TriOrb CDC" in dev.description]
+            ports = find_ports()
             for p in ports:
-                return p.device
+                return p
             self._print_info("waiting triorb pico..")
             time.sleep(1)
             if timeout is not None:
@@ -205,185 +514,282 @@ class robot:
 
     @staticmethod
     def to_bytes(val):
-        if isinstance(val, RobotCodes):
-            return val.value.to_bytes(2, UART_ENDIAN)
-        if isinstance(val, RobotValues):
-            return val.value.to_bytes(1, UART_ENDIAN)
-        if isinstance(val, TriOrbDriveUSS):
-            return val.to_bytes()
-        if isinstance(val, TriOrbDrive3Pose):
-            return val.to_bytes()
-        if isinstance(val, TriOrbDrive3Vector):
-            return val.to_bytes()
-        if isinstance(val, TriOrbDriveMatrix):
-            return val.to_bytes()
-        if isinstance(val, TriOrbBaseSystem):
-            return val.to_bytes()
-        if isinstance(val, TriOrbBaseDevice):
-            return val.to_bytes()
-        if isinstance(val, TriOrbBaseSensor):
-            return val.to_bytes()
-        if isinstance(val, TriOrbBaseError):
-            return val.to_bytes()
-        if isinstance(val, TriOrbBaseState):
-            return val.to_bytes()
-        if isinstance(val, TriOrbErrorHistory):
-            return val.to_bytes()
-        if isinstance(val, int):
-            return val.to_bytes(1, UART_ENDIAN)
-        if isinstance(val, np.uint32):
-            return int(val).to_bytes(4, UART_ENDIAN)
-        if isinstance(val, np.int32):
-            return int(val).to_bytes(4, UART_ENDIAN, signed = True)
-        if isinstance(val, np.uint16):
-            return int(val).to_bytes(2, UART_ENDIAN)
-        if isinstance(val, np.uint8):
-           return int(val).to_bytes(1, UART_ENDIAN)
-        if isinstance(val, np.float32):
-            return struct.pack('<f', val)
-        # if isinstance(val, np.uint16):
-        #    return val.to_bytes(2, UART_ENDIAN)
-        self._print_error(type(val))
-        raise Exception("Unknown type")
+        return to_bytes(val)
 
     @staticmethod
     def from_bytes(val, code):
-        if code == RobotCodes.KINEMATICS or code == RobotCodes.KINEMATICS_TRANS:
-            dtype = RobotValueTypes[code](np.zeros((3, 3), dtype=np.float32))
-            dtype.from_bytes(val)
-            return dtype
-
-        dtype = RobotValueTypes[code]()
-        if isinstance(dtype, RobotCodes):
-            return val.value.from_bytes(2, UART_ENDIAN)
-        if isinstance(dtype, RobotValues):
-            return val.value.from_bytes(1, UART_ENDIAN)
-        if isinstance(dtype, TriOrbDriveUSS):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, TriOrbDrive3Pose):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, TriOrbDrive3Vector):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, TriOrbBaseSystem):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, TriOrbBaseDevice):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, TriOrbBaseSensor):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, TriOrbBaseError):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, TriOrbBaseState):
-            dtype.from_bytes(val, True)
-            return dtype
-        if isinstance(dtype, TriOrbErrorHistory):
-            dtype.from_bytes(val)
-            return dtype
-        if isinstance(dtype, int):
-            return struct.unpack("<i", val)[0]
-        if isinstance(dtype, np.uint32):
-            return struct.unpack('<I', val)[0]
-        if isinstance(dtype, np.int32):
-            return struct.unpack('<i', val)[0]
-        if isinstance(dtype, np.uint16):
-            return struct.unpack('<H', val)[0]
-        if isinstance(dtype, np.float32):
-            return struct.unpack('<f', val)[0]
-        if isinstance(dtype, np.uint8):
-            return val[0]
-        # if isinstance(val, np.uint16):
-        #    return val.to_bytes(2, UART_ENDIAN)
-        self._print_error(type(val))
-        raise Exception("Unknown type")
+        return RobotCodecs[code].decode(val)
 
     @staticmethod
     def byteList_to_string(arr):
-        return ' '.join(['0x{:02x}'.format(_b) for _b in arr])
+        return hex_string(arr)
+
+    def submit(self, code_array=[]):
+        """
+        Sends the query and returns a concurrent.futures.Future resolved with
+        the parsed response. Requires the background reader.
+        """
+        if self._reader is None:
+            raise Exception("submit() requires the background reader. Call start_reader() first.")
+        self._tx(code_array)
+        return self._tls.future
+
+    def _request(self, code_array):
+        self._tx(code_array)
+        return self.rx()
+
+    def _request_all(self, code_arrays):
+        values = []
+        for code_array in code_arrays:
+            res = self._request(code_array)
+            # タイムアウト(b"")や不正パケットの応答は連結せずにそのまま返す
+            if not isinstance(res, list):
+                return res
+            values += res
+            if len(res) != len(code_array):
+                return values  # 読めなかった値がある. 残りは送らない
+        return values
 
     def tx(self, code_array=[]):
+        # 送信したフレームは従来通りintのリストで返す
+        return list(self._tx(code_array))
+
+    def _tx(self, code_array):
         if self._uart is None:
-            return []
+            return b""
+        _send_binary, self._expected_response_values, self._expected_response_size = \
+            self._build_frame(code_array)
+
+        future = self._write_frame(
+            _send_binary, self._expected_response_values, self._expected_response_size)
+        if future is not None:
+            self._tls.future = future
+        self.tracer.tx(_send_binary)
+        return _send_binary
+
+    def _build_frame(self, code_array):
         if not isinstance(code_array, list):
             self._print_warning(
                 "Please provide the code_array in list format. For instance, it should be something like 'code_array = [RobotCodes.SYSTEM_INFORMATION, [RobotCodes.STARTUP_SUSPENSION, 0x02:],]'.")
+        if len(self.cache) > 0 or self.shadow is not None:
+            # 読み出し指定値で設定値を読むだけのエントリは書き込みとして扱わない
+            written = _written_entries(code_array)
+            if len(self.cache) > 0:
+                self._invalidate_cache(written)
+            if self.shadow is not None:
+                self.shadow.observe(written)
+        return self._frame_builder.build(code_array)
+
+    def _invalidate_cache(self, code_array):
+        # 設定を変えるコマンドを送る前に関係するキャッシュを捨てる
+        codes = []
+        for entry in code_array:
+            code = entry[0] if isinstance(entry, (list, tuple)) else entry
+            if code in CACHE_INVALIDATION:
+                codes += CACHE_INVALIDATION[code]
+        if codes:
+            self.cache.invalidate(codes)
+
+    def set_write_coalescing(self, enabled):
+        """
+        Enables/disables dropping sub-commands (acc, dec, speeds, life time,
+        drive mode) of set_vel_*/set_pos_* whose value equals the last one
+        acknowledged by the ECU.
+        """
+        if not enabled:
+            self.shadow = None
+        elif self.shadow is None:
+            self.shadow = ShadowState(COALESCE_CODES, COALESCE_RESET_CODES)
+
+    def _coalesced_request(self, query):
+        if self.shadow is None:
+            return self._request(query)
+        query, pending = self.shadow.filter(query)
+        values = self._request(query)
+        self.shadow.acknowledge(pending, isinstance(values, list) and len(values) == len(query))
+        return values
 
-        self._expected_response_values = []
-        self._expected_response_size = []
-        _tx_bytes = [0x00]
-        for code_value in code_array:
-            if not isinstance(code_value, list):
-                logger.debug(
-                    "Since it's only a communication code, I will add value=0x00.")
-                code_value = [code_value, 0x00]
-            _code, _value = code_value
-            _code_bytes = _code if isinstance(
-                _code, bytes) else self.to_bytes(_code)
-            _value_bytes = _value if isinstance(
-                _value, bytes) else self.to_bytes(_value)
-            _tx_bytes.extend(_code_bytes)
-            _tx_bytes.extend(_value_bytes)
-            self._expected_response_values.append(_code)
-            self._expected_response_size.append(len(_value_bytes))
-        _tx_bytes.extend([0x0d, 0x0a])
-        _send_binary = bytes(_tx_bytes)
-
-        self._uart.write(_send_binary)
-        logger.debug("Send: {}".format(_send_binary))
-        # print(_send_binary)
-        return _tx_bytes
+    def _cached_request(self, code_array):
+        """_request() served from self.cache while the response of the same codes is valid."""
+        key = tuple(entry[0] for entry in code_array)
+        hit, values = self.cache.get(key)
+        if hit:
+            return list(values)
+        values = self._request(code_array)
+        if isinstance(values, list) and len(values) == len(code_array):
+            self.cache.put(key, list(values), key)
+        return values
+
+    def _write_frame(self, send_binary, expected_values, expected_size, parse=None):
+        t0 = time.perf_counter()
+        if self._reader is None:
+            self._write_uart(send_binary)
+            future = None
+        else:
+            # 応答の照合順序と送信順序を一致させるため登録と送信をまとめてロック
+            with self._tx_lock:
+                future = self._reader.expect(
+                    expected_values, expected_size, send_binary[1:3], parse)
+                self._write_uart(send_binary)
+        if self.metrics.enabled:
+            self.metrics.observe_tx(expected_values[0] if expected_values else None,
+                                    time.perf_counter() - t0, len(send_binary))
+        return future
+
+    def _write_uart(self, data):
+        if self.recorder is not None:
+            self.recorder.tx(data)
+        self._uart.write(data)
+
+    def _record_rx(self, data):
+        # 解析前の受信バイト列をそのまま記録する. 読み捨てたバイトや不正パケットの応答も残る
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.rx(data)
+
+    def pipeline(self, code_arrays, depth=PIPELINE_DEPTH, raw=False):
+        """
+        Sends several queries back-to-back without waiting for each response.
+        Up to `depth` frames are kept in flight and the responses are matched
+        in order, so the returned list has one rx() result per query.
+        With raw=True the response frames are returned undecoded (bytes).
+        """
+        if self._uart is None:
+            return []
+        depth = max(int(depth), 1)
+        parse = self._raw_response if raw else None
+        results = []
+        inflight = collections.deque()
+        for code_array in code_arrays:
+            if len(inflight) >= depth:
+                results.append(self._rx_pipelined(inflight.popleft()))
+            _send_binary, expected_values, expected_size = self._build_frame(code_array)
+            future = self._write_frame(_send_binary, expected_values, expected_size, parse)
+            self.tracer.tx(_send_binary)
+            inflight.append((future, expected_values, expected_size, parse))
+        while inflight:
+            results.append(self._rx_pipelined(inflight.popleft()))
+        return results
+
+    def _rx_pipelined(self, inflight):
+        future, expected_values, expected_size, parse = inflight
+        if future is not None:
+            return self._rx_future(future)
+        return self._rx_sync(expected_values, expected_size, parse)
+
+    def _raw_response(self, buf, expected_values, expected_size):
+        self.tracer.rx(buf)
+        return bytes(buf)
 
     def rx(self):
         if self._uart is None:
             return 0
-        expected_buf_length = sum(self._expected_response_size) + \
-            len(self._expected_response_size)*2 + len([0x00, 0x0d, 0x0a])
+        if self._reader is not None:
+            future = getattr(self._tls, "future", None)
+            self._tls.future = None
+            return self._rx_future(future)
+        return self._rx_sync(self._expected_response_values, self._expected_response_size)
+
+    def _rx_sync(self, expected_values, expected_size, parse=None):
+        expected_buf_length = response_length(expected_size)
         # return expected_buf_length
+        prefix = self._response_prefix(expected_values)
+        t0 = time.perf_counter()
 
-        buf = b""
+        frames = self._rx_frames
         timeout_count = 0
         while (True):
-            lb = len(buf)
-            # buf += self._uart.readline() # 0x0aまで読み込み
-            buf += self._uart.read()
-            if len(buf) == lb:
-                print(".", end="")
-                timeout_count += 1
-                if timeout_count > 20:
-                    self._uart.reset_output_buffer()
-                    self._uart.reset_input_buffer()
-                    print("[ERROR] timeout. May be send wrong packet.")
-                    return buf
-                continue
-            if len(buf) < expected_buf_length:
+            buf = frames.next_frame(expected_buf_length, prefix, expected_values, expected_size)
+            if buf is not None:
+                break
+            # 受信済みのバイトをまとめて読む. 次の応答の分まで読んだ場合はframesに残る
+            data = self._uart.read(max(self._uart.in_waiting, 1))
+            if data:
+                self._record_rx(data)
+                frames.feed(data)
                 continue
-            if buf[-2] == 0x0d:  # たまたま改行コードと同じ値が送られた場合を防ぐ. ただし, たまたま0x0d0aとなる値が送られてきた場合はどうしようもない
+            # 受信が途切れた. 期待長より短い応答(読めないコードを含む等)ならここで区切る
+            buf = frames.flush(expected_values, expected_size)
+            if buf is not None:
                 break
+            print(".", end="")
+            timeout_count += 1
+            if timeout_count > 20:
+                # 受信途中のデータは返して捨てる. 遅れて届いた残りは次の応答の先頭で再同期して読み飛ばす
+                self._uart.reset_output_buffer()
+                print("[ERROR] timeout. May be send wrong packet.")
+                self._dump_trace()
+                self.metrics.count_timeout()
+                return frames.clear()
+
+        if parse is None:
+            parse = self._parse_response
+        t1 = time.perf_counter()
+        values = parse(buf, expected_values, expected_size)
+        if self.metrics.enabled:
+            self.metrics.observe_rx(expected_values[0] if expected_values else None,
+                                    t1 - t0, time.perf_counter() - t1, len(buf))
+        print("\r", end="")
+        return values
+
+    @property
+    def resyncs(self):
+        """Number of times the response stream was resynchronized."""
+        n = self._rx_frames.resyncs
+        if self._reader is not None:
+            n += self._reader.resyncs
+        return n
 
+    @staticmethod
+    def _response_prefix(expected_values):
+        """Header and echoed first code of the expected response, used to resynchronize."""
+        if not expected_values:
+            return None
+        code = expected_values[0]
+        return FRAME_HEADER + (code if isinstance(code, bytes) else to_bytes(code))
+
+    def _rx_future(self, future):
+        if future is None:
+            self._print_warning("rx() was called without tx().")
+            return []
+        try:
+            return future.result(timeout=RESPONSE_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self._print_error("[ERROR] timeout. May be send wrong packet.")
+            self._dump_trace()
+            self.metrics.count_timeout()
+            return b""
+
+    def _dump_trace(self):
+        if self.tracer.history > 0:
+            self._print_error("Last frames:\n" + self.tracer.dump())
+
+    def _parse_response(self, buf, expected_values, expected_size):
+        self.tracer.rx(buf)
+        expected_buf_length = response_length(expected_size)
         if len(buf) == 3:
             print("[ERROR] Send wrong packet")
             return buf
 
         with_not_readable_code = (
             expected_buf_length != len(buf))  # 期待通りの長さのコードが帰ってきているか
+        if not with_not_readable_code:
+            values = self._decode_values(buf, expected_values, expected_size)
+            if values is not None:
+                return values
 
-        logger.debug("Response: {}".format(buf))
         # print("Res: {}".format(buf) )
         values = []
 
         code_index = 0
         i = 0
         for _ in range(len(buf)):
-            code = self._expected_response_values[code_index]
+            code = expected_values[code_index]
             if isinstance(code, bytes):
                 c = struct.unpack("<H", code)[0]
                 code = RobotCodes(c)
-            clen = self._expected_response_size[code_index]
+            clen = expected_size[code_index]
             if i > len(buf):
                 break
 
@@ -392,8 +798,8 @@ class robot:
                     next_bytes = int.from_bytes(buf[i+2:i+4], UART_ENDIAN)
                     if next_bytes == 0x0a0d:
                         break
-                    if code_index+1 < len(self._expected_response_values):
-                        if next_bytes == self._expected_response_values[code_index+1].value:
+                    if code_index+1 < len(expected_values):
+                        if next_bytes == expected_values[code_index+1].value:
                             code_index += 1
                             i += 2
                             continue
@@ -401,26 +807,39 @@ class robot:
                 values.append(self.from_bytes(buf[i+2:i+2+clen], code))
                 code_index += 1
                 i += clen
-                if len(self._expected_response_values) == code_index:
+                if len(expected_values) == code_index:
                     break
             i += 1
         # print(values)
-        print("\r", end="")
+        return values
+
+    def _decode_values(self, buf, expected_values, expected_size):
+        """
+        Decodes a response of the expected length in place (struct.unpack_from at fixed offsets).
+        Returns None if a code is not where it should be, so that the caller falls back to scanning.
+        """
+        values = []
+        i = len(FRAME_HEADER)
+        for code, clen in zip(expected_values, expected_size):
+            if isinstance(code, bytes):
+                code = RobotCodes(struct.unpack("<H", code)[0])
+            codec = RobotCodecs.get(code)
+            if codec is None or codec.size != clen or buf[i] | (buf[i+1] << 8) != code.value:
+                return None
+            values.append(codec.decode(buf, i + CODE_SIZE))
+            i += CODE_SIZE + clen
         return values
 
     def rx_bytes(self):
-        buf = b""
-        while (True):
-            buf += self._uart.readline()  # 0x0aまで読み込み
-            if len(buf) < 2:
-                print(".", end="")
-                continue
-            if buf[-2] == 0x0d:  # たまたま改行コードと同じ値が送られた場合を防ぐ. ただし, たまたま0x0d0aとなる値が送られてきた場合はどうしようもない
-                break
-        return buf
+        """Returns the response frame of the last tx() as bytes."""
+        if self._uart is None:
+            return b""
+        return self._rx_sync(self._expected_response_values, self._expected_response_size,
+                             self._raw_response)
 
     def clear_rx(self):
         msg = "clear "
+        self._rx_frames.clear()
         if self._uart.in_waiting > 0:
             self._uart.reset_input_buffer()
             msg += "input"
@@ -436,63 +855,133 @@ class robot:
 
     def wakeup(self):
         logger.debug("Wakeup")
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.STARTUP_SUSPENSION, RobotValues.ROBOT_STARTUP]])))
-        return self.rx()
+        return self._request([[RobotCodes.STARTUP_SUSPENSION, RobotValues.ROBOT_STARTUP]])
 
     def sleep(self):
         logger.debug("Sleep")
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.STARTUP_SUSPENSION, RobotValues.ROBOT_SUSPENSION]])))
-        return self.rx()
+        return self._request([[RobotCodes.STARTUP_SUSPENSION, RobotValues.ROBOT_SUSPENSION]])
     
     def ota_reboot(self):
         logger.debug("OTA Reboot")
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.STARTUP_SUSPENSION, RobotValues.OTA_REBOOT]])))
+        self._tx([[RobotCodes.STARTUP_SUSPENSION, RobotValues.OTA_REBOOT]])
         return [RobotCodes.STARTUP_SUSPENSION, RobotValues.OTA_REBOOT]
 
-    def join(self):
+    def join(self, timeout=None, **kwargs):
         logger.debug("join")
-        time.sleep(3.0)  # 早くに送信するとモーターのmoveフラグが立つ前のクエリが帰ってくるのでsleep
+        done = self.wait_motion(timeout=timeout, **kwargs)
+        print("move end" if done else "move timeout")
+        return done
+
+    def join_async(self, timeout=None, **kwargs):
+        """
+        Runs wait_motion() in a thread and returns a concurrent.futures.Future
+        resolved with its result. Starts the background reader, as the waiting
+        thread polls the motors while the caller may send other commands.
+        """
+        self.start_reader()
+        future = concurrent.futures.Future()
+
+        def _wait():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.wait_motion(timeout=timeout, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        threading.Thread(target=_wait, name="triorb-join", daemon=True).start()
+        return future
+
+    def wait_motion(self, timeout=None, poll_interval=JOIN_POLL_INTERVAL, max_poll_interval=JOIN_MAX_POLL_INTERVAL,
+                    backoff=JOIN_POLL_BACKOFF, min_wait=JOIN_MIN_WAIT, predicted_time=None):
+        """
+        Waits until the drive motors finish the current position move.
+        Polling starts after max(min_wait, predicted_time) and its interval grows
+        from poll_interval by `backoff` up to max_poll_interval.
+        predicted_time defaults to the duration predicted by the last
+        set_pos_relative() call, when it could be computed.
+        Right after a command the ECU may still report the previous in-position
+        state, so the move counts as completed only once the move flag has been
+        seen, or after predicted_time (JOIN_SETTLE_TIME if unknown).
+        Returns True when the move is completed, False on timeout [s].
+        """
+        wait = self._motion_wait(timeout, poll_interval, max_poll_interval, backoff, min_wait, predicted_time)
         while (True):  # 定期的に状態取得用のクエリを送る
+            delay, expired = wait.next_poll(time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+            if expired:
+                return False
             # data = self.get_operating_status(_id=DRIVE_MOTOR_LOCAL_IDS)
             data = self.get_motor_status(
                 params=["state"], _id=DRIVE_MOTOR_LOCAL_IDS)
-            # 全てのmoveが0になるまでループ. 本来ならin_posを使いたいが, 時間経過でoffになるので信頼性が低い
-            if (data[0].in_pos and data[1].in_pos and data[2].in_pos):
+            if wait.done(data, time.monotonic()):
                 break
-            if data[2].success:
-                if not (data[0].move or data[1].move or data[2].move):
-                    break
-            time.sleep(1.0)
-        print("move end")
+        self._motion_end = None
+        return True
+
+    def _motion_wait(self, timeout, poll_interval, max_poll_interval, backoff, min_wait, predicted_time):
+        now = time.monotonic()
+        if predicted_time is None and self._motion_end is not None:
+            predicted_time = self._motion_end - now
+        if predicted_time is None:
+            # moveフラグを一度も見ていなくても完了とみなしてよくなるまでの時間
+            first_delay, settle_time = min_wait, JOIN_SETTLE_TIME
+        else:
+            first_delay, settle_time = max(min_wait, predicted_time*JOIN_PREDICT_MARGIN), max(predicted_time, 0.0)
+        return MotionWait(now, timeout, first_delay, settle_time, poll_interval, max_poll_interval, backoff)
 
     def brake(self):
         logger.debug("brake")
         td3p = RobotValueTypes[RobotCodes.MOVING_SPEED_RELATIVE](0, 0, 0)
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.MOVING_SPEED_RELATIVE, td3p]])))
-        return self.rx()
+        return self._request([[RobotCodes.MOVING_SPEED_RELATIVE, td3p]])
 
     def get_pos(self):  # how to get? not implemented
         logger.debug("get_pos")
         val = RobotValueTypes[RobotCodes.GET_POSE]()
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.GET_POSE, val]])))
-        return self.rx()
+        return self._request([[RobotCodes.GET_POSE, val]])
 
     def read_config(self, params=["acc", "dec", "std-vel", "torque"]):
         logger.debug("read_config")
+        plan = self._config_read_plan(params)
+        res = self._request(plan.query) if plan.query else []
+        return self._config_read_result(plan, res)
+
+    def _config_read_plan(self, params):
         if isinstance(params, str):
             params = [params]
         elif not isinstance(params, list):
             self._print_warning("Please provide the params in list format.")
-
+        known = []
+        codes = []
+        for p in params:
+            if p in CONFIG_PARAM_CODES:
+                known.append(p)
+                codes += CONFIG_PARAM_CODES[p]
+            else:
+                print(p, "is not configure value.")
+        # 設定値はコード毎にキャッシュするので, 読み出すパラメータが重なれば共有される
+        values = {}
+        for code in dict.fromkeys(codes):
+            hit, v = self.cache.get((code,))
+            if hit:
+                values[code] = v[0]
+        missing = [code for code in dict.fromkeys(codes) if code not in values]
         # irregular value for read mode
-        dicts = {p: 0x7FFFFFFF for p in params}
-        values = self.write_config(dicts)
-
+        query = [[code, config_read_value(code)] for code in missing]
+        return ConfigRead(known, codes, values, missing, query)
+
+    def _config_read_result(self, plan, res):
+        """Caches the values read by plan.query and returns the values of plan.params, or the failed response."""
+        values = plan.values
+        if plan.missing:
+            if not isinstance(res, list) or len(res) != len(plan.missing):
+                return res
+            for code, v in zip(plan.missing, res):
+                values[code] = v
+                self.cache.put((code,), [v], (code,))
+        return self._read_config_values(plan.params, [values[code] for code in plan.codes])
+
+    def _read_config_values(self, params, values):
         for i in range(len(params)):
             if params[i] == "std-vel":  # 水平速度と回転速度両方が帰ってくるので除く
                 values.pop(i)
@@ -528,21 +1017,21 @@ class robot:
 
             elif k == "kin-matrix":
                 command.append(
-                    [RobotCodes.KINEMATICS,   RobotValueTypes[RobotCodes.KINEMATICS](v)])
+                    [RobotCodes.KINEMATICS,   RobotValueTypes[RobotCodes.KINEMATICS](_matrix_value(v))])
             elif k == "kin-trans":
                 command.append([RobotCodes.KINEMATICS_TRANS,
-                               RobotValueTypes[RobotCodes.KINEMATICS_TRANS](v)])
+                               RobotValueTypes[RobotCodes.KINEMATICS_TRANS](_matrix_value(v))])
             else:
                 print(k, "is not configure value.")
         if len(command) > 0:
-            logger.debug(self.byteList_to_string(self.tx(command)))
-            return self.rx()
+            return self._request(command)
         else:
             return False
 
     # read mode not implemented
     def set_pos_absolute(self, x, y, w, acc=None, dec=None, vel_xy=None, vel_w=None):   
         logger.debug("set_pos_absolute")
+        self._motion_end = None  # 現在位置に依存するので所要時間は予測しない
         td3p = RobotValueTypes[RobotCodes.TARGET_POSITION_ABSOLUTE](x, y, w)
         query = [[RobotCodes.TARGET_POSITION_ABSOLUTE, td3p]]
         if acc is not None:
@@ -558,12 +1047,13 @@ class robot:
             vel = RobotValueTypes[RobotCodes.POSITION_DRIVE_ROT_SPEED](vel_w)
             query.append([RobotCodes.POSITION_DRIVE_ROT_SPEED, vel])
 
-        logger.debug(self.byteList_to_string(self.tx(query)))
-        return self.rx()
+        return self._coalesced_request(query)
 
     # read mode not implemented
     def set_pos_relative(self, x, y, w, acc=None, dec=None, vel_xy=None, vel_w=None):
         logger.debug("set_pos_relative")
+        predicted = predict_move_time(x, y, w, acc, dec, vel_xy, vel_w)
+        self._motion_end = None if predicted is None else time.monotonic() + predicted
         td3p = RobotValueTypes[RobotCodes.TARGET_POSITION_RELATIVE](x, y, w)
         query = [[RobotCodes.TARGET_POSITION_RELATIVE, td3p]]
         if acc is not None:
@@ -579,8 +1069,7 @@ class robot:
             vel = RobotValueTypes[RobotCodes.POSITION_DRIVE_ROT_SPEED](vel_w)
             query.append([RobotCodes.POSITION_DRIVE_ROT_SPEED, vel])
 
-        logger.debug(self.byteList_to_string(self.tx(query)))
-        return self.rx()
+        return self._coalesced_request(query)
 
     def set_vel_absolute(self, vx, vy, vw, acc=None, dec=None, life_time=None):  # read mode not implemented
         logger.debug("set_vel_absolute")
@@ -595,8 +1084,7 @@ class robot:
         if life_time is not None:
             life = RobotValueTypes[RobotCodes.MOVING_DRIVE_LIFE_TIME](life_time)
             query.append([RobotCodes.MOVING_DRIVE_LIFE_TIME, life])
-        logger.debug(self.byteList_to_string(self.tx(query)))
-        return self.rx()
+        return self._coalesced_request(query)
 
     def set_vel_relative(self, vx, vy, vw, acc=None, dec=None, life_time=None, drive_mode=None):
         logger.debug("set_vel_relative")
@@ -614,167 +1102,190 @@ class robot:
         if drive_mode is not None:
             mode = RobotValueTypes[RobotCodes.DRIVE_MODE](drive_mode)
             query.append([RobotCodes.DRIVE_MODE, mode])
-        logger.debug(self.byteList_to_string(self.tx(query)))
-        return self.rx()
+        return self._coalesced_request(query)
+
+    def velocity_stream(self, rate=VEL_STREAM_RATE, life_time=VEL_STREAM_LIFE_TIME, relative=True, acc=None, dec=None):
+        """
+        Returns a started VelocityStream. post(vx, vy, vw) on it sends only the
+        latest velocity, at most `rate` times per second, with `life_time` [ms]
+        as a watchdog.
+        """
+        stream = VelocityStream(self, rate, life_time, relative, acc, dec)
+        stream.start()
+        return stream
+
+    def follow_trajectory(self, trajectory, rate=TRAJECTORY_RATE, life_time=TRAJECTORY_LIFE_TIME, relative=True,
+                          feedback=False, gain_xy=1.0, gain_w=1.0, check_limits=False, **profile):
+        """
+        Returns a started TrajectoryExecutor streaming `trajectory` (a Trajectory,
+        or waypoints (N, 3) built into one with **profile) as velocity commands.
+        With check_limits=True the profile is checked against get_kinematics() first.
+        """
+        if not isinstance(trajectory, Trajectory):
+            trajectory = Trajectory(trajectory, **profile)
+        kinematics = self.get_kinematics() if check_limits else None
+        executor = TrajectoryExecutor(self, trajectory, rate, life_time, relative, feedback, gain_xy, gain_w, kinematics)
+        executor.start()
+        return executor
 
     def set_lifter_move(self, pos):
         logger.debug("set_lifter_move")
         td3p = RobotValueTypes[RobotCodes.SET_LIFTER_MOVE](pos)
         query = [[RobotCodes.SET_LIFTER_MOVE, td3p]]
-        logger.debug(self.byteList_to_string(self.tx(query)))
-        return self.rx()
+        return self._request(query)
 
     def get_lifter_pos(self):
         logger.debug("get_lifter_pos")
         val = RobotValueTypes[RobotCodes.GET_LIFTER_POSITION]()
         query = [[RobotCodes.GET_LIFTER_POSITION, val]]
-        logger.debug(self.byteList_to_string(self.tx(query)))
-        return self.rx()
+        return self._request(query)
     
     def get_info(self):
         logger.debug("get_info")
         val = RobotValueTypes[RobotCodes.SYSTEM_INFORMATION]()
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.SYSTEM_INFORMATION, val]])))
-        return self.rx()
+        return self._cached_request([[RobotCodes.SYSTEM_INFORMATION, val]])
 
     def get_device_status(self):
         logger.debug("get_device_status")
         val = RobotValueTypes[RobotCodes.DEVICE_STATUS]()
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.DEVICE_STATUS, val]])))
-        return self.rx()
+        return self._cached_request([[RobotCodes.DEVICE_STATUS, val]])
+
+    def get_kinematics(self):
+        """
+        Returns a Kinematics of the KINEMATICS/KINEMATICS_TRANS matrices and the
+        velocity limits of get_device_status(). They are read once and kept in
+        self.cache until they are written or the TTL expires.
+        """
+        logger.debug("get_kinematics")
+        hit, kin = self.cache.get(KINEMATICS_CACHE_KEY)
+        if hit:
+            return kin
+        return self._store_kinematics(self._request_all(self._kinematics_queries()))
+
+    @staticmethod
+    def _kinematics_queries():
+        # 行列2つは1フレームに収まらないので分けて送る
+        return [[[RobotCodes.KINEMATICS, config_read_value(RobotCodes.KINEMATICS)]],
+                [[RobotCodes.KINEMATICS_TRANS, config_read_value(RobotCodes.KINEMATICS_TRANS)]],
+                [[RobotCodes.DEVICE_STATUS, RobotValueTypes[RobotCodes.DEVICE_STATUS]()]]]
+
+    def _store_kinematics(self, values):
+        if not isinstance(values, list) or len(values) != len(KINEMATICS_CACHE_CODES):
+            self._print_warning("Failed to read the kinematics.")
+            return None
+        kin = Kinematics(values[0], values[1], limits=values[2])
+        self.cache.put(KINEMATICS_CACHE_KEY, kin, KINEMATICS_CACHE_CODES)
+        return kin
 
     def get_sensor_info(self):
         logger.debug("get_sensor_info")
         val = RobotValueTypes[RobotCodes.SENSOR_INFORMATION]()
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.SENSOR_INFORMATION, val]])))
-        return self.rx()
+        return self._cached_request([[RobotCodes.SENSOR_INFORMATION, val]])
 
     def get_error_history(self):
         logger.debug("get_error_history")
         val = RobotValueTypes[RobotCodes.ERROR_HISTORY]()
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.ERROR_HISTORY, val]])))
-        return self.rx()
+        return self._request([[RobotCodes.ERROR_HISTORY, val]])
 
     def get_motor_status(self, params=["error", "state", "voltage", "power"], _id=ALL_MOTOR_LOCAL_IDS):
+        return self._request_all(self._motor_status_queries(params, _id))
 
-        if not isinstance(_id, list):
-            _id = [_id]
+    def _motor_status_queries(self, params, _id):
+        ids = self._motor_ids(_id)
         if isinstance(params, str):
             params = [params]
-        code_dicts = {"error": RobotCodes.ERROR_INFORMATION,
-                      "state": RobotCodes.OPERATING_STATUS,
-                      "voltage": RobotCodes.POWER_SUPPLY_VOLTAGE,
-                      "power": RobotCodes.DRIVING_POWER}
+        code_dicts = MOTOR_STATUS_CODES
         if len(params) > 3: # 送信バイト数の上限を超えちゃうので分割して送信するための分岐
-            query = []
-            for pm in params[:3]:
-                code = code_dicts[pm]
-                val = RobotValueTypes[code](0)
-                val = self.to_bytes(val)
-                for i in _id:
-                    if i in ALL_MOTOR_LOCAL_IDS:
-                        # 最後の1バイトでIDを指定
-                        v = val[:-1] + int(i).to_bytes(1, "little")
-                        query.append([code, v])
-                    else:
-                        print("motor ID %d is not existing" % i)
-            logger.debug(self.byteList_to_string(self.tx(query)))
-            res1 = self.rx()
-
-            query = []
-            code = code_dicts[params[-1]]
-            val = RobotValueTypes[code](0)
-            val = self.to_bytes(val)
-            for i in _id:
-                if i in ALL_MOTOR_LOCAL_IDS:
-                    v = val[:-1] + int(i).to_bytes(1, "little")
-                    query.append([code, v])
-                else:
-                    print("motor ID %d is not existing" % i)
-            logger.debug(self.byteList_to_string(self.tx(query)))
-            res2 = self.rx()
-            return res1 + res2
-
-
+            groups = [params[:3], params[-1:]]
         else:
+            groups = [params]
+
+        queries = []
+        for group in groups:
             query = []
-            for pm in params:
+            for pm in group:
                 code = code_dicts[pm]
-                val = RobotValueTypes[code](0)
-                val = self.to_bytes(val)
-                for i in _id:
-                    if i in ALL_MOTOR_LOCAL_IDS:
-                        # 最後の1バイトでIDを指定
-                        v = val[:-1] + int(i).to_bytes(1, "little")
-                        query.append([code, v])
-                    else:
-                        print("motor ID %d is not existing" % i)
-            logger.debug(self.byteList_to_string(self.tx(query)))
-            return self.rx()
-
+                for i in ids:
+                    query.append([code, motor_query_value(code, i)])
+            queries.append(query)
+        return queries
+
+    def get_motor_snapshot(self, params=["error", "state", "voltage", "power"], _id=ALL_MOTOR_LOCAL_IDS):
+        """
+        Reads the status of several motors into a MOTOR_STATUS_DTYPE array, one
+        row per motor id in the order of _id. The queries are packed into as
+        few frames as possible and pipelined. Values that were not read are
+        0 (alarm, state) or NaN (voltage, power); rows missing a requested
+        value have valid == False.
+        """
+        logger.debug("get_motor_snapshot")
+        plan = self._motor_snapshot_plan(params, _id)
+        return plan.decode(self.pipeline(plan.queries, raw=True))
+
+    def get_motor_alarms(self, _id=ALL_MOTOR_LOCAL_IDS):
+        """Reads the alarm of several motors in one request and decodes them (MOTOR_ALARM_DTYPE)."""
+        logger.debug("get_motor_alarms")
+        return decode_motor_alarms(self.get_motor_snapshot(params=["error"], _id=_id))
+
+    def _motor_snapshot_plan(self, params, _id):
+        if isinstance(params, str):
+            params = [params]
+        return motor_snapshot_plan(tuple(params), tuple(self._motor_ids(_id)))
 
+    @staticmethod
+    def _motor_ids(_id):
+        if not isinstance(_id, list):
+            _id = [_id]
+        ids = []
+        for i in _id:
+            if i in ALL_MOTOR_LOCAL_IDS:
+                ids.append(i)
+            else:
+                print("motor ID %d is not existing" % i)
+        return ids
 
     def reset_error(self):
         logger.debug("reset_error")
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.ERROR_RESET, 0x01]])))
-        return self.rx()
+        return self._request([[RobotCodes.ERROR_RESET, 0x01]])
 
     def reset_origin(self):
         logger.debug("reset_origin")
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.ORIGIN_RESET, 0x01]])))
-        return self.rx()
+        return self._request([[RobotCodes.ORIGIN_RESET, 0x01]])
 
     def set_odometry(self, x, y, w):
         logger.debug("set_odometry")
         td3p = RobotValueTypes[RobotCodes.SET_POSE](x, y, w)
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.SET_POSE, td3p]])))
-        return self.rx()
+        return self._request([[RobotCodes.SET_POSE, td3p]])
 
     def operating_mode(self, param=0x03):  # no need?
         logger.debug("operating_mode")
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.OPERATING_MODE, param]])))
-        return self.rx()
+        return self._request([[RobotCodes.OPERATING_MODE, param]])
 
     def set_acceleration_time(self, param):  # read mode not implemented yet
         logger.debug("set_acceleration_time")
         td3p = RobotValueTypes[RobotCodes.ACCELERATION_TIME](
             param, param, param)
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.ACCELERATION_TIME, td3p]])))
-        return self.rx()
+        return self._request([[RobotCodes.ACCELERATION_TIME, td3p]])
 
     def set_deceleration_time(self, param):  # read mode not implemented yet
         logger.debug("set_deceleration_time")
         td3p = RobotValueTypes[RobotCodes.DECELERATION_TIME](
             param, param, param)
-        logger.debug(self.byteList_to_string(
-            self.tx([[RobotCodes.DECELERATION_TIME, td3p]])))
-        return self.rx()
+        return self._request([[RobotCodes.DECELERATION_TIME, td3p]])
 
     def set_aeb(self, param):
         logger.debug("set_aeb")
-        logger.debug(self.byteList_to_string(self.tx([[RobotCodes.AEB_MODE, param]])))
-        return self.rx()
+        return self._request([[RobotCodes.AEB_MODE, param]])
 
     def set_vel_level(self, param):
         logger.debug("set_vel_level")
-        logger.debug(self.byteList_to_string(self.tx([[RobotCodes.VEL_LEVEL, param]])))
-        return self.rx()
+        return self._request([[RobotCodes.VEL_LEVEL, param]])
 
     def set_motor_param(self, lpf=True, filter_t=1, pos_p_gain=10, speed_p_gain=100, speed_i_gain=1580, torque_filter=1000, speed_feedforward=80, stiffness=7):
         logger.debug("set_motor_param")
         #smp = RobotValueTypes[RobotCodes.SET_MOTOR_PARAMS]( lpf, filter_t, pos_p_gain, speed_p_gain, speed_i_gain )
         smp = RobotValueTypes[RobotCodes.SET_MOTOR_PARAMS]( lpf, filter_t, pos_p_gain, speed_p_gain, speed_i_gain, torque_filter, speed_feedforward, stiffness )
-        logger.debug(self.byteList_to_string(self.tx([[RobotCodes.SET_MOTOR_PARAMS, smp]])))
-        return self.rx()
+        return self._request([[RobotCodes.SET_MOTOR_PARAMS, smp]])
 
     def shift_robot_center(self, x=0.0, y=0.0, towing_wheelbase_mm=None):
         logger.debug("shift_robot_center")
@@ -783,33 +1294,35 @@ class robot:
         else:
             td3p = RobotValueTypes[RobotCodes.ROBOT_CENTER](x, y, 0.0)
         query = [[RobotCodes.ROBOT_CENTER, td3p]]
-        logger.debug(self.byteList_to_string(self.tx(query)))
-        return self.rx()
+        return self._request(query)
 
 
     def initialize_config(self):
         logger.debug("initialize_config")
         command = [ [RobotCodes.INITIALIZE_CONFIG, 0x00] ]
-        logger.debug(self.byteList_to_string(self.tx( command )))
-        return self.rx()
+        return self._request(command)
 
 
     # def set_torque(self, param):
     #    logger.debug("set_torque")
     #    code = RobotCodes.DRIVING_TORQUE
     #    val = RobotValueTypes[code](param)
-    #    logger.debug(self.byteList_to_string(self.tx([[code, val ]])))
+    #    self.tx([[code, val ]])
     #    return self.rx()[0]
 
     def set_gamepad_disable(self, param):
         logger.debug("set_gamepad_disable")
-        logger.debug(self.byteList_to_string(self.tx([[RobotCodes.DISABLE_GAMEPAD, param]])))
-        return self.rx()
+        return self._request([[RobotCodes.DISABLE_GAMEPAD, param]])
     
     def close_serial(self):
-        self._uart.close()
+        self.stop_reader()
+        self.stop_capture()
+        if self._uart is not None:
+            self._uart.close()
+            self._uart = None
 
     def __del__(self):
-        self.sleep()
+        # close_serial()の後はポートが無いのでsleep()は送らない
         if self._uart is not None:
-            self._uart.close()
+            self.sleep()
+        self.close_serial()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .codec import to_bytes
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ShadowState:
+    """
+    Last value acknowledged by the ECU for each of `codes`.
+    filter() drops the entries of a query whose value equals the shadow, and
+    acknowledge() stores the values of the remaining entries once the
+    response has arrived. observe() sees every frame that is sent: a code
+    written outside filter() (e.g. set_acceleration_time()) forgets its
+    value, and any of `reset_codes` forgets everything, because those
+    commands may change the values held by the ECU.
+    """
+
+    def __init__(self, codes, reset_codes=()):
+        self.codes = frozenset(codes)
+        self.reset_codes = frozenset(reset_codes)
+        self._values = {}
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+
+    def filter(self, query):
+        """Returns (query without redundant entries, [(code, value bytes)] to acknowledge)."""
+        out = []
+        pending = []
+        with self._lock:
+            for n, entry in enumerate(query):
+                code = entry[0]
+                # 先頭は主コマンドなので常に送る
+                if n == 0 or code not in self.codes:
+                    out.append(entry)
+                    continue
+                value = to_bytes(entry[1]) if not isinstance(entry[1], bytes) else entry[1]
+                if self._values.get(code) == value:
+                    self.dropped += 1
+                    continue
+                self.sent += 1
+                out.append(entry)
+                pending.append((code, value))
+        return out, pending
+
+    def acknowledge(self, pending, ok):
+        """Stores the pending values if the request succeeded, forgets them otherwise."""
+        with self._lock:
+            for code, value in pending:
+                if ok:
+                    self._values[code] = value
+                else:
+                    self._values.pop(code, None)
+
+    def observe(self, code_array):
+        """
+        Forgets the value of every code written by code_array, or the whole
+        shadow if it contains a reset code. Values sent through filter() are
+        stored again by acknowledge().
+        """
+        if not self._values:
+            return
+        with self._lock:
+            for entry in code_array:
+                code = entry[0] if isinstance(entry, (list, tuple)) else entry
+                if code in self.reset_codes:
+                    self._values.clear()
+                    return
+                self._values.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
@@ -0,0 +1,533 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .core_types import *
+from .robot import RobotCodes, RobotValues, RobotCodecs, RobotValueTypes, UART_BAUDRATE, UART_TIMEOUT, \
+    CONFIG_READ_BYTES
+from .framing import FRAME_HEADER, FRAME_TERMINATOR, WRONG_PACKET_FRAME
+from .capture import read_capture
+from .trace import TRACE_TX
+from .motion import predict_move_time
+import collections
+import math
+import numpy as np
+import os
+import select
+import struct
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+UART_BITS_PER_BYTE = 10  # スタートビット + 8bit + ストップビット
+
+SIM_VOLTAGE = 24.0  # [V]
+SIM_DRIVING_POWER = 5.0  # 移動中のモータ1つ当たりの消費電力 [W]
+
+# 電源投入時の設定値
+SIM_DEFAULT_CONFIG = {
+    RobotCodes.STANDARD_ACCELERATION_TIME: RobotValueTypes[RobotCodes.STANDARD_ACCELERATION_TIME](500),
+    RobotCodes.STANDARD_DECELERATION_TIME: RobotValueTypes[RobotCodes.STANDARD_DECELERATION_TIME](500),
+    RobotCodes.STANDARD_HORIZONTAL_SPEED: RobotValueTypes[RobotCodes.STANDARD_HORIZONTAL_SPEED](0.5),
+    RobotCodes.STANDARD_ROTATION_SPEED: RobotValueTypes[RobotCodes.STANDARD_ROTATION_SPEED](1.0),
+    RobotCodes.DRIVING_TORQUE: RobotValueTypes[RobotCodes.DRIVING_TORQUE](1000),
+    RobotCodes.KINEMATICS: TriOrbDriveMatrix(np.array([[3000., 6000., 650.],
+                                                       [-6000., 0., 650.],
+                                                       [3000., -6000., 650.]], dtype=np.float32)),
+    RobotCodes.KINEMATICS_TRANS: TriOrbDriveMatrix(np.identity(3, dtype=np.float32)),
+}
+
+
+def transfer_time(n_bytes, baudrate):
+    """Time to shift n_bytes through a UART at baudrate [s]. 0 if baudrate is None."""
+    if not baudrate:
+        return 0.0
+    return n_bytes * UART_BITS_PER_BYTE / baudrate
+
+
+def _state_bytes(move, in_pos, s_on, success, motor_id):
+    # TriOrbBaseStateのデコード順 (btn_y, btn_b, btn_a, btn_x, move, in_pos, s_on, success) に合わせる
+    hb = move << 4 | in_pos << 5 | s_on << 6 | success << 7
+    return struct.pack("<BBB", hb, 0, motor_id)
+
+
+class SimulatedECU:
+    """
+    Software model of the TriOrb control ECU.
+    Requests are parsed with the same frame layout robot.tx() builds, and every
+    RobotCodes entry is answered with a payload of the size of its
+    RobotValueTypes entry. Velocity (MOVING_SPEED_*) and position
+    (TARGET_POSITION_*) commands move a holonomic base whose pose is advanced
+    lazily from `clock` whenever a request arrives.
+    x, y: [m], w: [deg], angular speeds: [rad/s], times: [ms] as in robot.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rx_buffer = bytearray()
+        self.frames = 0  # 処理したリクエスト数
+        self.wrong_packets = 0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._t = self._clock()
+            self.pose = [0.0, 0.0, 0.0]
+            self.excited = False
+            self.lifter = 0
+            self.alarms = {}  # モーターID: アラームコード
+            self.config = dict(SIM_DEFAULT_CONFIG)
+            self.registers = {}  # その他の設定コマンドの最後の値
+            self._vel = None  # (vx, vy, vw, relative)
+            self._vel_until = None
+            self._target = None  # (start pose, end pose, start time, duration)
+            self._in_pos = False
+
+    @property
+    def moving(self):
+        with self._lock:
+            self._advance(self._clock())
+            return self._moving()
+
+    def _moving(self):
+        return self._target is not None or (self._vel is not None and any(self._vel[:3]))
+
+    def feed(self, data):
+        """Consumes request bytes and returns the response bytes of all complete frames."""
+        self._rx_buffer += data
+        out = bytearray()
+        while True:
+            frame, used = self._split_frame(self._rx_buffer)
+            if used == 0:
+                break
+            del self._rx_buffer[:used]
+            if frame is None:
+                self.wrong_packets += 1
+                out += WRONG_PACKET_FRAME
+            else:
+                out += self.process(frame)
+        return bytes(out)
+
+    @staticmethod
+    def _split_frame(buf):
+        """Returns (entries or None if invalid, consumed bytes). consumed is 0 if the frame is incomplete."""
+        if len(buf) == 0:
+            return None, 0
+        if buf[0:1] != FRAME_HEADER:
+            end = buf.find(FRAME_TERMINATOR)
+            return None, (0 if end < 0 else end + len(FRAME_TERMINATOR))
+        pos = len(FRAME_HEADER)
+        entries = []
+        while True:
+            if len(buf) < pos + 2:
+                return None, 0
+            if buf[pos:pos+2] == FRAME_TERMINATOR:
+                return entries, pos + 2
+            try:
+                code = RobotCodes(int.from_bytes(buf[pos:pos+2], "little"))
+            except ValueError:
+                # 値の長さが分からないので終端まで読み捨てる
+                end = buf.find(FRAME_TERMINATOR, pos)
+                return None, (0 if end < 0 else end + len(FRAME_TERMINATOR))
+            size = RobotCodecs[code].size
+            if len(buf) < pos + 2 + size:
+                return None, 0
+            entries.append((code, bytes(buf[pos+2:pos+2+size])))
+            pos += 2 + size
+
+    def process(self, entries):
+        """Executes the (code, value bytes) entries of one request and returns the response frame."""
+        if len(entries) == 0:
+            self.wrong_packets += 1
+            return WRONG_PACKET_FRAME
+        with self._lock:
+            self._advance(self._clock())
+            out = bytearray(FRAME_HEADER)
+            for code, value in entries:
+                out += code.value.to_bytes(2, "little")
+                out += self._handle(code, value)
+            out += FRAME_TERMINATOR
+            self.frames += 1
+        return bytes(out)
+
+    def _handle(self, code, value):
+        codec = RobotCodecs[code]
+        if code == RobotCodes.GET_POSE:
+            return codec.encode(TriOrbDrive3Pose(*self.pose))
+        if code == RobotCodes.OPERATING_STATUS:
+            return _state_bytes(self._moving(), self._in_pos, self.excited, 1, value[-1])
+        if code == RobotCodes.ERROR_INFORMATION:
+            return struct.pack("<BB", self.alarms.get(value[-1], 0), value[-1])
+        if code == RobotCodes.POWER_SUPPLY_VOLTAGE:
+            return codec.encode(RobotValueTypes[code](SIM_VOLTAGE))
+        if code == RobotCodes.DRIVING_POWER:
+            return codec.encode(RobotValueTypes[code](SIM_DRIVING_POWER if self._moving() else 0.0))
+        if code == RobotCodes.GET_LIFTER_POSITION:
+            return codec.encode(RobotValueTypes[code](self.lifter))
+        if code in (RobotCodes.SYSTEM_INFORMATION, RobotCodes.DEVICE_STATUS,
+                    RobotCodes.SENSOR_INFORMATION, RobotCodes.ERROR_HISTORY):
+            return codec.encode(RobotValueTypes[code]())
+
+        if code == RobotCodes.STARTUP_SUSPENSION:
+            if value[0] == RobotValues.ROBOT_STARTUP.value:
+                self.excited = True
+            elif value[0] == RobotValues.ROBOT_SUSPENSION.value:
+                self._stop()
+                self.excited = False
+            return value
+        if code == RobotCodes.ORIGIN_RESET:
+            self.pose = [0.0, 0.0, 0.0]
+            return value
+        if code == RobotCodes.SET_POSE:
+            p = codec.decode(value)
+            self.pose = [p.x, p.y, p.w]
+            return value
+        if code == RobotCodes.SET_LIFTER_MOVE:
+            self.lifter = min(max(codec.decode(value), 0), 255)
+            return value
+        if code in (RobotCodes.MOVING_SPEED_ABSOLUTE, RobotCodes.MOVING_SPEED_RELATIVE):
+            v = codec.decode(value)
+            self._set_velocity(v.x, v.y, v.w, code == RobotCodes.MOVING_SPEED_RELATIVE)
+            return value
+        if code in (RobotCodes.TARGET_POSITION_ABSOLUTE, RobotCodes.TARGET_POSITION_RELATIVE):
+            p = codec.decode(value)
+            self._set_target(p.x, p.y, p.w, code == RobotCodes.TARGET_POSITION_RELATIVE)
+            return value
+        if code == RobotCodes.MOVING_DRIVE_LIFE_TIME:
+            # 寿命は保持され, 以降の速度指令毎に計り直す
+            self.registers[code] = value
+            if self._vel is not None:
+                self._vel_until = self._life_end()
+            return value
+        if code in self.config:
+            # 読み出し指定値の場合は書き込まずに現在値を返す
+            if value != CONFIG_READ_BYTES[code]:
+                self.config[code] = codec.decode(value)
+            return codec.encode(self.config[code])
+        # その他の設定値は保存してそのまま返す
+        self.registers[code] = value
+        return value
+
+    def _register(self, code):
+        value = self.registers.get(code)
+        return None if value is None else RobotCodecs[code].decode(value)
+
+    def _stop(self):
+        self._vel = None
+        self._vel_until = None
+        self._target = None
+
+    def _set_velocity(self, vx, vy, vw, relative):
+        if not self.excited:
+            return
+        self._target = None
+        self._in_pos = False
+        self._vel = (vx, vy, vw, relative)
+        self._vel_until = self._life_end()
+
+    def _life_end(self):
+        life = self._register(RobotCodes.MOVING_DRIVE_LIFE_TIME)
+        return None if not life else self._t + life / 1000.0
+
+    def _set_target(self, x, y, w, relative):
+        if not self.excited:
+            return
+        self._vel = None
+        self._vel_until = None
+        self._in_pos = False
+        start = list(self.pose)
+        if relative:
+            # x, yは現在の向きのロボット座標系
+            th = math.radians(start[2])
+            end = [start[0] + x*math.cos(th) - y*math.sin(th),
+                   start[1] + x*math.sin(th) + y*math.cos(th),
+                   start[2] + w]
+        else:
+            end = [x, y, w]
+        self._target = (start, end, self._t, None)
+
+    def _target_duration(self, start, end):
+        # 同じフレームで速度と加減速時間が指定されるので所要時間は最初の時刻更新時に決める
+        acc = self._register(RobotCodes.ACCELERATION_TIME)
+        dec = self._register(RobotCodes.DECELERATION_TIME)
+        acc = self.config[RobotCodes.STANDARD_ACCELERATION_TIME] if acc is None else acc.v1
+        dec = self.config[RobotCodes.STANDARD_DECELERATION_TIME] if dec is None else dec.v1
+        vel_xy = self._register(RobotCodes.POSITION_DRIVE_STD_SPEED)
+        vel_w = self._register(RobotCodes.POSITION_DRIVE_ROT_SPEED)
+        vel_xy = self.config[RobotCodes.STANDARD_HORIZONTAL_SPEED] if vel_xy is None else vel_xy
+        vel_w = self.config[RobotCodes.STANDARD_ROTATION_SPEED] if vel_w is None else vel_w
+        duration = predict_move_time(end[0] - start[0], end[1] - start[1], end[2] - start[2],
+                                     float(acc), float(dec), float(vel_xy), float(vel_w))
+        return 0.0 if duration is None else duration
+
+    def _advance(self, now):
+        """Moves the model from its last update time to now."""
+        t0 = self._t
+        self._t = now
+        if now <= t0:
+            return
+        if self._target is not None:
+            start, end, st, duration = self._target
+            if duration is None:
+                duration = self._target_duration(start, end)
+                self._target = (start, end, st, duration)
+            r = 1.0 if duration <= 0.0 else min((now - st) / duration, 1.0)
+            self.pose = [s + (e - s) * r for s, e in zip(start, end)]
+            if r >= 1.0:
+                self._target = None
+                self._in_pos = True
+            return
+        if self._vel is None:
+            return
+        t1 = now
+        if self._vel_until is not None and self._vel_until < now:
+            t1 = max(self._vel_until, t0)
+            vel = self._vel
+            self._vel = None
+            self._vel_until = None
+        else:
+            vel = self._vel
+        self._integrate(vel, t1 - t0)
+
+    def _integrate(self, vel, dt):
+        vx, vy, vw, relative = vel
+        x, y, w = self.pose
+        th = math.radians(w)
+        if relative:
+            if abs(vw) > 1e-9:
+                # 一定の並進・回転速度での厳密な積分
+                dth = vw * dt
+                s = (math.sin(th + dth) - math.sin(th)) / vw
+                c = (math.cos(th + dth) - math.cos(th)) / vw
+                x += vx * s + vy * c
+                y += -vx * c + vy * s
+            else:
+                x += (vx*math.cos(th) - vy*math.sin(th)) * dt
+                y += (vx*math.sin(th) + vy*math.cos(th)) * dt
+        else:
+            x += vx * dt
+            y += vy * dt
+        self.pose = [x, y, w + math.degrees(vw * dt)]
+
+
+class SimulatedSerial:
+    """
+    pyserial-like transport connected to a SimulatedECU, to be passed as
+    robot(transport=...). A response becomes readable after the request and
+    the response have been shifted through the line at `baudrate` plus
+    `latency` [s], in the order the requests were written.
+    """
+
+    def __init__(self, ecu=None, latency=0.0, baudrate=UART_BAUDRATE, timeout=UART_TIMEOUT):
+        self.ecu = SimulatedECU() if ecu is None else ecu
+        self.latency = latency
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+        self._pending = collections.deque()  # (readable time, bytes)
+        self._buffer = bytearray()
+        self._line_free = 0.0  # 送信路が空く時刻
+        self._cv = threading.Condition()
+
+    def write(self, data):
+        if not self.is_open:
+            raise Exception("Port is closed")
+        now = time.monotonic()
+        responses = self._respond(bytes(data), now)
+        with self._cv:
+            for ready, response in responses:
+                # 応答は書き込んだ順に読める
+                if self._pending:
+                    ready = max(ready, self._pending[-1][0])
+                self._pending.append((ready, response))
+            if responses:
+                self._cv.notify_all()
+        return len(data)
+
+    def _respond(self, data, now):
+        """Returns the [(readable time, bytes)] answering the bytes written at `now`."""
+        response = self.ecu.feed(data)
+        with self._cv:
+            tx_done = max(now, self._line_free) + transfer_time(len(data), self.baudrate)
+            self._line_free = tx_done
+        if not response:
+            return []
+        return [(tx_done + self.latency + transfer_time(len(response), self.baudrate), response)]
+
+    def _collect(self, now):
+        while self._pending and self._pending[0][0] <= now:
+            self._buffer += self._pending.popleft()[1]
+
+    @property
+    def in_waiting(self):
+        with self._cv:
+            self._collect(time.monotonic())
+            return len(self._buffer)
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cv:
+            while self.is_open:
+                now = time.monotonic()
+                self._collect(now)
+                if len(self._buffer) >= size:
+                    break
+                if deadline is not None and now >= deadline:
+                    break
+                wake = self._pending[0][0] if self._pending else None
+                if deadline is not None:
+                    wake = deadline if wake is None else min(wake, deadline)
+                self._cv.wait(None if wake is None else max(wake - now, 0.0))
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def reset_input_buffer(self):
+        with self._cv:
+            self._pending.clear()
+            self._buffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._cv:
+            self.is_open = False
+            self._cv.notify_all()
+
+
+class ReplaySerial(SimulatedSerial):
+    """
+    Transport that answers with a session recorded by robot.start_capture().
+    Each write() consumes the next recorded write and releases the bytes
+    read after it, delayed as in the recording divided by `speed` (None:
+    without delay). A write that differs from the recorded one is counted
+    in `mismatches`.
+    """
+
+    def __init__(self, path, speed=1.0, timeout=UART_TIMEOUT):
+        # 応答は記録から返すのでECUは持たない
+        super().__init__(ecu=False, timeout=timeout)
+        self.ecu = None
+        self.speed = speed
+        self.mismatches = 0
+        _started, records = read_capture(path)
+        # 書き込みごとに, 次の書き込みまでに読んだバイト列を(書き込みからの遅れ, バイト列)で持つ
+        self._exchanges = collections.deque()
+        for stamp, direction, data in records:
+            if direction == TRACE_TX:
+                self._exchanges.append((data, stamp, []))
+            elif self._exchanges:
+                _data, tx_stamp, responses = self._exchanges[-1]
+                responses.append((stamp - tx_stamp, data))
+            else:
+                self._buffer += data  # 記録開始前から届いていたバイト列
+
+    @property
+    def remaining(self):
+        """Number of recorded writes not replayed yet."""
+        return len(self._exchanges)
+
+    def _respond(self, data, now):
+        with self._cv:
+            if not self._exchanges:
+                logger.warning("Replay has no more recorded frames")
+                return []
+            recorded, _stamp, responses = self._exchanges.popleft()
+            if recorded != data:
+                self.mismatches += 1
+                logger.debug("Replay mismatch: recorded {} written {}".format(recorded, data))
+        return [(now if not self.speed else now + delay / self.speed, response)
+                for delay, response in responses]
+
+
+class PtyECU:
+    """
+    Serves a SimulatedECU on a pseudo terminal (POSIX only), so that
+    robot(port=PtyECU(...).port) talks to it through a real serial device.
+    """
+
+    def __init__(self, ecu=None, latency=0.0, baudrate=UART_BAUDRATE):
+        import tty
+        self.ecu = SimulatedECU() if ecu is None else ecu
+        self.latency = latency
+        self.baudrate = baudrate
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="triorb-sim-pty", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _run(self):
+        pending = collections.deque()
+        line_free = 0.0
+        while self._running:
+            now = time.monotonic()
+            while pending and pending[0][0] <= now:
+                os.write(self._master, pending.popleft()[1])
+            timeout = 0.05 if not pending else max(pending[0][0] - now, 0.0)
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            now = time.monotonic()
+            line_free = max(now, line_free) + transfer_time(len(data), self.baudrate)
+            response = self.ecu.feed(data)
+            if response:
+                ready = line_free + self.latency + transfer_time(len(response), self.baudrate)
+                if pending:
+                    ready = max(ready, pending[-1][0])
+                pending.append((ready, response))
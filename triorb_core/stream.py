@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+VEL_STREAM_RATE = 20.0  # 最大送信周期 [Hz]
+VEL_STREAM_LIFE_TIME = 500  # 指令の寿命 [ms]. 送信が途絶えたらこの時間で停止する
+
+
+def send_velocity(robot, vx, vy, vw, relative=True, **kwargs):
+    """
+    Sends one velocity command of a sender thread with set_vel_relative()
+    (set_vel_absolute() if relative is False). Returns True if it was
+    answered. Failures are logged instead of raised, so the sender keeps running.
+    """
+    try:
+        if relative:
+            res = robot.set_vel_relative(vx, vy, vw, **kwargs)
+        else:
+            res = robot.set_vel_absolute(vx, vy, vw, **kwargs)
+    except Exception as e:
+        logger.error("velocity command failed: {}".format(e))
+        return False
+    if not isinstance(res, list):
+        # タイムアウト(b"")や不正パケットの応答
+        logger.error("velocity command got no response: {}".format(res))
+        return False
+    return True
+
+
+class VelocityStream:
+    """
+    Latest-wins velocity command channel.
+    Producers call post() at any rate; a sender thread transmits only the most
+    recent velocity, at most `rate` times per second. Every command carries
+    `life_time` [ms], so the robot stops by itself if the stream stalls.
+    A velocity that is replaced before it could be sent is counted in `dropped`.
+    """
+
+    def __init__(self, robot, rate=VEL_STREAM_RATE, life_time=VEL_STREAM_LIFE_TIME, relative=True,
+                 acc=None, dec=None):
+        self.robot = robot
+        self.period = 1.0 / rate
+        self.life_time = life_time
+        self.relative = relative
+        self.acc = acc
+        self.dec = dec
+        self.posted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latency = None  # 最後に送った指令のpost()から応答までの時間 [s]
+        self._latest = None  # (vx, vy, vw, post time)
+        self._cv = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """Starts the sender thread, and the background reader of the robot."""
+        if self._running:
+            return
+        # 呼び出し側のスレッドと同時に送受信するので受信はリーダーに任せる
+        self.robot.start_reader()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="triorb-vel-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self, brake=True, timeout=1.0):
+        """Stops the sender thread. Sends brake() afterwards if brake is True."""
+        with self._cv:
+            self._running = False
+            self._latest = None
+            self._cv.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if brake:
+            self.robot.brake()
+
+    def post(self, vx, vy, vw):
+        """Sets the velocity to be sent next. Never blocks on the serial port."""
+        with self._cv:
+            if self._latest is not None:
+                self.dropped += 1
+            self._latest = (vx, vy, vw, time.monotonic())
+            self.posted += 1
+            self._cv.notify()
+
+    def _run(self):
+        next_t = 0.0
+        while True:
+            with self._cv:
+                while self._running and self._latest is None:
+                    self._cv.wait()
+                if not self._running:
+                    return
+            # 送信周期の上限を守る. 待っている間に届いた値は上書きされる
+            delay = next_t - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._cv:
+                if not self._running or self._latest is None:
+                    continue
+                vx, vy, vw, posted_at = self._latest
+                self._latest = None
+            next_t = time.monotonic() + self.period
+            self._send(vx, vy, vw, posted_at)
+
+    def _send(self, vx, vy, vw, posted_at):
+        if not send_velocity(self.robot, vx, vy, vw, self.relative,
+                             acc=self.acc, dec=self.dec, life_time=self.life_time):
+            self.errors += 1
+            return
+        self.sent += 1
+        self.latency = time.monotonic() - posted_at
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from .robot import RobotCodes, RobotValueTypes, DRIVE_MOTOR_LOCAL_IDS, MAX_PACKET_SIZE, motor_query_value
+from .framing import ReadPlan
+import threading
+import time
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+TELEMETRY_CODES = (
+    RobotCodes.GET_POSE,
+    RobotCodes.OPERATING_STATUS,
+    RobotCodes.POWER_SUPPLY_VOLTAGE,
+    RobotCodes.DRIVING_POWER,
+    RobotCodes.GET_LIFTER_POSITION,
+)
+
+# code: (field name, dtype, shape of one value, per motor)
+TELEMETRY_FIELDS = {
+    RobotCodes.GET_POSE: ("pose", "<f4", (3,), False),
+    RobotCodes.OPERATING_STATUS: ("state", "u1", (2,), True),  # 状態ビットの生データ2バイト
+    RobotCodes.POWER_SUPPLY_VOLTAGE: ("voltage", "<f4", (), True),
+    RobotCodes.DRIVING_POWER: ("power", "<f4", (), True),
+    RobotCodes.GET_LIFTER_POSITION: ("lifter", "u1", (), False),
+}
+
+
+class Telemetry:
+    """
+    Polls a fixed set of codes at a fixed rate in a background thread and
+    stores timestamped samples in a preallocated NumPy ring buffer.
+    Responses are decoded straight from the raw frames into the buffer, and
+    readers (latest(), window()) never touch the serial port.
+    The robot's background reader is started so that the port can be shared
+    with other callers.
+    """
+
+    def __init__(self, robot, codes=TELEMETRY_CODES, rate=10.0, capacity=1024,
+                 motor_ids=DRIVE_MOTOR_LOCAL_IDS, max_packet_size=MAX_PACKET_SIZE):
+        self.robot = robot
+        self.codes = tuple(codes)
+        self.period = 1.0 / rate
+        self.motor_ids = list(motor_ids)
+        n_motors = len(self.motor_ids)
+
+        fields = [("t", "<f8"), ("ok", "?")]
+        entries = []
+        self._fields = []  # (field, エントリ番号, dtype, 1エントリの値の数)
+        for code in self.codes:
+            name, dtype, shape, per_motor = TELEMETRY_FIELDS[code]
+            count = int(np.prod(shape, dtype=int))
+            if per_motor:
+                fields.append((name, dtype, (n_motors,) + shape))
+                index = np.arange(len(entries), len(entries) + n_motors)
+                entries += [[code, motor_query_value(code, i)] for i in self.motor_ids]
+            else:
+                fields.append((name, dtype, shape))
+                index = np.array([len(entries)])
+                entries.append([code, self.robot.to_bytes(RobotValueTypes[code]())])
+            self._fields.append((name, index, dtype, count))
+        self.dtype = np.dtype(fields)
+        self._plan = ReadPlan(entries, max_packet_size)
+
+        self._buffer = np.zeros(capacity, dtype=self.dtype)
+        self._capacity = capacity
+        self._count = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    @property
+    def frames_per_sample(self):
+        return len(self._plan.queries)
+
+    @property
+    def count(self):
+        """Total number of samples taken (may exceed the buffer capacity)."""
+        return self._count
+
+    def start(self):
+        if self._running:
+            return
+        self.robot.start_reader()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="triorb-telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        next_t = time.monotonic()
+        while self._running:
+            try:
+                self.sample()
+            except Exception as e:
+                self.errors += 1
+                logger.error("telemetry sample failed: {}".format(e))
+            next_t += self.period
+            delay = next_t - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_t = time.monotonic()  # 周期に間に合わない場合は遅れを持ち越さない
+
+    def sample(self):
+        """Polls all codes once and appends the sample to the buffer. Returns the sample."""
+        t = time.monotonic()
+        buf, ok = self._plan.read(self.robot.pipeline(self._plan.queries, raw=True))
+        record = np.zeros((), dtype=self.dtype)
+        record["t"] = t
+        for name, index, dtype, count in self._fields:
+            values = self._plan.values(buf, index, dtype, count)
+            values[~ok[index]] = np.nan if np.dtype(dtype).kind == "f" else 0
+            record[name] = values.reshape(record[name].shape)
+        record["ok"] = ok.all()
+        if not record["ok"]:
+            self.errors += 1
+        with self._lock:
+            self._buffer[self._count % self._capacity] = record
+            self._count += 1
+        return record
+
+    def latest(self):
+        """Returns the newest sample (a copy) or None."""
+        with self._lock:
+            if self._count == 0:
+                return None
+            return self._buffer[(self._count - 1) % self._capacity].copy()
+
+    def window(self, n=None, since=None):
+        """
+        Returns the buffered samples in chronological order (a copy).
+        n: only the newest n samples, since: only samples with t >= since (time.monotonic()).
+        """
+        with self._lock:
+            size = min(self._count, self._capacity)
+            if n is not None:
+                size = min(size, n)
+            end = self._count % self._capacity
+            idx = (np.arange(end - size, end)) % self._capacity
+            samples = self._buffer[idx]
+        if since is not None:
+            samples = samples[samples["t"] >= since]
+        return samples
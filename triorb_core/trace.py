@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import collections
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+TRACE_TX = "tx"
+TRACE_RX = "rx"
+
+
+def hex_string(arr):
+    return ' '.join(['0x{:02x}'.format(_b) for _b in arr])
+
+
+class PacketTracer:
+    """
+    Traces raw frames passing through robot.tx()/rx().
+    Frames are formatted only when DEBUG is enabled on the logger. When
+    `history` > 0 the last `history` frames are kept with monotonic
+    timestamps so they can be dumped after a failure.
+    """
+
+    def __init__(self, history=0, log=logger):
+        self._log = log
+        self._frames = None
+        self.set_history(history)
+
+    @property
+    def history(self):
+        return 0 if self._frames is None else self._frames.maxlen
+
+    def set_history(self, history):
+        if history > 0:
+            self._frames = collections.deque(self._frames or (), maxlen=history)
+        else:
+            self._frames = None
+
+    def tx(self, frame):
+        self._trace(TRACE_TX, "Send", frame)
+
+    def rx(self, frame):
+        self._trace(TRACE_RX, "Response", frame)
+
+    def _trace(self, direction, label, frame):
+        if self._frames is not None:
+            self._frames.append((time.monotonic(), direction, bytes(frame)))
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("{}: {}".format(label, hex_string(frame)))
+
+    def frames(self):
+        """Returns the recorded frames as a list of (monotonic time, "tx"/"rx", bytes)."""
+        return [] if self._frames is None else list(self._frames)
+
+    def clear(self):
+        if self._frames is not None:
+            self._frames.clear()
+
+    def dump(self):
+        """Formats the recorded frames, oldest first, relative to the newest one."""
+        frames = self.frames()
+        if not frames:
+            return ""
+        last = frames[-1][0]
+        return "\n".join(["{:+.4f} {} {}".format(stamp - last, direction, hex_string(frame))
+                          for stamp, direction, frame in frames])
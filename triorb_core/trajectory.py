@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 TriOrb Co. Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# 姿勢は robot と同じく x, y: [m], w: [deg]
+# 速度指令は set_vel_* と同じく vx, vy: [m/s], vw: [rad/s], acc/dec: [ms]
+
+from .motion import trapezoid_time
+from .odometry import relative, unwrap_deg
+from .stream import send_velocity
+import threading
+import time
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+TRAJECTORY_RATE = 20.0  # 速度指令の送信周期 [Hz]
+TRAJECTORY_LIFE_TIME = 200  # 指令の寿命 [ms]. 送信が途絶えたらこの時間で停止する
+TRAJECTORY_VEL_XY = 0.3  # [m/s]
+TRAJECTORY_VEL_W = 0.5  # [rad/s]
+TRAJECTORY_ACC = 500  # [ms]
+TRAJECTORY_DEC = 500  # [ms]
+TRAJECTORY_SHAPES = ("trapezoid", "scurve")
+
+TRAJECTORY_DTYPE = np.dtype([
+    ("t", "<f8"),
+    ("pose", "<f8", (3,)),  # x, y, w [m, m, deg]
+    ("vel", "<f8", (3,)),  # 原点座標系の速度 vx, vy, vw [m/s, m/s, rad/s]
+    ("vel_body", "<f8", (3,)),  # 機体座標系の速度
+])
+
+
+def _ramp(x, shape):
+    """Speed ratio (0-1) over a ramp and its integral, at x = 0-1 of the ramp."""
+    if shape == "scurve":
+        return 3 * x**2 - 2 * x**3, x**3 - x**4 / 2
+    return x, x**2 / 2
+
+
+class Trajectory:
+    """
+    Time-parameterized path through SE(2) waypoints.
+    Every segment is traversed at the highest speed that keeps both vel_xy
+    and vel_w, and one velocity profile (trapezoidal, or S-shaped ramps with
+    shape="scurve") runs over the whole path, so the robot only stops at
+    the last waypoint. The heading is interpolated along each segment.
+    """
+
+    def __init__(self, waypoints, vel_xy=TRAJECTORY_VEL_XY, vel_w=TRAJECTORY_VEL_W,
+                 acc=TRAJECTORY_ACC, dec=TRAJECTORY_DEC, shape="trapezoid"):
+        if shape not in TRAJECTORY_SHAPES:
+            raise Exception("Unknown profile shape: {}".format(shape))
+        points = np.array(waypoints, dtype=np.float64).reshape(-1, 3)
+        if len(points) < 2:
+            raise Exception("A trajectory needs at least two waypoints")
+        if vel_xy <= 0 or vel_w <= 0:
+            raise Exception("vel_xy and vel_w must be positive")
+        points[:, 2] = unwrap_deg(points[:, 2])
+        self.vel_xy = vel_xy
+        self.vel_w = vel_w
+        self.acc = acc
+        self.dec = dec
+        self.shape = shape
+
+        # 各区間を最高速度で進む時間を経路のパラメータuにする. du/dt = 0-1
+        delta = np.diff(points, axis=0)
+        du = np.maximum(np.hypot(delta[:, 0], delta[:, 1]) / vel_xy, np.abs(np.radians(delta[:, 2])) / vel_w)
+        keep = du > 0
+        if not keep.any():
+            raise Exception("The waypoints do not move")
+        self.waypoints = np.vstack((points[:1], points[1:][keep]))
+        self._du = du[keep]
+        self._u = np.concatenate(([0.0], np.cumsum(self._du)))
+        self._slope = np.diff(self.waypoints, axis=0) / np.maximum(self._du, 1e-12)[:, None]
+        self._slope[:, 2] = np.radians(self._slope[:, 2])
+        self.length = self._u[-1]
+
+        acc_time = acc / 1000.0
+        dec_time = dec / 1000.0
+        self.duration = trapezoid_time(self.length, 1.0, acc_time, dec_time)
+        ramp = (acc_time + dec_time) / 2.0
+        # 最高速度に達しない場合はpeak < 1の三角形(S字)プロファイル
+        self._peak = 1.0 if self.length >= ramp else np.sqrt(self.length / ramp)
+        self._t_acc = self._peak * acc_time
+        self._t_dec = self._peak * dec_time
+
+    @classmethod
+    def from_spline(cls, spline, samples=200, **kwargs):
+        """
+        Builds a trajectory from a callable spline(s) returning (len(s), 3)
+        poses for s = 0-1 (e.g. scipy.interpolate.CubicSpline), evaluated at `samples` points.
+        """
+        return cls(spline(np.linspace(0.0, 1.0, samples)), **kwargs)
+
+    def _progress(self, t):
+        # (経路パラメータ u, 速度比 du/dt)
+        t = np.clip(np.asarray(t, dtype=np.float64), 0.0, self.duration)
+        p, ta, td, T = self._peak, self._t_acc, self._t_dec, self.duration
+        x_acc = t / ta if ta > 0 else np.ones_like(t)
+        x_dec = (T - t) / td if td > 0 else np.ones_like(t)
+        f_acc, F_acc = _ramp(np.clip(x_acc, 0.0, 1.0), self.shape)
+        f_dec, F_dec = _ramp(np.clip(x_dec, 0.0, 1.0), self.shape)
+        in_acc = t < ta
+        in_dec = t > T - td
+        ratio = np.where(in_acc, p * f_acc, np.where(in_dec, p * f_dec, p))
+        u = np.where(in_acc, p * ta * F_acc,
+                     np.where(in_dec, self.length - p * td * F_dec, p * ta / 2.0 + p * (t - ta)))
+        return np.clip(u, 0.0, self.length), ratio
+
+    def at(self, t):
+        """Poses (..., 3) and world-frame velocities (..., 3) at times t [s] from the start."""
+        u, ratio = self._progress(t)
+        pose = np.empty(u.shape + (3,))
+        for k in range(3):
+            pose[..., k] = np.interp(u, self._u, self.waypoints[:, k])
+        segment = np.clip(np.searchsorted(self._u, u, side="right") - 1, 0, len(self._du) - 1)
+        vel = self._slope[segment] * ratio[..., None]
+        return pose, vel
+
+    def sample(self, rate=TRAJECTORY_RATE):
+        """
+        Evaluates the trajectory every 1/rate [s] up to and including its end.
+        Returns a TRAJECTORY_DTYPE array; vel_body is rotated by the heading
+        at the middle of each period, as it is held for one period.
+        """
+        n = int(np.floor(self.duration * rate)) + 1
+        t = np.arange(n) / rate
+        if t[-1] < self.duration:
+            t = np.append(t, self.duration)
+        out = np.zeros(len(t), dtype=TRAJECTORY_DTYPE)
+        out["t"] = t
+        out["pose"], out["vel"] = self.at(t)
+        mid, _vel = self.at(t + 0.5 / rate)
+        th = np.radians(mid[:, 2])
+        c, s = np.cos(th), np.sin(th)
+        out["vel_body"][:, 0] = c * out["vel"][:, 0] + s * out["vel"][:, 1]
+        out["vel_body"][:, 1] = -s * out["vel"][:, 0] + c * out["vel"][:, 1]
+        out["vel_body"][:, 2] = out["vel"][:, 2]
+        return out
+
+
+class TrajectoryExecutor:
+    """
+    Streams a Trajectory as velocity commands from a thread at a fixed `rate`.
+    Commands are sent with set_vel_relative() (set_vel_absolute() if relative
+    is False), each with `life_time` [ms], so the robot stops by itself if
+    the host stalls. Periods that were missed are skipped, not sent late.
+    With feedback=True the pose is read every period and the error to the
+    planned pose is added as a proportional correction (gain [1/s]).
+    With a Kinematics, the profile is checked against its limits before
+    start() and corrected commands are scaled into them.
+    """
+
+    def __init__(self, robot, trajectory, rate=TRAJECTORY_RATE, life_time=TRAJECTORY_LIFE_TIME, relative=True,
+                 feedback=False, gain_xy=1.0, gain_w=1.0, kinematics=None):
+        self.robot = robot
+        self.trajectory = trajectory
+        self.rate = rate
+        self.life_time = life_time
+        self.relative = relative
+        self.feedback = feedback
+        self.gain = np.array([gain_xy, gain_xy, gain_w])
+        self.kinematics = kinematics
+        self.samples = trajectory.sample(rate)
+        self.sent = 0
+        self.skipped = 0
+        self.errors = 0
+        self.error = None  # 最後に読んだ姿勢の計画からの偏差 (機体座標系) [m, m, deg]
+        self.finished = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def commands(self):
+        """Planned velocity commands (N, 3) as they are sent without feedback."""
+        return self.samples["vel_body" if self.relative else "vel"]
+
+    def start(self):
+        """Starts streaming the trajectory. The background reader of the robot is started as well."""
+        if self.running:
+            return
+        if self.kinematics is not None:
+            self.kinematics.check_profile(self.commands())
+        self.robot.start_reader()
+        self._stop.clear()
+        self.finished = False
+        self._thread = threading.Thread(target=self._run, name="triorb-trajectory", daemon=True)
+        self._thread.start()
+
+    def stop(self, brake=True, timeout=1.0):
+        """Stops the sender thread. Sends brake() afterwards if brake is True."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if brake:
+            self.robot.brake()
+
+    def join(self, timeout=None):
+        """Waits until the trajectory has been streamed. Returns True if it reached the end."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.finished
+
+    def _run(self):
+        period = 1.0 / self.rate
+        t0 = time.monotonic()
+        k = 0
+        while k < len(self.samples):
+            # 絶対時刻で待つので周期がずれていかない
+            if self._stop.wait(max(t0 + k * period - time.monotonic(), 0.0)):
+                return
+            late = int((time.monotonic() - t0) * self.rate)
+            if late > k:
+                self.skipped += min(late, len(self.samples) - 1) - k
+                k = min(late, len(self.samples) - 1)
+            self._send(self._command(self.samples[k]))
+            k += 1
+        self.finished = True
+        self.robot.brake()
+
+    def _command(self, sample):
+        if not self.feedback:
+            return sample["vel_body"] if self.relative else sample["vel"]
+        pose = self._read_pose()
+        if pose is None:
+            return sample["vel_body"] if self.relative else sample["vel"]
+        # 計画した姿勢の, 現在の姿勢から見た偏差
+        error = relative(pose, sample["pose"])
+        error[2] = (error[2] + 180.0) % 360.0 - 180.0
+        self.error = error
+        correction = self.gain * np.array([error[0], error[1], np.radians(error[2])])
+        th = np.radians(pose[2])
+        c, s = np.cos(th), np.sin(th)
+        vel = sample["vel"]
+        if self.relative:
+            command = np.array([c * vel[0] + s * vel[1], -s * vel[0] + c * vel[1], vel[2]]) + correction
+        else:
+            command = vel + np.array([c * correction[0] - s * correction[1],
+                                      s * correction[0] + c * correction[1], correction[2]])
+        if self.kinematics is not None:
+            command = self.kinematics.scale_to_limits(command)
+        return command
+
+    def _read_pose(self):
+        try:
+            values = self.robot.get_pos()
+        except Exception as e:
+            logger.error("trajectory pose read failed: {}".format(e))
+            return None
+        if not isinstance(values, list) or len(values) == 0:
+            return None
+        p = values[0]
+        return np.array([p.x, p.y, p.w], dtype=np.float64)
+
+    def _send(self, command):
+        vx, vy, vw = (float(v) for v in command)
+        if not send_velocity(self.robot, vx, vy, vw, self.relative, life_time=self.life_time):
+            self.errors += 1
+            return
+        self.sent += 1